@@ -31,6 +31,7 @@ CREATE TABLE `power_generation` (
   `Derived_From_Sensor` int DEFAULT NULL,
   PRIMARY KEY (`Generation_ID`),
   KEY `Project_ID` (`Project_ID`),
+  UNIQUE KEY `idx_project_interval_time` (`Project_ID`,`Aggregation_Interval`,`Timestamp`),
   KEY `Derived_From_Sensor` (`Derived_From_Sensor`),
   CONSTRAINT `power_generation_ibfk_1` FOREIGN KEY (`Project_ID`) REFERENCES `projects` (`Project_ID`),
   CONSTRAINT `power_generation_ibfk_2` FOREIGN KEY (`Derived_From_Sensor`) REFERENCES `sensors` (`Sensor_ID`)
@@ -82,14 +83,13 @@ DROP TABLE IF EXISTS `sensor_data`;
 /*!40101 SET @saved_cs_client     = @@character_set_client */;
 /*!50503 SET character_set_client = utf8mb4 */;
 CREATE TABLE `sensor_data` (
-  `Data_ID` bigint NOT NULL AUTO_INCREMENT,
   `Sensor_ID` int NOT NULL,
   `Timestamp` timestamp NOT NULL,
   `Value` float NOT NULL,
-  PRIMARY KEY (`Data_ID`),
-  KEY `idx_sensor_time` (`Sensor_ID`,`Timestamp`),
-  CONSTRAINT `sensor_data_ibfk_1` FOREIGN KEY (`Sensor_ID`) REFERENCES `sensors` (`Sensor_ID`) ON DELETE CASCADE
-) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+  PRIMARY KEY (`Sensor_ID`,`Timestamp`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci
+/*!50100 PARTITION BY RANGE (unix_timestamp(`Timestamp`))
+(PARTITION p_future VALUES LESS THAN MAXVALUE ENGINE = InnoDB) */;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
 --
@@ -116,7 +116,7 @@ CREATE TABLE `sensors` (
   `Unit` varchar(50) NOT NULL,
   `Created_At` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
   PRIMARY KEY (`Sensor_ID`),
-  KEY `Project_ID` (`Project_ID`),
+  UNIQUE KEY `idx_project_sensor_code` (`Project_ID`,`Sensor_Code`),
   CONSTRAINT `sensors_ibfk_1` FOREIGN KEY (`Project_ID`) REFERENCES `projects` (`Project_ID`) ON DELETE CASCADE
 ) ENGINE=InnoDB AUTO_INCREMENT=17 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
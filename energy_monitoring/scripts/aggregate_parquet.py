@@ -1,20 +1,49 @@
-import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import os
 from datetime import datetime, timedelta
 from pathlib import Path
 import logging
 
+try:
+    from scripts import archive, metrics, profiling, segment_log, sketches, validation, wide_tables
+except ImportError:  # executed directly as scripts/<name>.py
+    import archive
+    import metrics
+    import profiling
+    import segment_log
+    import sketches
+    import validation
+    import wide_tables
+
 """
 aggregate_parquet.py
 
-This script scans the raw CSV data generated over the last 30 minutes and aggregates
-it into a single Parquet file for compressed archival and efficient downstream processing.
+This script collects the raw readings written since the last run and aggregates
+them into the partitioned Parquet archive for compressed archival and efficient
+downstream processing.
 
-- Reads raw CSV files from the data/raw/YYYY-MM-DD/ directory
-- Filters only those CSVs created within the last 30 minutes
-- Concatenates them into a single DataFrame
-- Saves the DataFrame to data/processed/YYYY-MM-DD_HH-MM.parquet
-- Deletes the original CSVs once the parquet is successfully written
+- Reads every sealed segment of the raw segment log (data/raw/segments/) through
+  a memory map, as Arrow record batches with no CSV parsing
+- Also picks up legacy raw CSV files in data/raw/YYYY-MM-DD/ created within the
+  last 30 minutes, read with pyarrow's multithreaded CSV reader against an
+  explicit schema (repeated strings dictionary-encoded, no type inference)
+- Validates every table with whole-column checks (validation.py): missing or
+  future timestamps, NaN values, values outside the per-sensor-type limits in
+  config/validation_limits.json and non-monotonic timestamps per sensor are
+  routed to data/quarantine/<run file name> with a reason code
+- Streams the clean data into one file per (date, project) partition,
+  data/processed/date=YYYY-MM-DD/project=<id>/YYYY-MM-DD_HH-MM-SS_<run id>.parquet
+  (see archive.py), one sorted row group at a time, so peak memory stays flat
+  however many raw files are in the window. The run id keeps a manual run
+  from replacing the files of a scheduled run in the same minute
+- Maintains hourly quantile sketches of voltage, current and wind speed per
+  sensor while streaming, stored in the partition's _sketches/ directory
+  (see sketches.py)
+- Pivots the same rows into the per-project wide tables (one column per
+  sensor, one row per sample interval) in data/wide/ and queues them for the
+  SQL sync done by upload_to_sql.py (see wide_tables.py)
+- Deletes the consumed segments and CSVs once the parquet is successfully written
 
 Designed for low-power Raspberry Pi environments running scheduled tasks (via cron).
 """
@@ -40,36 +69,61 @@ def log_error(msg): logging.error(msg)
 # Paths and Constants
 # ---------------------------
 RAW_DIR = Path(__file__).parent.parent / "data" / "raw"
+SEGMENT_DIR = RAW_DIR / "segments"
 PROCESSED_DIR = Path(__file__).parent.parent / "data" / "processed"
 PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 
+# Rows buffered before a row group is written
+ROW_GROUP_ROWS = archive.ROW_GROUP_ROWS
+
+CSV_READ_OPTIONS = pa_csv.ReadOptions(use_threads=True)
+CSV_CONVERT_OPTIONS = pa_csv.ConvertOptions(
+    column_types=segment_log.RAW_SCHEMA,
+    include_columns=segment_log.RAW_SCHEMA.names
+)
+
 # ---------------------------
-# Main Function
+# Raw Data Readers
 # ---------------------------
-def aggregate_recent_csv():
+def iter_sealed_segments():
     """
-    Aggregate all CSV files from the last 30 minutes into a Parquet file.
+    Yield (table, path) for every sealed raw segment, oldest first.
 
-    This function:
-    - Scans today's raw data directory
-    - Filters CSV files created within the last 30 minutes (based on filename timestamps)
-    - Reads and concatenates their contents
-    - Saves a Parquet file in data/processed/
-    - Deletes the original raw CSVs that were included in the aggregation
+    Any open segment left behind by a stopped writer is sealed first. The
+    table is backed by the memory-mapped segment and is None for an empty
+    segment.
     """
-    now = datetime.utcnow()
-    start_time = now - timedelta(minutes=30)
+    if not SEGMENT_DIR.exists():
+        return
+
+    sealed = segment_log.seal_stale_segments(SEGMENT_DIR)
+    if sealed:
+        log(f"Sealed {sealed} stale open segment(s).")
+
+    for segment in segment_log.list_sealed_segments(SEGMENT_DIR):
+        try:
+            batches = segment_log.read_segment(segment)
+        except Exception as e:
+            log_error(f"Failed to read {segment}: {e}")
+            continue
+        metrics.BYTES.inc(segment.stat().st_size, stage="aggregate_recent_csv")
+        table = pa.Table.from_batches(batches, schema=segment_log.RAW_SCHEMA) if batches else None
+        yield table, segment
+
+def iter_recent_csvs(now):
+    """
+    Yield (table, path) for legacy raw CSVs in today's directory from the last 30 minutes.
+
+    Files are parsed with pyarrow's multithreaded reader straight into the raw
+    schema: timestamps as timestamp[s, UTC], repeated strings dictionary-encoded.
+    """
+    start_time = now - timedelta(seconds=segment_log.LEGACY_CSV_WINDOW)
     today_dir = RAW_DIR / now.strftime("%Y-%m-%d")
 
     if not today_dir.exists():
-        log("No raw data directory for today.")
         return
 
-    csv_files = sorted(today_dir.glob("*.csv"))
-    used_files = []
-    dfs = []
-
-    for file in csv_files:
+    for file in sorted(today_dir.glob("*.csv")):
         try:
             file_time = datetime.strptime(file.stem, "%H-%M-%S")
             file_datetime = datetime.combine(now.date(), file_time.time())
@@ -79,26 +133,128 @@ def aggregate_recent_csv():
 
         if start_time <= file_datetime <= now:
             try:
-                df = pd.read_csv(file)
-                dfs.append(df)
-                used_files.append(file)
+                table = pa_csv.read_csv(
+                    file, read_options=CSV_READ_OPTIONS, convert_options=CSV_CONVERT_OPTIONS
+                )
             except Exception as e:
                 log_error(f"Failed to read {file}: {e}")
+                continue
+            metrics.BYTES.inc(file.stat().st_size, stage="aggregate_recent_csv")
+            yield table, file
 
-    if not dfs:
-        log("No CSVs to aggregate for this interval.")
-        return
+# ---------------------------
+# Main Function
+# ---------------------------
+@profiling.profiled("aggregate_recent_csv")
+@metrics.timed("aggregate_recent_csv")
+def aggregate_recent_csv():
+    """
+    Aggregate all raw data written since the last run into a Parquet file.
+
+    This function:
+    - Reads every sealed segment of the raw segment log
+    - Reads legacy CSV files from today's raw directory created within the last 30 minutes
+    - Streams their contents into per-(date, project) Parquet files in
+      data/processed/, written to temporary names and renamed once complete
+    - Deletes the segments and CSVs that were included in the aggregation
+    """
+    now = datetime.utcnow()
+    file_name = archive.run_file_name(now)
+
+    used_files = []
+    buffered, buffered_rows, total_rows = [], 0, 0
+    limits = validation.load_limits()
+    last_seen = {}  # (project, sensor) -> newest timestamp validated in this run
+    quarantined = []
+    writers = {}    # (date, project) -> (ParquetWriter, final path)
+    partition_sketches = {}    # (date, project) -> {(sensor_id, hour): QuantileSketch}
+    wide = wide_tables.WideBuffer()
+
+    def flush():
+        nonlocal buffered, buffered_rows
+        if not buffered:
+            return
+        with profiling.span("aggregate_recent_csv", "transform"):
+            parts = archive.split_by_partition(pa.concat_tables(buffered))
+        for (date_str, project), part in parts.items():
+            if (date_str, project) not in writers:
+                path = archive.partition_dir(PROCESSED_DIR, date_str, project) / file_name
+                path.parent.mkdir(parents=True, exist_ok=True)
+                writers[(date_str, project)] = (
+                    archive.new_writer(archive.temp_path(path), segment_log.RAW_SCHEMA), path
+                )
+            with profiling.span("aggregate_recent_csv", "transform"):
+                part = archive.sort_readings(part)
+                sketches.build_sketches(part, partition_sketches.setdefault((date_str, project), {}))
+                wide.add(part)
+            with profiling.span("aggregate_recent_csv", "write"):
+                writers[(date_str, project)][0].write_table(part, row_group_size=ROW_GROUP_ROWS)
+        buffered, buffered_rows = [], 0
 
-    aggregated_df = pd.concat(dfs, ignore_index=True)
-    parquet_file = PROCESSED_DIR / f"{now.strftime('%Y-%m-%d_%H-%M')}.parquet"
     try:
-        aggregated_df.to_parquet(parquet_file, index=False)
-        log(f"Saved aggregated parquet: {parquet_file.name}")
+        sources = [iter_sealed_segments(), iter_recent_csvs(now)]
+        items = (item for source in sources for item in source)
+        for table, path in profiling.timed_iter("aggregate_recent_csv", "read", items):
+            used_files.append(path)
+            if table is None or table.num_rows == 0:
+                continue
+            with profiling.span("aggregate_recent_csv", "transform"):
+                table, rejected = validation.validate(table, limits, now, last_seen)
+            if rejected is not None:
+                quarantined.append(rejected)
+            if table.num_rows == 0:
+                continue
+            buffered.append(table)
+            buffered_rows += table.num_rows
+            total_rows += table.num_rows
+            if buffered_rows >= ROW_GROUP_ROWS:
+                flush()
+        flush()
+        with profiling.span("aggregate_recent_csv", "write"):
+            for writer, _ in writers.values():
+                writer.close()
+            quarantine_file = validation.write_quarantine(quarantined, file_name)
+            for _, path in writers.values():
+                os.replace(archive.temp_path(path), path)
     except Exception as e:
         log_error(f"Failed to write parquet: {e}")
+        for writer, path in writers.values():
+            writer.close()
+            archive.temp_path(path).unlink(missing_ok=True)
         return
 
-    # Delete used CSV files
+    for key, bucket_sketches in partition_sketches.items():
+        if not bucket_sketches:
+            continue
+        try:
+            with profiling.span("aggregate_recent_csv", "write"):
+                sketches.write_sketches(bucket_sketches, sketches.sketch_path(writers[key][1]))
+        except Exception as e:
+            log_error(f"Failed to write sketches for {writers[key][1].name}: {e}")
+
+    if wide:
+        try:
+            with profiling.span("aggregate_recent_csv", "write"):
+                wide_tables.queue_sql_sync(wide.write())
+        except Exception as e:
+            log_error(f"Failed to update wide tables: {e}")
+
+    if quarantine_file:
+        for reason, count in validation.count_reasons(pa.concat_tables(quarantined)).items():
+            metrics.QUARANTINED.inc(count, reason=reason)
+            log(f"Quarantined {count} rows ({reason}) in {quarantine_file.name}")
+
+    # Release the memory-mapped segments before deleting them
+    table = sources = rejected = quarantined = None
+
+    metrics.BACKLOG.set(len(used_files), stage="aggregate_recent_csv")
+    if not writers:
+        log("No raw data to aggregate for this interval.")
+    else:
+        metrics.ROWS.inc(total_rows, stage="aggregate_recent_csv")
+        log(f"Saved aggregated parquet: {file_name} ({total_rows} rows, {len(writers)} partitions)")
+
+    # Delete used segments and CSV files (empty sealed segments included)
     for file in used_files:
         try:
             os.remove(file)
@@ -111,3 +267,4 @@ def aggregate_recent_csv():
 # ---------------------------
 if __name__ == "__main__":
     aggregate_recent_csv()
+    metrics.write_textfile("aggregate_parquet")
@@ -0,0 +1,232 @@
+"""
+archive.py
+
+Layout of the processed Parquet archive (data/processed/).
+
+Readings are stored as a Hive-style partitioned dataset:
+
+    data/processed/date=YYYY-MM-DD/project=<project_id>/<file>.parquet
+
+- Files inside a partition are named after the time they cover:
+  YYYY-MM-DD_HH-MM-SS_<run id>.parquet (one aggregation run; the random run
+  id keeps two runs in the same second apart), YYYY-MM-DD_HH.parquet (hourly
+  compaction) and YYYY-MM-DD.parquet (daily compaction). Runs written before
+  the run id was added are named YYYY-MM-DD_HH-MM.parquet
+- Rows are sorted by sensor_id then timestamp, so row-group statistics are
+  tight and sensor/time predicates can skip most of a file
+- Files are zstd-compressed with column statistics and bounded row groups
+
+Readers should use open_dataset(), which exposes the `date` and `project`
+partition keys for pruning. Flat files written before partitioning are moved
+into partitions by compact_parquet.py. Files being written use a hidden
+".<name>.tmp" name so that readers never see partial output.
+"""
+
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+try:
+    from scripts import segment_log
+except ImportError:  # executed directly as scripts/<name>.py
+    import segment_log
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+PROCESSED_DIR = Path(__file__).parent.parent / "data" / "processed"
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("date", pa.string()), ("project", pa.string())]),
+    flavor="hive"
+)
+
+ROW_GROUP_ROWS = 128 * 1024
+COMPRESSION = "zstd"
+
+SORT_KEYS = [("sensor_id", "ascending"), ("timestamp", "ascending")]
+
+RUN_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+LEGACY_RUN_TIME_FORMAT = "%Y-%m-%d_%H-%M"
+
+# Readings plus the partition keys, as seen through open_dataset()
+ARCHIVE_SCHEMA = pa.unify_schemas([segment_log.RAW_SCHEMA, PARTITIONING.schema])
+
+# ---------------------------
+# Layout Helpers
+# ---------------------------
+def partition_dir(base, date_str, project):
+    """Return the directory of the (date, project) partition under base."""
+    return Path(base) / f"date={date_str}" / f"project={quote(str(project), safe='')}"
+
+def run_file_name(now):
+    """
+    Returns:
+        str: YYYY-MM-DD_HH-MM-SS_<run id>.parquet, unique per aggregation run
+    """
+    return f"{now.strftime(RUN_TIME_FORMAT)}_{uuid.uuid4().hex[:8]}.parquet"
+
+def run_file_time(path):
+    """
+    Returns:
+        datetime: Start of the aggregation run that wrote path (either run
+        file name), or None for other files
+    """
+    stem = Path(path).stem
+    for name, fmt in ((stem.rsplit("_", 1)[0], RUN_TIME_FORMAT), (stem, LEGACY_RUN_TIME_FORMAT)):
+        try:
+            return datetime.strptime(name, fmt)
+        except ValueError:
+            continue
+    return None
+
+def file_stamp(path):
+    """
+    Returns:
+        dict: Size and modification time of a file, kept in the upload ledger
+        so a file replaced after its upload is noticed
+    """
+    stat = Path(path).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def matches_stamp(entry, path):
+    """True if a ledger entry describes path as it is now (entries without a stamp always do)."""
+    if "size" not in entry:
+        return True
+    try:
+        stamp = file_stamp(path)
+    except FileNotFoundError:
+        return False
+    return entry["size"] == stamp["size"] and entry.get("mtime_ns") == stamp["mtime_ns"]
+
+def partition_project(path):
+    """Project of a data file from its project=<id> directory; None for legacy flat files."""
+    for part in reversed(Path(path).parent.parts):
+        if part.startswith("project="):
+            return unquote(part.split("=", 1)[1])
+    return None
+
+def iter_partition_dirs(base=None):
+    """Yield every date=/project= partition directory under base."""
+    base = Path(base or PROCESSED_DIR)
+    for date_dir in sorted(base.glob("date=*")):
+        for project_dir in sorted(date_dir.glob("project=*")):
+            if project_dir.is_dir():
+                yield project_dir
+
+def split_by_partition(table):
+    """
+    Split a raw readings table by (date, project_id).
+
+    Returns:
+        dict: {(date_str, project_id): pyarrow.Table}
+    """
+    if table.num_rows == 0:
+        return {}
+    dates = pc.strftime(table["timestamp"], format="%Y-%m-%d")
+    projects = pc.cast(table["project_id"], pa.string())
+    keys = pa.table({"date": dates, "project": projects})
+
+    parts = {}
+    for row in keys.group_by(["date", "project"]).aggregate([]).to_pylist():
+        mask = pc.and_(pc.equal(dates, row["date"]), pc.equal(projects, row["project"]))
+        parts[(row["date"], row["project"])] = table.filter(mask)
+    return parts
+
+def sort_readings(table):
+    """
+    Sort a readings table by SORT_KEYS.
+
+    Arrow cannot sort dictionary columns directly, so keys are decoded for
+    computing the order only; the returned table keeps its original types.
+    """
+    keys = pa.table({
+        name: pc.cast(table[name], pa.string()) if pa.types.is_dictionary(table.schema.field(name).type)
+        else table[name]
+        for name, _ in SORT_KEYS
+    })
+    return table.take(pc.sort_indices(keys, sort_keys=SORT_KEYS))
+
+def to_raw_schema(table):
+    """
+    Conform a readings table to segment_log.RAW_SCHEMA.
+
+    Used for Parquet files written before the typed raw layer, which stored
+    every column except value as plain strings (timestamps as ISO-8601 text).
+    """
+    if table.schema.equals(segment_log.RAW_SCHEMA):
+        return table
+    columns = []
+    for field in segment_log.RAW_SCHEMA:
+        column = table[field.name]
+        if field.name == "timestamp" and not pa.types.is_timestamp(column.type):
+            parsed = pd.to_datetime(column.to_pandas(), utc=True, format="ISO8601").dt.floor("s")
+            column = pa.array(parsed, type=field.type)
+        columns.append(column.cast(field.type))
+    return pa.table(columns, schema=segment_log.RAW_SCHEMA)
+
+def read_readings(path):
+    """Read a processed Parquet file as a RAW_SCHEMA table."""
+    return to_raw_schema(pq.read_table(path, columns=segment_log.RAW_SCHEMA.names))
+
+def temp_path(path):
+    """Hidden temporary name used while writing path."""
+    path = Path(path)
+    return path.with_name(f".{path.name}.tmp")
+
+def new_writer(path, schema, metadata=None):
+    """Open a ParquetWriter with the archive's compression and statistics settings."""
+    if metadata:
+        schema = schema.with_metadata({**(schema.metadata or {}), **metadata})
+    return pq.ParquetWriter(path, schema, compression=COMPRESSION, write_statistics=True)
+
+def write_sorted(table, path, metadata=None):
+    """
+    Sort a table and write it to path atomically (temp file + rename).
+
+    Args:
+        table (pyarrow.Table): Readings to write
+        path (Path): Destination file
+        metadata (dict): Extra key/value metadata stored in the file schema
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = temp_path(path)
+    writer = new_writer(tmp_file, table.schema, metadata)
+    try:
+        writer.write_table(sort_readings(table), row_group_size=ROW_GROUP_ROWS)
+    finally:
+        writer.close()
+    os.replace(tmp_file, path)
+
+def iter_data_files(base=None):
+    """
+    Yield every data file of the archive, including legacy flat files.
+
+    Hidden files (".<name>.tmp" being written) and "_"-prefixed directories
+    such as _sketches/ are skipped, as open_dataset() does.
+    """
+    base = Path(base or PROCESSED_DIR)
+    for path in sorted(base.rglob("*.parquet")):
+        if not any(part.startswith((".", "_")) for part in path.relative_to(base).parts):
+            yield path
+
+def open_dataset(base=None):
+    """
+    Open the processed archive as a pyarrow dataset with partition pruning.
+
+    Returns:
+        pyarrow.dataset.Dataset: Columns of the readings plus `date` and `project`
+    """
+    return ds.dataset(
+        str(base or PROCESSED_DIR), schema=ARCHIVE_SCHEMA, format="parquet",
+        partitioning=PARTITIONING, ignore_prefixes=[".", "_"]
+    )
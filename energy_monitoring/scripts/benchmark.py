@@ -0,0 +1,441 @@
+import io
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import psutil
+import pyarrow.parquet as pq
+
+try:
+    from scripts import (aggregate_parquet, archive, generate_sample_data, records, segment_log,
+                         sensor_registry, storage, thingspeak_outbox, upload_thingspeak, upload_to_sql,
+                         validation, wide_tables)
+except ImportError:  # executed directly as scripts/<name>.py
+    import aggregate_parquet
+    import archive
+    import generate_sample_data
+    import records
+    import segment_log
+    import sensor_registry
+    import storage
+    import thingspeak_outbox
+    import upload_thingspeak
+    import upload_to_sql
+    import validation
+    import wide_tables
+
+"""
+benchmark.py
+
+Hermetic performance benchmarks of every pipeline stage.
+
+Each scale builds a synthetic deployment (generate_sample_data.build_load_config)
+in a temporary directory and runs the real pipeline functions against it, in
+order, never touching data/, the operational MySQL or api.thingspeak.com:
+
+- generate_sample: SAMPLE_CYCLES reading cycles of every sensor
+- generate_load: the scale's readings (SAMPLE_INTERVAL apart) into the segment log
+- aggregate_recent_csv: segments -> partitioned Parquet archive and wide
+  tables, with validation
+- upload_parquet_to_sql: archive and wide tables -> SQLite (storage.SQLiteStore),
+  registering the synthetic sensors through the sensor registry
+- upload_to_thingspeak: latest values from the wide tables to a local stub HTTP server;
+  half of the sites drain a full bulk batch of backlog from the outbox, the
+  other half post single updates
+
+Every stage records wall time (time.perf_counter), rows and the peak resident
+memory above the level before the stage, sampled from a background thread
+(tracemalloc would slow the stages down and miss Arrow's allocations).
+
+Results are compared with config/benchmark_baseline.json: a stage regresses
+when it is slower than baseline * (1 + --time-tolerance) plus TIME_SLACK, or
+uses more memory than baseline * (1 + --memory-tolerance) plus MEMORY_SLACK_MB.
+Regressions are listed and the exit status is 1. Baselines are only
+meaningful on the machine that recorded them; refresh with --update-baseline
+after a deliberate change or on new hardware.
+
+Example:
+    python scripts/benchmark.py --scale small --scale medium
+    python scripts/benchmark.py --scale large --update-baseline
+"""
+
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+BASELINE_FILE = Path(__file__).parent.parent / "config" / "benchmark_baseline.json"
+
+# name -> sensors, sites, hours of data
+SCALES = {
+    "small": {"sensors": 16, "sites": 2, "hours": 1},
+    "medium": {"sensors": 1000, "sites": 10, "hours": 1},
+    "week": {"sensors": 16, "sites": 2, "hours": 168},
+    "large": {"sensors": 10000, "sites": 100, "hours": 1},
+}
+DEFAULT_SCALES = ["small", "medium", "week"]
+WARMUP_SCALE = {"sensors": 8, "sites": 2, "hours": 0.25}   # run first, not recorded
+
+STAGES = ["generate_sample", "generate_load", "aggregate_recent_csv",
+          "upload_parquet_to_sql", "upload_to_thingspeak"]
+
+SAMPLE_INTERVAL = 30        # seconds between readings of one sensor
+SAMPLE_CYCLES = 10          # generate_sample() calls per run
+LOAD_CHUNK_SECONDS = 600    # data per generate_load() append (one raw batch)
+SEED = 2030
+
+TIME_TOLERANCE = 1.0        # relative slowdown allowed (shared machines are noisy)
+MEMORY_TOLERANCE = 0.5      # relative memory growth allowed
+TIME_SLACK = 0.05           # seconds, absorbs timer noise on fast stages
+MEMORY_SLACK_MB = 32.0
+
+RSS_SAMPLE_SECONDS = 0.005
+
+# ---------------------------
+# Measurement
+# ---------------------------
+class PeakMemory:
+    """Peak RSS of this process above its level at start, sampled in a thread."""
+
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.stop = threading.Event()
+        self.start_rss = self.peak_rss = 0
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = self.process.memory_info().rss
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    def _sample(self):
+        while not self.stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+
+    @property
+    def peak_mb(self):
+        return (self.peak_rss - self.start_rss) / 2**20
+
+def measure(fn, *args, **kwargs):
+    """
+    Run fn once, timing it and tracking its peak memory.
+
+    Returns:
+        tuple: (fn's return value, seconds, peak RSS increase in MB)
+    """
+    with PeakMemory() as memory:
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+    return result, seconds, memory.peak_mb
+
+def stage_result(rows, seconds, memory_mb):
+    return {
+        "rows": int(rows),
+        "seconds": round(seconds, 4),
+        "rows_per_s": round(rows / seconds) if seconds > 0 else None,
+        "peak_rss_mb": round(memory_mb, 1),
+    }
+
+# ---------------------------
+# Sandbox
+# ---------------------------
+@contextmanager
+def patched(module, **attrs):
+    """Point module-level paths/settings elsewhere for the duration of a run."""
+    saved = {name: getattr(module, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+@contextmanager
+def thingspeak_stub():
+    """
+    Local HTTP server answering like ThingSpeak.
+
+    Yields:
+        tuple: (update URL, bulk update URL template, list of request counts)
+    """
+    received = [0]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, like the real API
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            received[0] += 1
+            if self.path.endswith("/bulk_update.json"):
+                reply, status = b'{"success":true}', 202
+            else:
+                reply, status = str(received[0]).encode(), 200
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        yield f"{base}/update", base + "/channels/{channel_id}/bulk_update.json", received
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def build_channels(load_config):
+    """
+    ThingSpeak channel config for a synthetic deployment; even-numbered sites
+    get a channel_id (outbox + bulk updates), the others post single updates.
+    """
+    channels = {}
+    for s in load_config:
+        channel = channels.setdefault(s["project_id"], {
+            "write_api_key": f"KEY_{s['project_id']}",
+            "update_interval": upload_thingspeak.MIN_UPDATE_INTERVAL,
+            "fields": {},
+        })
+        channel["fields"][s["sensor_id"]] = f"field{s['field']}"
+    for i, project in enumerate(sorted(channels)):
+        if i % 2 == 0:
+            channels[project]["channel_id"] = 100000 + i
+    return channels
+
+# ---------------------------
+# Stages
+# ---------------------------
+def run_scale(scale, workdir):
+    """
+    Run every stage once against a fresh synthetic deployment.
+
+    Args:
+        scale (dict): {"sensors", "sites", "hours"}, e.g. SCALES["small"]
+        workdir (Path): Empty directory for all files of the run
+
+    Returns:
+        dict: {stage: {"rows", "seconds", "rows_per_s", "peak_rss_mb"}}
+    """
+    workdir = Path(workdir)
+    data_dir = workdir / "data"
+    segment_dir = data_dir / "raw" / "segments"
+    processed_dir = data_dir / "processed"
+    load_config = generate_sample_data.build_load_config(scale["sensors"], scale["sites"])
+    config_path = workdir / "sensor_config.json"
+    with open(config_path, "w") as f:
+        json.dump(load_config, f)
+    channels = build_channels(load_config)
+    duration = int(scale["hours"] * 3600)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(seconds=duration)
+    results = {}
+
+    # generate_sample: one reading per sensor per cycle
+    writer = segment_log.SegmentWriter(workdir / "sample_segments")
+    catalog = records.SensorCatalog.from_config(load_config)
+    with patched(generate_sample_data, SENSOR_CONFIG=load_config, SENSOR_CATALOG=catalog,
+                 _segment_writer=writer), \
+            redirect_stdout(io.StringIO()):
+        def sample_cycles():
+            for _ in range(SAMPLE_CYCLES):
+                generate_sample_data.generate_sample()
+        _, seconds, memory = measure(sample_cycles)
+    writer.close()
+    results["generate_sample"] = stage_result(SAMPLE_CYCLES * len(load_config), seconds, memory)
+
+    rows, seconds, memory = measure(
+        generate_sample_data.generate_load, scale["sensors"], scale["sites"],
+        rate_hz=1.0 / SAMPLE_INTERVAL, duration_s=duration, start=start,
+        chunk_seconds=LOAD_CHUNK_SECONDS, data_dir=data_dir, seed=SEED
+    )
+    results["generate_load"] = stage_result(rows, seconds, memory)
+    segment_log.seal_stale_segments(segment_dir, stale_after=0)
+
+    with patched(aggregate_parquet, RAW_DIR=data_dir / "raw", SEGMENT_DIR=segment_dir,
+                 PROCESSED_DIR=processed_dir), \
+            patched(validation, QUARANTINE_DIR=data_dir / "quarantine"), \
+            patched(wide_tables, WIDE_DIR=data_dir / "wide"):
+        _, seconds, memory = measure(aggregate_parquet.aggregate_recent_csv)
+    archived = sum(pq.ParquetFile(f).metadata.num_rows for f in archive.iter_data_files(processed_dir))
+    results["aggregate_recent_csv"] = stage_result(archived, seconds, memory)
+
+    registry = sensor_registry.SensorRegistry(config_path, workdir / "sensor_registry.json")
+    with patched(storage, STORAGE_BACKEND="sqlite", SQLITE_PATH=workdir / "energy_monitoring.db"), \
+            patched(sensor_registry, _registry=registry), \
+            patched(wide_tables, WIDE_DIR=data_dir / "wide"):
+        with patched(upload_to_sql, PROCESSED_DIR=processed_dir,
+                     LEDGER_FILE=data_dir / "upload_ledger.json"):
+            _, seconds, memory = measure(upload_to_sql.upload_parquet_to_sql)
+        with storage.open_store() as store:
+            uploaded = store.conn.execute("SELECT COUNT(*) FROM Sensor_Data").fetchone()[0]
+        results["upload_parquet_to_sql"] = stage_result(uploaded, seconds, memory)
+
+        outbox_file = data_dir / "thingspeak_outbox.db"
+        backlog = min(thingspeak_outbox.BULK_MAX_ENTRIES, max(1, duration // 60))
+        with thingspeak_outbox.Outbox(outbox_file) as outbox:
+            for minute in range(backlog):
+                outbox.enqueue(
+                    {p: {"field1": minute} for p, c in channels.items() if c.get("channel_id")},
+                    datetime.now(timezone.utc) - timedelta(minutes=backlog - minute)
+                )
+        with thingspeak_stub() as (url, bulk_url, received), \
+                patched(upload_thingspeak, THINGSPEAK_URL=url, THINGSPEAK_BULK_URL=bulk_url,
+                        CHANNEL_STATE_FILE=data_dir / "thingspeak_state.json",
+                        load_sensor_config=lambda: load_config,
+                        load_thingspeak_config=lambda: channels), \
+                patched(thingspeak_outbox, OUTBOX_FILE=outbox_file):
+            _, seconds, memory = measure(upload_thingspeak.upload_to_thingspeak)
+            requests_sent = received[0]
+        with thingspeak_outbox.Outbox(outbox_file) as outbox:
+            left = sum(outbox.pending().values())
+        queued = (backlog + 1) * sum(1 for c in channels.values() if c.get("channel_id"))
+        # rows: latest values read + queued entries delivered
+        results["upload_to_thingspeak"] = dict(
+            stage_result(len(load_config) + queued - left, seconds, memory), requests=requests_sent
+        )
+    return results
+
+def run(scales, workdir=None):
+    """
+    Run the given scales, each in its own temporary directory, after an
+    unrecorded warm-up run (imports, page cache, first HTTP connection).
+
+    Returns:
+        dict: Results document ({"machine": ..., "scales": {name: {stage: ...}}})
+    """
+    results = {"machine": machine_info(), "scales": {}}
+    logging.disable(logging.INFO)   # keep the stages' info logs out of the timings and logs/
+    try:
+        for name, scale in [(None, WARMUP_SCALE)] + [(name, SCALES[name]) for name in scales]:
+            path = Path(tempfile.mkdtemp(prefix=f"benchmark_{name or 'warmup'}_", dir=workdir))
+            try:
+                stages = run_scale(scale, path)
+                if name:
+                    results["scales"][name] = stages
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+    finally:
+        logging.disable(logging.NOTSET)
+    return results
+
+def machine_info():
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": psutil.cpu_count(),
+        "recorded_at": datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+    }
+
+# ---------------------------
+# Baseline
+# ---------------------------
+def load_baseline(path=BASELINE_FILE):
+    path = Path(path)
+    if not path.exists():
+        return {"scales": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def save_baseline(results, path=BASELINE_FILE):
+    """Store results as the new baseline, keeping scales that were not re-run."""
+    baseline = load_baseline(path)
+    baseline["machine"] = results["machine"]
+    baseline.setdefault("scales", {}).update(results["scales"])
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def compare(results, baseline, time_tolerance=TIME_TOLERANCE, memory_tolerance=MEMORY_TOLERANCE):
+    """
+    Compare results with a baseline; stages missing from it are skipped.
+
+    Returns:
+        list: One message per regression (empty if none)
+    """
+    regressions = []
+    for scale, stages in results["scales"].items():
+        for stage, current in stages.items():
+            base = baseline.get("scales", {}).get(scale, {}).get(stage)
+            if not base:
+                continue
+            limit = base["seconds"] * (1 + time_tolerance) + TIME_SLACK
+            if current["seconds"] > limit:
+                regressions.append(
+                    f"{scale}/{stage}: {current['seconds']:.3f}s > {limit:.3f}s (baseline {base['seconds']:.3f}s)"
+                )
+            limit = max(base["peak_rss_mb"], 0) * (1 + memory_tolerance) + MEMORY_SLACK_MB
+            if current["peak_rss_mb"] > limit:
+                regressions.append(
+                    f"{scale}/{stage}: {current['peak_rss_mb']:.1f} MB > {limit:.1f} MB "
+                    f"(baseline {base['peak_rss_mb']:.1f} MB)"
+                )
+    return regressions
+
+def format_results(results, baseline):
+    lines = [f"{'scale':<8} {'stage':<22} {'rows':>10} {'seconds':>9} {'rows/s':>10} {'MB':>7} {'vs base':>8}"]
+    for scale, stages in results["scales"].items():
+        for stage, r in stages.items():
+            base = baseline.get("scales", {}).get(scale, {}).get(stage)
+            ratio = f"{r['seconds'] / base['seconds']:.2f}x" if base and base["seconds"] else "-"
+            lines.append(
+                f"{scale:<8} {stage:<22} {r['rows']:>10} {r['seconds']:>9.3f} "
+                f"{r['rows_per_s'] or 0:>10} {r['peak_rss_mb']:>7.1f} {ratio:>8}"
+            )
+    return "\n".join(lines)
+
+# ---------------------------
+# Main Function
+# ---------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic data.")
+    parser.add_argument("--scale", action="append", choices=sorted(SCALES),
+                        help=f"scale to run (repeatable); default: {', '.join(DEFAULT_SCALES)}")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE, help="baseline JSON file")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--output", type=Path, help="also write the results JSON here")
+    parser.add_argument("--time-tolerance", type=float, default=TIME_TOLERANCE)
+    parser.add_argument("--memory-tolerance", type=float, default=MEMORY_TOLERANCE)
+    parser.add_argument("--workdir", type=Path, help="parent of the temporary directories")
+    args = parser.parse_args(argv)
+
+    results = run(args.scale or DEFAULT_SCALES, args.workdir)
+    baseline = load_baseline(args.baseline)
+    print(format_results(results, baseline))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        save_baseline(results, args.baseline)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    return 1 if regressions else 0
+
+# ---------------------------
+# Entrypoint
+# ---------------------------
+if __name__ == "__main__":
+    sys.exit(main())
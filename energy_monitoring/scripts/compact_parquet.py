@@ -0,0 +1,239 @@
+import os
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    from scripts import archive, metrics, sketches
+except ImportError:  # executed directly as scripts/<name>.py
+    import archive
+    import metrics
+    import sketches
+
+"""
+compact_parquet.py
+
+This script compacts the partitioned Parquet archive in data/processed/ so the
+number of files stays small however long the pipeline runs.
+
+- Moves flat files written before partitioning (data/processed/*.parquet) into
+  their date=/project= partitions, converted to the typed raw schema
+- Merges the per-run files of an hour (YYYY-MM-DD_HH-MM-SS_<run id>.parquet,
+  see archive.run_file_name()) into one hourly file (YYYY-MM-DD_HH.parquet) once the hour is over
+- Merges the hourly files of a day into one daily file (YYYY-MM-DD.parquet)
+  once the day is over
+- Rewrites every output sorted by sensor_id and timestamp with bounded,
+  zstd-compressed row groups (see archive.py)
+- Merges the quantile sketch files of merged files the same way (see
+  sketches.py) and builds sketches for migrated flat files
+
+Only files already recorded in the upload ledger are compacted, and outputs
+are tagged with the "grid.uploaded" metadata key so upload_to_sql.py records
+them without inserting their rows a second time.
+
+Designed for low-power Raspberry Pi environments running scheduled tasks (via cron).
+"""
+
+
+# ---------------------------
+# Logging Setup
+# ---------------------------
+LOG_FILE = Path(__file__).parent.parent / "logs" / "compact_parquet.log"
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    handlers=[
+        logging.FileHandler(LOG_FILE),
+        logging.StreamHandler()
+    ]
+)
+
+def log(msg): logging.info(msg)
+def log_error(msg): logging.error(msg)
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+PROCESSED_DIR = Path(__file__).parent.parent / "data" / "processed"
+LEDGER_FILE = PROCESSED_DIR.parent / "upload_ledger.json"
+SHARD_LEDGER_GLOB = "shards/shard-*/upload_ledger.json"     # see shards.py
+
+# Time after the end of an hour/day before its files are compacted, so late
+# aggregation runs for that period are not split across two outputs
+COMPACTION_GRACE = timedelta(minutes=int(os.environ.get("COMPACTION_GRACE_MINUTES", 15)))
+
+UPLOADED_METADATA = {"grid.uploaded": "true"}
+
+HOUR_FORMAT = "%Y-%m-%d_%H"
+DAY_FORMAT = "%Y-%m-%d"
+
+# ---------------------------
+# Helpers
+# ---------------------------
+def load_uploaded(base):
+    """
+    Return the ledger entries of uploaded files, keyed by path relative to base.
+
+    The ledgers are owned by upload_to_sql.py (one per shard when the
+    pipeline is sharded) and only read here.
+    """
+    root = Path(base).parent
+    uploaded = {}
+    for ledger_file in [root / LEDGER_FILE.name] + sorted(root.glob(SHARD_LEDGER_GLOB)):
+        if not ledger_file.exists():
+            continue
+        try:
+            with open(ledger_file, "r") as f:
+                uploaded.update(json.load(f))
+        except (OSError, ValueError) as e:
+            log_error(f"Could not read upload ledger {ledger_file.name}: {e}")
+    return uploaded
+
+def is_uploaded(path, base, uploaded):
+    """
+    True if path is in the ledger (as it is now, not a file it replaced) or
+    is a compaction output itself.
+    """
+    entry = uploaded.get(path.relative_to(base).as_posix())
+    if entry is not None and archive.matches_stamp(entry, path):
+        return True
+    metadata = pq.read_schema(path).metadata or {}
+    return metadata.get(b"grid.uploaded") == b"true"
+
+def file_period(path):
+    """
+    Classify an archive file by its name.
+
+    Returns:
+        tuple: ("minute" | "hour" | "day", datetime start) or (None, None)
+    """
+    run_time = archive.run_file_time(path)
+    if run_time is not None:
+        return "minute", run_time
+    for kind, fmt in (("hour", HOUR_FORMAT), ("day", DAY_FORMAT)):
+        try:
+            return kind, datetime.strptime(path.stem, fmt)
+        except ValueError:
+            continue
+    return None, None
+
+def merge_files(sources, target):
+    """
+    Merge sources (and target, if it exists) into target and delete the sources.
+
+    Returns:
+        int: Rows written to target
+    """
+    inputs = list(sources) + ([target] if target.exists() and target not in sources else [])
+    table = pa.concat_tables([archive.read_readings(f) for f in inputs])
+    archive.write_sorted(table, target, metadata=UPLOADED_METADATA)
+    sketches.merge_sketch_files(sources, target)
+    for f in sources:
+        if f != target:
+            f.unlink()
+    metrics.ROWS.inc(table.num_rows, stage="compact_parquet")
+    return table.num_rows
+
+# ---------------------------
+# Compaction Steps
+# ---------------------------
+def migrate_flat_files(base, uploaded):
+    """
+    Move uploaded flat files from the root of base into their partitions.
+
+    Returns:
+        int: Number of flat files migrated
+    """
+    migrated = 0
+    for path in sorted(Path(base).glob("*.parquet")):
+        if not is_uploaded(path, base, uploaded):
+            continue    # upload_to_sql.py picks it up first
+        try:
+            parts = archive.split_by_partition(archive.read_readings(path))
+            for (date_str, project), part in parts.items():
+                target = archive.partition_dir(base, date_str, project) / path.name
+                if target.exists():
+                    part = pa.concat_tables([archive.read_readings(target), part])
+                archive.write_sorted(part, target, metadata=UPLOADED_METADATA)
+                bucket_sketches = sketches.build_sketches(part)
+                if bucket_sketches:
+                    sketches.write_sketches(bucket_sketches, sketches.sketch_path(target))
+            path.unlink()
+            migrated += 1
+            log(f"Migrated flat file {path.name} into {len(parts)} partition(s)")
+        except Exception as e:
+            log_error(f"Failed to migrate {path.name}: {e}")
+    return migrated
+
+def compact_partition(partition, base, uploaded, now):
+    """
+    Merge the finished minute files of a partition into hourly files, then
+    finished hourly files into a daily file.
+
+    Returns:
+        int: Number of files written
+    """
+    written = 0
+    for kind, span, fmt in (("minute", timedelta(hours=1), HOUR_FORMAT),
+                            ("hour", timedelta(days=1), DAY_FORMAT)):
+        groups = defaultdict(list)
+        for path in sorted(partition.glob("*.parquet")):
+            file_kind, start = file_period(path)
+            if file_kind == kind:
+                groups[start.strftime(fmt)].append(path)
+
+        for name, paths in groups.items():
+            period_start = datetime.strptime(name, fmt)
+            if period_start + span + COMPACTION_GRACE > now:
+                continue
+            target = partition / f"{name}.parquet"
+            if not all(is_uploaded(p, base, uploaded) for p in paths + [target] if p.exists()):
+                continue
+            try:
+                rows = merge_files(paths, target)
+                written += 1
+                log(f"Compacted {len(paths)} file(s) into {target.relative_to(base).as_posix()} ({rows} rows)")
+            except Exception as e:
+                log_error(f"Failed to compact {target}: {e}")
+    return written
+
+# ---------------------------
+# Main Function
+# ---------------------------
+@metrics.timed("compact_parquet")
+def compact_parquet(base=None, now=None):
+    """
+    Migrate legacy flat files and compact every partition of the archive.
+
+    Args:
+        base (Path): Archive root, defaults to data/processed/
+        now (datetime): Current UTC time (naive), defaults to utcnow()
+    """
+    base = Path(base or PROCESSED_DIR)
+    now = now or datetime.utcnow()
+    if not base.exists():
+        log("No processed archive to compact.")
+        return
+
+    uploaded = load_uploaded(base)
+    migrated = migrate_flat_files(base, uploaded)
+    written = sum(
+        compact_partition(partition, base, uploaded, now)
+        for partition in archive.iter_partition_dirs(base)
+    )
+    if migrated or written:
+        log(f"Compaction finished: {migrated} flat file(s) migrated, {written} file(s) written")
+    else:
+        log("Nothing to compact.")
+
+# ---------------------------
+# Entrypoint
+# ---------------------------
+if __name__ == "__main__":
+    compact_parquet()
+    metrics.write_textfile("compact_parquet")
@@ -1,11 +1,25 @@
 import schedule
+import os
+import sys
 import time
+import argparse
+import importlib
 import subprocess
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import psutil
 
+try:
+    from scripts import db, metrics, profiling, shards
+except ImportError:  # executed directly as scripts/<name>.py
+    import db
+    import metrics
+    import profiling
+    import shards
+
 
 """
 cron_manager.py
@@ -18,8 +32,23 @@ Key responsibilities:
 - Aggregate CSV data into Parquet every 1 minute
 - Upload aggregated data to MySQL every 1 minute
 - Upload latest readings to ThingSpeak cloud every 1 minute
-- Avoid concurrent executions using psutil-based overlap protection
+- Avoid concurrent executions of the same job (per-job overlap protection)
 - Log all events to logs/cron_manager.log
+- Record scheduler lag and job failures in logs/metrics/cron_manager.prom,
+  optionally served on a local HTTP port (--metrics-port)
+- Optionally profile every job run (--profile cprofile,sample,tracemalloc,spans
+  or all; see profiling.py), writing the profiles to logs/profiles/
+- Optionally shard generation, aggregation and the SQL upload by project
+  (--shards N, see shards.py): each of those jobs is scheduled once per
+  shard and runs in that shard's worker process, so shards proceed in
+  parallel on separate cores and one slow site only delays its own shard
+
+By default jobs run in-process: the pipeline modules are imported once and
+their entry points are called on a small worker pool, so no run pays Python
+startup or the pandas/pyarrow/pymysql imports again, and database
+connections stay warm in the shared pool (db.py). Pass --subprocess to
+run each job as a separate `python scripts/<job>.py` process instead
+(psutil-based overlap protection), e.g. for isolation while debugging.
 
 Designed to be run as a long-lived background process (manually or via systemd/cron).
 """
@@ -54,7 +83,24 @@ def log_error(msg):
     logging.error(msg)
 
 # ------------------------------
-# SCRIPT EXECUTION UTILITIES
+# JOB DEFINITIONS
+# ------------------------------
+
+# name: (module, entry point, interval in seconds, timeout in seconds)
+JOBS = {
+    "generate_sample": ("generate_sample_data", "generate_sample", 30, 25),
+    "aggregate_recent_csv": ("aggregate_parquet", "aggregate_recent_csv", 60, 55),
+    "upload_parquet_to_sql": ("upload_to_sql", "upload_parquet_to_sql", 60, 55),
+    "upload_to_thingspeak": ("upload_thingspeak", "upload_to_thingspeak", 60, 55),
+    "rollup_power": ("rollup_power", "rollup_power", 300, 240),
+    "compact_parquet": ("compact_parquet", "compact_parquet", 3600, 3000),
+    "retention": ("retention", "apply_retention", 86400, 3600),
+}
+
+MAX_WORKERS = 4
+
+# ------------------------------
+# SCRIPT EXECUTION UTILITIES (--subprocess mode)
 # ------------------------------
 
 def is_script_running(script_name: str) -> bool:
@@ -64,7 +110,6 @@ def is_script_running(script_name: str) -> bool:
     Uses psutil to prevent overlapping executions of the same Python script.
     Returns True if the script is found in the current process list.
     """
-    """Check if the given script is already running via psutil."""
     for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
         try:
             if proc.info['cmdline'] and script_name in ' '.join(proc.info['cmdline']):
@@ -73,61 +118,192 @@ def is_script_running(script_name: str) -> bool:
             continue
     return False
 
-def run_script(script_path: str):
+def run_script(script_path: str, timeout: float = None, args=()):
     """
     Execute a Python script via subprocess with overlap protection.
 
     Logs execution attempts and any errors that occur during invocation.
-    Skips execution if script is already running.
+    Skips execution if the same command line is already running.
     """
-    """Run a script with overlap protection and logging."""
-    if is_script_running(script_path):
-        log(f"Skipping {script_path} (already running)")
+    command = " ".join([script_path, *args])
+    if is_script_running(command):
+        log(f"Skipping {command} (already running)")
         return
     try:
-        log(f"Executing {script_path}")
-        subprocess.run(["python", script_path], check=True)
+        log(f"Executing {command}")
+        subprocess.run(["python", script_path, *args], check=True, timeout=timeout)
     except subprocess.CalledProcessError as e:
-        log_error(f"Error running {script_path}: {e}")
+        log_error(f"Error running {command}: {e}")
+    except subprocess.TimeoutExpired:
+        log_error(f"{command} killed after exceeding {timeout}s timeout")
 
 # ------------------------------
-# SCHEDULED TASKS
+# IN-PROCESS JOB RUNNER
 # ------------------------------
 
-def generate_data():
-    """Scheduled wrapper for sensor data generation."""
-    run_script("scripts/generate_sample_data.py")
+class JobRunner:
+    """
+    Run pipeline entry points as in-process callables on a worker pool.
+
+    Each job has at most one run in flight: a trigger while the previous run
+    is still active is skipped. Python threads cannot be killed, so a run that
+    exceeds its timeout is reported and keeps blocking new runs of that job
+    until it returns, rather than piling up further overlapping runs.
+    """
 
-def aggregate_data():
-    """Scheduled wrapper for aggregating recent CSVs to Parquet."""
-    run_script("scripts/aggregate_parquet.py")
+    def __init__(self, jobs, max_workers=MAX_WORKERS, shard_pool=None):
+        self.jobs = jobs
+        self.shard_pool = shard_pool
+        if shard_pool:
+            # One waiting thread per sharded job run on top of the in-process jobs
+            max_workers += len(shards.SHARDED_JOBS) * shard_pool.count
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.lock = threading.Lock()
+        self.running = {}      # (job name, shard) -> trigger time (monotonic)
+        self.callables = {}
 
-def upload_to_sql():
-    """Scheduled wrapper for uploading latest Parquet to SQL."""
-    run_script("scripts/upload_to_sql.py")
+    def load(self, name):
+        """Import the job's module once and return its entry point."""
+        if name not in self.callables:
+            module_name, func_name, _, _ = self.jobs[name]
+            if __package__:
+                module_name = f"{__package__}.{module_name}"
+            self.callables[name] = getattr(importlib.import_module(module_name), func_name)
+        return self.callables[name]
 
-def upload_to_thingspeak():
-    """Scheduled wrapper for uploading latest readings to ThingSpeak."""
-    run_script("scripts/upload_thingspeak.py")
+    def submit(self, name, shard=None):
+        """
+        Schedule one run of a job (of one shard, for sharded jobs) unless a
+        previous run is still active.
+        """
+        label = name if shard is None else f"{name}[shard {shard}]"
+        with self.lock:
+            started = self.running.get((name, shard))
+            if started is not None:
+                elapsed = time.monotonic() - started
+                timeout = self.jobs[name][3]
+                if elapsed > timeout:
+                    log_error(f"{label} still running after {elapsed:.0f}s (timeout {timeout}s); skipping")
+                else:
+                    log(f"Skipping {label} (already running)")
+                return None
+            self.running[(name, shard)] = time.monotonic()
+        return self.pool.submit(self._run, name, shard)
+
+    def _run(self, name, shard=None):
+        label = name if shard is None else f"{name}[shard {shard}]"
+        start = time.monotonic()
+        with self.lock:
+            metrics.SCHEDULER_LAG.observe(start - self.running[(name, shard)], job=name)
+        try:
+            log(f"Executing {label}")
+            if shard is None:
+                self.load(name)()
+            else:
+                self.shard_pool.run(shard, name)
+        except Exception as e:
+            metrics.JOB_FAILURES.inc(job=name)
+            log_error(f"Error running {label}: {e}")
+        finally:
+            elapsed = time.monotonic() - start
+            timeout = self.jobs[name][3]
+            if elapsed > timeout:
+                log_error(f"{label} took {elapsed:.1f}s, exceeding its {timeout}s timeout")
+            with self.lock:
+                self.running.pop((name, shard), None)
+            metrics.write_textfile("cron_manager")
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        if self.shard_pool:
+            self.shard_pool.shutdown()
+        db.close_pool()
 
 # ------------------------------
 # JOB REGISTRATION
 # ------------------------------
 
-schedule.every(30).seconds.do(generate_data)
-schedule.every(1).minutes.do(aggregate_data)
-schedule.every(1).minutes.do(upload_to_sql)
-schedule.every(1).minutes.do(upload_to_thingspeak)
+def register_jobs(use_subprocess=False, shard_count=1):
+    """
+    Register all JOBS with the scheduler; with shard_count > 1, the jobs in
+    shards.SHARDED_JOBS are registered once per shard.
 
-log("Cron Manager started. Scheduling all jobs.")
+    Returns:
+        JobRunner or None: The in-process runner, or None in subprocess mode
+    """
+    sharded = shard_count > 1
+    runner = None
+    if not use_subprocess:
+        runner = JobRunner(JOBS, shard_pool=shards.ShardPool(shard_count) if sharded else None)
+    for name, (module_name, _, interval, timeout) in JOBS.items():
+        if sharded and name in shards.SHARDED_JOBS:
+            for shard in range(shard_count):
+                if runner:
+                    schedule.every(interval).seconds.do(runner.submit, name, shard)
+                else:
+                    schedule.every(interval).seconds.do(
+                        run_script, "scripts/shards.py", timeout,
+                        ["--shards", str(shard_count), "--shard", str(shard), "--run", name]
+                    )
+        elif runner:
+            runner.load(name)  # import everything once, up front
+            schedule.every(interval).seconds.do(runner.submit, name)
+        else:
+            schedule.every(interval).seconds.do(run_script, f"scripts/{module_name}.py", timeout)
+    return runner
 
 # ------------------------------
 # MAIN LOOP
 # ------------------------------
 
-try:
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
-except KeyboardInterrupt:
-    log("Cron Manager stopped by user.")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Schedule the energy monitoring pipeline.")
+    parser.add_argument(
+        "--subprocess", action="store_true",
+        help="run every job in a fresh Python process instead of in-process"
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=None,
+        help="also serve Prometheus metrics on http://127.0.0.1:PORT/metrics"
+    )
+    parser.add_argument(
+        "--profile", metavar="MODES", default=None,
+        help="profile every job run: comma-separated cprofile, sample, tracemalloc, spans or all"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=shards.SHARD_COUNT,
+        help="shard generation, aggregation and SQL upload by project across N worker processes"
+    )
+    args = parser.parse_args(argv)
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+
+    if args.profile:
+        try:
+            profiling.configure(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+        os.environ["PROFILE"] = args.profile    # inherited by --subprocess jobs
+        log(f"Profiling job runs ({args.profile}) into {profiling.PROFILE_DIR}")
+
+    runner = register_jobs(use_subprocess=args.subprocess, shard_count=args.shards)
+    if args.shards > 1:
+        log(f"Sharding {', '.join(shards.SHARDED_JOBS)} across {args.shards} workers")
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+        log(f"Serving metrics on port {args.metrics_port}")
+    mode = "subprocess" if args.subprocess else "in-process"
+    log(f"Cron Manager started ({mode} mode). Scheduling all jobs.")
+
+    try:
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+    except KeyboardInterrupt:
+        log("Cron Manager stopped by user.")
+    finally:
+        if runner:
+            runner.shutdown()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,201 @@
+"""
+db.py
+
+Shared MySQL connection layer for every pipeline script.
+
+- One DB_CONFIG, read from DEFAULT_CONFIG, then the JSON file named by
+  DB_CONFIG_FILE (default config/db_config.json, optional), then the DB_HOST,
+  DB_PORT, DB_USER, DB_PASSWORD and DB_NAME environment variables
+- A process-wide pool of warm connections (get_pool()). Under cron_manager's
+  in-process mode the jobs reuse them run after run, so a job no longer pays
+  TCP connect and authentication every minute
+- Connections idle for more than HEALTH_CHECK_SECONDS are pinged before they
+  are handed out; dead ones are replaced transparently
+- New connections are retried with exponential backoff (CONNECT_RETRIES),
+  so a MySQL restart delays a run instead of failing it
+- Returned connections with an open transaction are rolled back, so a job
+  that failed half-way never leaks its writes into the next one
+
+The pool never blocks: when every pooled connection is in use (e.g. the
+upload worker threads) an extra one is opened, and it is closed on release
+if the pool is already full.
+
+pymysql has no binary protocol, so statements are not prepared server-side;
+executemany() on an INSERT ... VALUES instead sends each batch as a single
+multi-row statement, which is one parse and one round trip per batch.
+"""
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+try:
+    from scripts import metrics
+except ImportError:  # executed directly as scripts/<name>.py
+    import metrics
+
+# ---------------------------
+# Configuration
+# ---------------------------
+DEFAULT_CONFIG = {
+    "host": "localhost",
+    "port": 3306,
+    "user": "root",
+    "password": "Grid2030.",
+    "database": "energy_monitoring"
+}
+
+CONFIG_FILE = Path(os.environ.get("DB_CONFIG_FILE", Path(__file__).parent.parent / "config" / "db_config.json"))
+
+# Environment variable -> (config key, type)
+ENV_OVERRIDES = {
+    "DB_HOST": ("host", str),
+    "DB_PORT": ("port", int),
+    "DB_USER": ("user", str),
+    "DB_PASSWORD": ("password", str),
+    "DB_NAME": ("database", str),
+}
+
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 4))
+HEALTH_CHECK_SECONDS = 30
+CONNECT_RETRIES = 3
+BACKOFF_SECONDS = 0.5       # doubled after every failed attempt
+CONNECT_TIMEOUT = 10
+
+def load_config(path=None, environ=None):
+    """
+    Build the connection settings (defaults < config file < environment).
+
+    Returns:
+        dict: Keyword arguments for pymysql.connect()
+    """
+    config = dict(DEFAULT_CONFIG)
+    path = Path(path or CONFIG_FILE)
+    if path.exists():
+        with open(path, "r") as f:
+            config.update(json.load(f))
+    environ = os.environ if environ is None else environ
+    for name, (key, cast) in ENV_OVERRIDES.items():
+        if name in environ:
+            config[key] = cast(environ[name])
+    return config
+
+DB_CONFIG = load_config()
+
+# ---------------------------
+# Connections
+# ---------------------------
+def connect(config=None, retries=CONNECT_RETRIES, backoff=BACKOFF_SECONDS):
+    """
+    Open a new connection, retrying with exponential backoff.
+
+    Raises:
+        pymysql.err.OperationalError: If the last attempt fails
+    """
+    config = dict(config or DB_CONFIG)
+    config.setdefault("connect_timeout", CONNECT_TIMEOUT)
+    for attempt in range(retries + 1):
+        try:
+            conn = pymysql.connect(**config)
+            metrics.DB_CONNECTS.inc(outcome="ok")
+            return conn
+        except pymysql.err.OperationalError as e:
+            metrics.DB_CONNECTS.inc(outcome="error")
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            logging.warning(f"MySQL connect failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def in_transaction(conn):
+    return bool(conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS)
+
+class ConnectionPool:
+    """Thread-safe pool of warm connections (see the module docstring)."""
+
+    def __init__(self, config=None, size=POOL_SIZE, health_check=HEALTH_CHECK_SECONDS):
+        self.config = dict(config or DB_CONFIG)
+        self.size = size
+        self.health_check = health_check
+        self.idle = queue.LifoQueue(maxsize=size)     # (conn, released_at)
+
+    def get(self):
+        """Return a live connection, reusing an idle one when possible."""
+        while True:
+            try:
+                conn, released = self.idle.get_nowait()
+            except queue.Empty:
+                return connect(self.config)
+            if time.monotonic() - released < self.health_check:
+                return conn
+            try:
+                conn.ping(reconnect=False)
+                metrics.DB_ROUNDTRIPS.inc(stage="db_pool")
+                return conn
+            except pymysql.err.Error:
+                self._discard(conn)
+
+    def put(self, conn):
+        """Give a connection back; rolls back any transaction left open."""
+        try:
+            if in_transaction(conn):
+                conn.rollback()
+            self.idle.put_nowait((conn, time.monotonic()))
+        except queue.Full:
+            self._discard(conn)
+        except pymysql.err.Error:
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """with pool.connection() as conn: ..."""
+        conn = self.get()
+        try:
+            yield conn
+        finally:
+            self.put(conn)
+
+    def close(self):
+        """Close every idle connection."""
+        while True:
+            try:
+                conn, _ = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass
+
+# ---------------------------
+# Process-wide Pool
+# ---------------------------
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+def close_pool():
+    """Close the process-wide pool's idle connections (e.g. at shutdown)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
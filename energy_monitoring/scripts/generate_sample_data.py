@@ -1,32 +1,84 @@
 """
 generate_sample_data.py
 
-This script simulates sensor readings and writes them to a timestamped CSV file
-within a date-organized folder (data/raw/YYYY-MM-DD/).
+This script simulates sensor readings and appends them to the raw segment log
+(data/raw/segments/, see segment_log.py).
 
 - Reads sensor definitions from config/sensor_config.json
 - Randomly generates realistic values per sensor type
-- Writes one row per sensor every time it runs
-- CSV file includes: timestamp, project_id, sensor_id, sensor_type, value, unit
+- Appends one row per sensor every time it runs, as one Arrow record batch
+- Records include: timestamp, project_id, sensor_id, sensor_type, value, unit
 
 Intended to be run on a schedule (e.g., every 30 seconds via cron or scheduler).
+
+Load-generator mode (--load) synthesizes many sensors across many sites at a
+given sample rate (at most 1 Hz: timestamps have whole-second resolution
+from the segment log to Sensor_Data) with vectorized NumPy value models,
+optionally backdated, for capacity-testing aggregation, SQL load and uploads:
+
+    python scripts/generate_sample_data.py --load --sensors 5000 --sites 10 \
+        --rate 1 --duration 3600 --start 2025-06-01T00:00:00 --data-dir /tmp/load
 """
 
-import csv
 import random
 import time
-from datetime import datetime
+import argparse
+from datetime import datetime, timedelta
 from pathlib import Path
 import json
 
+import numpy as np
+import pyarrow as pa
+
+try:
+    from scripts import archive, metrics, profiling, records, segment_log, sketches
+except ImportError:  # executed directly as scripts/<name>.py
+    import archive
+    import metrics
+    import profiling
+    import records
+    import segment_log
+    import sketches
+
 # Path to sensor configuration file (sensor IDs, types, units)
 CONFIG_PATH = Path(__file__).parent.parent / 'config' / 'sensor_config.json'
 RAW_DATA_DIR = Path(__file__).parent.parent / 'data' / 'raw'
 
+# Readings carry whole-second timestamps end to end, so a sensor can report at
+# most once per second; faster rates would produce duplicate timestamps
+MAX_RATE_HZ = 1.0
+
 # Load sensor configuration
 with open(CONFIG_PATH, 'r') as f:
     SENSOR_CONFIG = json.load(f)
 
+# Sensor key -> metadata side dictionary of the configured sensors (config order)
+SENSOR_CATALOG = records.SensorCatalog.from_config(SENSOR_CONFIG)
+
+# Expected operating range per sensor type
+SENSOR_RANGES = {
+    'temperature': (20.0, 40.0),
+    'voltage': (10.0, 24.0),
+    'current': (0.1, 5.0),
+    'irradiance': (200.0, 1000.0),
+    'wind_speed': (0.0, 20.0),
+    'wind_direction': (0, 360),
+    'pressure': (100000, 400000),
+    'power': (0.0, 2000.0),
+}
+
+# Units used when synthesizing sensors in load-generator mode
+SENSOR_UNITS = {
+    'temperature': 'C',
+    'voltage': 'V',
+    'current': 'A',
+    'irradiance': 'W/m²',
+    'wind_speed': 'm/s',
+    'wind_direction': '°',
+    'pressure': 'Pa',
+    'power': 'W',
+}
+
 # Simulate a reading for a given sensor type
 def simulate_value(sensor_type):
     """
@@ -38,50 +90,261 @@ def simulate_value(sensor_type):
     Returns:
         float: Randomly generated value within expected operating range.
     """
-    ranges = {
-        'temperature': (20.0, 40.0),
-        'voltage': (10.0, 24.0),
-        'current': (0.1, 5.0),
-        'irradiance': (200.0, 1000.0),
-        'wind_speed': (0.0, 20.0),
-        'wind_direction': (0, 360),
-        'pressure': (100000, 400000),
-        'power': (0.0, 2000.0),
-    }
-    lo, hi = ranges.get(sensor_type, (0, 1))
+    lo, hi = SENSOR_RANGES.get(sensor_type, (0, 1))
     return round(random.uniform(lo, hi), 2)
 
+_segment_writer = None
+
+def get_segment_writer():
+    """
+    Return this process's segment writer.
+
+    Kept open between calls so that, when run in-process by cron_manager,
+    appends share one open segment and fsyncs are batched.
+    """
+    global _segment_writer
+    if _segment_writer is None:
+        _segment_writer = segment_log.SegmentWriter(RAW_DATA_DIR / 'segments')
+    return _segment_writer
+
+@profiling.profiled("generate_sample")
+@metrics.timed("generate_sample")
 def generate_sample():
     """
-    Simulate one full reading cycle for all configured sensors and write to CSV.
+    Simulate one full reading cycle for all configured sensors.
 
     Output:
-        A new CSV file saved under data/raw/YYYY-MM-DD/HH-MM-SS.csv,
-        containing a row per sensor at the same UTC timestamp.
+        One record batch appended to the open segment in data/raw/segments/,
+        containing a row per sensor at the same UTC timestamp, built from
+        compact readings (records.py) keyed by SENSOR_CATALOG.
+    """
+    timestamp = int(time.time())
+    with profiling.span("generate_sample", "transform"):
+        readings = records.Readings(
+            np.arange(len(SENSOR_CONFIG)),
+            np.full(len(SENSOR_CONFIG), timestamp),
+            [simulate_value(sensor['sensor_type']) for sensor in SENSOR_CONFIG]
+        )
+        batch = records.to_record_batch(readings, SENSOR_CATALOG)
+
+    with profiling.span("generate_sample", "write"):
+        segment = get_segment_writer().append(batch)
+
+    metrics.ROWS.inc(batch.num_rows, stage="generate_sample")
+    metrics.BYTES.inc(batch.nbytes, stage="generate_sample")
+    print(f"[INFO] Sample data appended to {segment}")
+
+# ---------------------------
+# Load Generator
+# ---------------------------
+def build_load_config(n_sensors, n_sites):
+    """
+    Synthesize a sensor configuration for load testing.
+
+    Sensors are spread round-robin over sites named Site_000, Site_001, ...
+    and cycle through every type in SENSOR_RANGES.
+
+    Returns:
+        list: Sensor dicts shaped like config/sensor_config.json entries
+    """
+    types = list(SENSOR_RANGES)
+    config = []
+    for i in range(n_sensors):
+        sensor_type = types[(i // n_sites) % len(types)]
+        config.append({
+            'project_id': f"Site_{i % n_sites:03d}",
+            'sensor_id': f"{sensor_type}_{i // n_sites}",
+            'sensor_type': sensor_type,
+            'unit': SENSOR_UNITS[sensor_type],
+            'field': (i // n_sites) % 8 + 1,
+        })
+    return config
+
+def simulate_series(sensor_type, epoch_seconds, n_sensors, rng):
+    """
+    Vectorized value model for one sensor type.
+
+    Values follow a daily cycle (irradiance, temperature and the PV electrical
+    readings track the sun), Weibull-distributed wind and a random-walk wind
+    direction, plus per-sensor offsets and noise, clipped to SENSOR_RANGES.
+
+    Args:
+        sensor_type (str): Sensor type
+        epoch_seconds (ndarray): Sample times, shape (n_times,)
+        n_sensors (int): Number of sensors of this type
+        rng (numpy.random.Generator): Random source
+
+    Returns:
+        ndarray: float32 values, shape (n_times, n_sensors)
+    """
+    n_times = len(epoch_seconds)
+    hour = (epoch_seconds % 86400) / 3600.0
+    sun = np.clip(np.sin(np.pi * (hour - 6.0) / 12.0), 0.0, None)[:, None]
+    offset = rng.normal(0.0, 1.0, size=(1, n_sensors))
+    noise = rng.normal(0.0, 1.0, size=(n_times, n_sensors))
+
+    if sensor_type == 'irradiance':
+        values = 1000.0 * sun * (0.85 + 0.05 * offset) + 15.0 * noise
+    elif sensor_type == 'temperature':
+        values = 24.0 + 12.0 * sun + offset + 0.3 * noise
+    elif sensor_type == 'voltage':
+        values = 12.0 + 10.0 * sun + 0.3 * offset + 0.2 * noise
+    elif sensor_type == 'current':
+        values = 0.2 + 4.5 * sun + 0.1 * offset + 0.05 * noise
+    elif sensor_type == 'power':
+        values = 1800.0 * sun + 20.0 * offset + 10.0 * noise
+    elif sensor_type == 'wind_speed':
+        values = 6.0 * rng.weibull(2.0, size=(n_times, n_sensors))
+    elif sensor_type == 'wind_direction':
+        start = rng.uniform(0.0, 360.0, size=(1, n_sensors))
+        values = (start + np.cumsum(2.0 * noise, axis=0)) % 360.0
+    elif sensor_type == 'pressure':
+        values = 250000.0 + 20000.0 * offset + 500.0 * noise
+    else:
+        values = rng.uniform(0.0, 1.0, size=(n_times, n_sensors))
+
+    lo, hi = SENSOR_RANGES.get(sensor_type, (0, 1))
+    return np.round(np.clip(values, lo, hi), 2).astype(np.float32)
+
+def simulate_chunk(config, epoch_seconds, rng):
+    """
+    Generate readings for every sensor at every sample time.
+
+    Returns:
+        records.Readings: Sensor keys are positions in config, ordered by
+        timestamp then sensor (the layout generate_sample() writes)
+    """
+    n_times = len(epoch_seconds)
+    types = np.array([s['sensor_type'] for s in config])
+    values = np.empty((n_times, len(config)), dtype=np.float32)
+    for sensor_type in np.unique(types):
+        cols = np.flatnonzero(types == sensor_type)
+        values[:, cols] = simulate_series(sensor_type, epoch_seconds, len(cols), rng)
+
+    return records.Readings(
+        np.tile(np.arange(len(config), dtype=np.int32), n_times),
+        np.repeat(epoch_seconds, len(config)),
+        values.ravel()
+    )
+
+def generate_load(n_sensors, n_sites, rate_hz=1.0, duration_s=3600, start=None,
+                  chunk_seconds=60, data_dir=None, output='segment', seed=None):
+    """
+    Write synthetic readings for load and capacity testing.
+
+    Readings are written in chunks of chunk_seconds, either appended to the raw
+    segment log (output='segment', any age), as legacy raw CSVs in the
+    data/raw/YYYY-MM-DD/HH-MM-SS.csv layout (output='raw'; only today's data
+    from the last segment_log.LEGACY_CSV_WINDOW seconds, the CSVs
+    aggregate_parquet.py reads), or directly as
+    processed Parquet files in the partitioned archive layout,
+    data/processed/date=YYYY-MM-DD/project=<id>/YYYY-MM-DD_HH-MM.parquet
+    (output='processed'), to load-test the SQL uploader on its own.
+
+    Args:
+        n_sensors (int): Total number of sensors
+        n_sites (int): Number of projects/sites the sensors are spread over
+        rate_hz (float): Samples per second per sensor, 0 < rate_hz <= MAX_RATE_HZ
+        duration_s (int): Seconds of data to generate
+        start (datetime): First sample time (naive UTC); defaults to now - duration
+        chunk_seconds (int): Seconds of data per output file
+        data_dir (Path): Base data directory; defaults to the repo's data/
+        output (str): 'segment' (default), 'raw' or 'processed'
+        seed (int): Random seed for reproducible runs
+
+    Returns:
+        int: Number of readings written
+
+    Raises:
+        ValueError: rate_hz is not in (0, MAX_RATE_HZ], or output='raw' data
+            the aggregator would never read (use output='segment' to backfill)
     """
-    timestamp = datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'
-    today = datetime.utcnow().strftime('%Y-%m-%d')
-    raw_folder = RAW_DATA_DIR / today
-    raw_folder.mkdir(parents=True, exist_ok=True)
-
-    filename = f"{datetime.utcnow().strftime('%H-%M-%S')}.csv"
-    filepath = raw_folder / filename
-
-    with open(filepath, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(['timestamp', 'project_id', 'sensor_id', 'sensor_type', 'value', 'unit'])
-        for sensor in SENSOR_CONFIG:
-            value = simulate_value(sensor['sensor_type'])
-            writer.writerow([
-                timestamp,
-                sensor['project_id'],
-                sensor['sensor_id'],
-                sensor['sensor_type'],
-                value,
-                sensor['unit']
-            ])
-
-    print(f"[INFO] Sample data written to {filepath}")
+    if not 0 < rate_hz <= MAX_RATE_HZ:
+        raise ValueError(f"rate_hz must be in (0, {MAX_RATE_HZ:g}]: timestamps have whole-second resolution")
+    now = datetime.utcnow().replace(microsecond=0)
+    if start is None:
+        start = now - timedelta(seconds=duration_s)
+    if output == 'raw' and (start < now - timedelta(seconds=segment_log.LEGACY_CSV_WINDOW)
+                            or start.date() != now.date()
+                            or start + timedelta(seconds=duration_s) > now + timedelta(seconds=1)):
+        raise ValueError("output='raw' only covers today's last "
+                         f"{segment_log.LEGACY_CSV_WINDOW // 60} minutes, the CSVs aggregate_parquet.py reads; "
+                         "use output='segment' for backdated data")
+    rng = np.random.default_rng(seed)
+    data_dir = Path(data_dir) if data_dir else RAW_DATA_DIR.parent
+    config = build_load_config(n_sensors, n_sites)
+    catalog = records.SensorCatalog.from_config(config)
+
+    step = 1.0 / rate_hz
+    start_epoch = (start - datetime(1970, 1, 1)).total_seconds()
+    writer = segment_log.SegmentWriter(data_dir / 'raw' / 'segments') if output == 'segment' else None
+    written = 0
+    for chunk_start in np.arange(0, duration_s, chunk_seconds):
+        offsets = np.arange(chunk_start, min(chunk_start + chunk_seconds, duration_s), step)
+        epoch_seconds = np.floor(start_epoch + offsets).astype(np.int64)
+        readings = simulate_chunk(config, epoch_seconds, rng)
 
+        chunk_time = datetime.utcfromtimestamp(int(epoch_seconds[0]))
+        if output in ('segment', 'processed'):
+            batch = records.to_record_batch(readings, catalog)
+            table = pa.Table.from_batches([batch])
+        if writer is not None:
+            writer.append(batch)
+        elif output == 'processed':
+            file_name = f"{chunk_time.strftime('%Y-%m-%d_%H-%M')}.parquet"
+            for (date_str, project), part in archive.split_by_partition(table).items():
+                path = archive.partition_dir(data_dir / 'processed', date_str, project) / file_name
+                if path.exists():  # chunks shorter than a minute share a file
+                    part = pa.concat_tables([archive.read_readings(path), part])
+                archive.write_sorted(part, path)
+                bucket_sketches = sketches.build_sketches(part)
+                if bucket_sketches:
+                    sketches.write_sketches(bucket_sketches, sketches.sketch_path(path))
+        else:
+            folder = data_dir / 'raw' / chunk_time.strftime('%Y-%m-%d')
+            folder.mkdir(parents=True, exist_ok=True)
+            records.to_csv_frame(readings, catalog).to_csv(
+                folder / f"{chunk_time.strftime('%H-%M-%S')}.csv", index=False
+            )
+        written += len(readings)
+
+    if writer is not None:
+        writer.close()
+    metrics.ROWS.inc(written, stage="generate_load")
+    return written
+
+# ---------------------------
+# Entrypoint
+# ---------------------------
 if __name__ == '__main__':
-    generate_sample()
+    parser = argparse.ArgumentParser(description="Simulate sensor readings.")
+    parser.add_argument('--load', action='store_true', help="run the high-rate load generator")
+    parser.add_argument('--sensors', type=int, default=5000, help="number of sensors (load mode)")
+    parser.add_argument('--sites', type=int, default=10, help="number of sites (load mode)")
+    parser.add_argument('--rate', type=float, default=1.0,
+                        help=f"samples per second per sensor, at most {MAX_RATE_HZ:g}")
+    parser.add_argument('--duration', type=int, default=3600, help="seconds of data to generate")
+    parser.add_argument('--start', type=datetime.fromisoformat, default=None,
+                        help="first sample time, naive UTC ISO format (default: now - duration)")
+    parser.add_argument('--chunk', type=int, default=60, help="seconds of data per output file")
+    parser.add_argument('--data-dir', type=Path, default=None, help="base data directory")
+    parser.add_argument('--output', choices=['segment', 'raw', 'processed'], default='segment',
+                        help="segment: raw segment log, any age (default); raw: legacy CSVs, only today's "
+                             f"last {segment_log.LEGACY_CSV_WINDOW // 60} minutes (the window aggregation "
+                             "reads); processed: Parquet archive, skipping aggregation")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    if not 0 < args.rate <= MAX_RATE_HZ:
+        parser.error(f"--rate must be greater than 0 and at most {MAX_RATE_HZ:g} "
+                     "(timestamps have whole-second resolution)")
+
+    if args.load:
+        started = time.perf_counter()
+        rows = generate_load(args.sensors, args.sites, args.rate, args.duration, args.start,
+                             args.chunk, args.data_dir, args.output, args.seed)
+        elapsed = time.perf_counter() - started
+        print(f"[INFO] Generated {rows} readings in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+    else:
+        generate_sample()
+        get_segment_writer().close()
+    metrics.write_textfile("generate_sample_data")
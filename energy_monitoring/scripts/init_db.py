@@ -4,25 +4,29 @@ init_db.py
 Initializes the MySQL database schema for the energy monitoring system.
 
 - Creates tables: Projects, Sensors, Sensor_Data, Power_Generation
-- Connects to a running MySQL server using credentials from config
+- Creates Sensor_Data partitioned by month on its timestamp, clustered on a
+  (Sensor_ID, Timestamp) primary key (see partitions.py), and keeps monthly
+  partitions created ahead of time
+- Migrates an existing unpartitioned Sensor_Data table to that layout
+  (copy, deduplicate, swap); stop cron_manager.py while it runs
+- Enforces a unique (Project_ID, Aggregation_Interval, Timestamp) key on
+  Power_Generation and a unique (Project_ID, Sensor_Code) key on Sensors,
+  migrating existing installations in place
+- Connects to a running MySQL server using the shared settings in db.py
+  (config/db_config.json or DB_* environment variables)
 - Must be run manually once before starting the data pipeline
 
 Note: Assumes the database 'energy_monitoring' already exists.
 """
 
-import pymysql
 import logging
+from datetime import datetime, timezone
 
-# ---------------------------
-# DB Configuration
-# ---------------------------
-DB_CONFIG = {
-    "host": "localhost",
-    "port": 3306,
-    "user": "root",
-    "password": "Grid2030.",
-    "database": "energy_monitoring"
-}
+try:
+    from scripts import db, partitions
+except ImportError:  # executed directly as scripts/<name>.py
+    import db
+    import partitions
 
 # ---------------------------
 # SQL SCHEMA
@@ -47,18 +51,19 @@ CREATE TABLE IF NOT EXISTS Sensors (
     Unit VARCHAR(50) NOT NULL,
     Created_At TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (Project_ID) REFERENCES Projects(Project_ID)
-        ON DELETE CASCADE
+        ON DELETE CASCADE,
+    UNIQUE KEY idx_project_sensor_code (Project_ID, Sensor_Code)
 );
 
--- Sensor_Data table
+-- Sensor_Data table (monthly partitions are split off p_future by init_db.py)
 CREATE TABLE IF NOT EXISTS Sensor_Data (
-    Data_ID BIGINT AUTO_INCREMENT PRIMARY KEY,
     Sensor_ID INT NOT NULL,
     Timestamp TIMESTAMP NOT NULL,
     Value FLOAT NOT NULL,
-    FOREIGN KEY (Sensor_ID) REFERENCES Sensors(Sensor_ID)
-        ON DELETE CASCADE,
-    INDEX idx_sensor_time (Sensor_ID, Timestamp)
+    PRIMARY KEY (Sensor_ID, Timestamp)
+)
+PARTITION BY RANGE (UNIX_TIMESTAMP(Timestamp)) (
+    PARTITION p_future VALUES LESS THAN MAXVALUE
 );
 
 -- Power_Generation table
@@ -70,17 +75,129 @@ CREATE TABLE IF NOT EXISTS Power_Generation (
     Aggregation_Interval ENUM('30s', '5min', 'hourly', 'daily') DEFAULT 'hourly',
     Derived_From_Sensor INT,
     FOREIGN KEY (Project_ID) REFERENCES Projects(Project_ID),
-    FOREIGN KEY (Derived_From_Sensor) REFERENCES Sensors(Sensor_ID)
+    FOREIGN KEY (Derived_From_Sensor) REFERENCES Sensors(Sensor_ID),
+    UNIQUE KEY idx_project_interval_time (Project_ID, Aggregation_Interval, Timestamp)
 );
 """
 
+# ---------------------------
+# Migrations
+# ---------------------------
+MIGRATION_CHUNK_ROWS = 100000
+
+def migrate_sensor_data_to_partitions(conn, cursor):
+    """
+    Rebuild an unpartitioned Sensor_Data table in the partitioned layout.
+
+    Rows are copied in Data_ID order and in chunks into a new partitioned
+    table (INSERT IGNORE on the new primary key keeps the first of any
+    duplicate (Sensor_ID, Timestamp) rows), then the tables are swapped with
+    an atomic RENAME and the old table is dropped.
+    """
+    if partitions.list_partitions(cursor):
+        return
+
+    logging.info("Migrating Sensor_Data to the monthly partitioned layout.")
+    cursor.execute("SELECT UNIX_TIMESTAMP(MIN(Timestamp)), MIN(Data_ID), MAX(Data_ID) FROM Sensor_Data")
+    first_epoch, min_id, max_id = cursor.fetchone()
+    now = datetime.now(timezone.utc)
+    first_month = datetime.fromtimestamp(first_epoch, timezone.utc) if first_epoch else now
+    last_month = partitions.add_months(partitions.month_start(now), partitions.MONTHS_AHEAD)
+
+    cursor.execute("DROP TABLE IF EXISTS Sensor_Data_partitioned")
+    cursor.execute(f"""
+        CREATE TABLE Sensor_Data_partitioned (
+            Sensor_ID INT NOT NULL,
+            Timestamp TIMESTAMP NOT NULL,
+            Value FLOAT NOT NULL,
+            PRIMARY KEY (Sensor_ID, Timestamp)
+        )
+        {partitions.partition_ddl(first_month, last_month)}
+    """)
+    if min_id is not None:
+        for start in range(int(min_id), int(max_id) + 1, MIGRATION_CHUNK_ROWS):
+            cursor.execute("""
+                INSERT IGNORE INTO Sensor_Data_partitioned (Sensor_ID, Timestamp, Value)
+                SELECT Sensor_ID, Timestamp, Value FROM Sensor_Data
+                WHERE Data_ID >= %s AND Data_ID < %s
+                ORDER BY Data_ID
+            """, (start, start + MIGRATION_CHUNK_ROWS))
+            conn.commit()
+    cursor.execute(
+        "RENAME TABLE Sensor_Data TO Sensor_Data_unpartitioned, Sensor_Data_partitioned TO Sensor_Data"
+    )
+    cursor.execute("DROP TABLE Sensor_Data_unpartitioned")
+    logging.info("Sensor_Data migration complete.")
+
+def ensure_power_generation_unique_key(cursor):
+    """
+    Add the unique rollup key to an existing Power_Generation table.
+
+    rollup_power.py upserts on this key, so each (project, interval, bucket)
+    holds exactly one row. Duplicates are removed first, keeping the newest.
+    """
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'Power_Generation'
+          AND INDEX_NAME = 'idx_project_interval_time'
+        LIMIT 1
+    """)
+    if cursor.fetchone():
+        return
+
+    logging.info("Migrating Power_Generation: enforcing unique (Project_ID, Aggregation_Interval, Timestamp).")
+    cursor.execute("""
+        DELETE g1 FROM Power_Generation g1
+        JOIN Power_Generation g2
+          ON g1.Project_ID = g2.Project_ID
+         AND g1.Aggregation_Interval = g2.Aggregation_Interval
+         AND g1.Timestamp = g2.Timestamp
+         AND g1.Generation_ID < g2.Generation_ID
+    """)
+    cursor.execute(
+        "ALTER TABLE Power_Generation "
+        "ADD UNIQUE KEY idx_project_interval_time (Project_ID, Aggregation_Interval, Timestamp)"
+    )
+
+def ensure_sensor_code_unique_key(cursor):
+    """
+    Add the unique (Project_ID, Sensor_Code) key to an existing Sensors table.
+
+    sensor_registry.py bulk-registers sensors with INSERT IGNORE on this key,
+    so concurrent registrations cannot create the same sensor twice. Existing
+    duplicates are referenced by Sensor_Data, so they are reported instead of
+    deleted and the key is left out until they are merged by hand.
+    """
+    cursor.execute("""
+        SELECT 1 FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME = 'Sensors'
+          AND INDEX_NAME = 'idx_project_sensor_code'
+        LIMIT 1
+    """)
+    if cursor.fetchone():
+        return
+
+    cursor.execute("""
+        SELECT Project_ID, Sensor_Code, COUNT(*) FROM Sensors
+        GROUP BY Project_ID, Sensor_Code HAVING COUNT(*) > 1
+    """)
+    duplicates = cursor.fetchall()
+    if duplicates:
+        logging.error(f"Sensors has duplicate (Project_ID, Sensor_Code) rows, not adding unique key: {duplicates}")
+        return
+    logging.info("Migrating Sensors: enforcing unique (Project_ID, Sensor_Code).")
+    cursor.execute("ALTER TABLE Sensors ADD UNIQUE KEY idx_project_sensor_code (Project_ID, Sensor_Code)")
+
 # ---------------------------
 # Database Initializer
 # ---------------------------
 def create_mysql_schema():
     """Connect to MySQL and create tables if they don't exist."""
+    conn = None
     try:
-        conn = pymysql.connect(**DB_CONFIG)
+        conn = db.connect()
         cursor = conn.cursor()
         cursor.execute("SELECT DATABASE();")
         logging.info(f"Connected to DB: {cursor.fetchone()[0]}")
@@ -88,6 +205,12 @@ def create_mysql_schema():
         for stmt in SCHEMA_SQL.strip().split(";"):
             if stmt.strip():
                 cursor.execute(stmt + ";")
+        migrate_sensor_data_to_partitions(conn, cursor)
+        created = partitions.ensure_future_partitions(cursor)
+        if created:
+            logging.info(f"Created Sensor_Data partitions: {', '.join(created)}")
+        ensure_power_generation_unique_key(cursor)
+        ensure_sensor_code_unique_key(cursor)
         conn.commit()
         logging.info("Schema created successfully.")
     except Exception as e:
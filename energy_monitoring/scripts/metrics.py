@@ -0,0 +1,221 @@
+"""
+metrics.py
+
+Lightweight pipeline metrics shared by all scripts and cron_manager.py.
+
+- Counters, gauges and histograms with labels, kept in a process-wide registry
+- Rendered in the Prometheus text exposition format
+- Written atomically to logs/metrics/<name>.prom (node_exporter textfile
+  collector compatible) and optionally served over HTTP on a local port
+
+Recording a sample is a dict update under a lock, so instrumentation is cheap
+enough to leave on in production on a Raspberry Pi. Only the standard library
+is used.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+METRICS_DIR = Path(os.environ.get("METRICS_DIR", Path(__file__).parent.parent / "logs" / "metrics"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_registry = {}
+_constant_labels = ()     # added to every sample, see set_constant_labels()
+
+# ---------------------------
+# Metric Types
+# ---------------------------
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key, extra=()):
+    pairs = list(_constant_labels) + list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+class Counter:
+    """Monotonically increasing value, e.g. rows processed."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+class Gauge(Counter):
+    """Value that can go up and down, e.g. backlog depth."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[_label_key(labels)] = value
+
+class Histogram:
+    """Distribution of observations in cumulative buckets, e.g. durations."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}    # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, state in self.values.items():
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {count}"
+            yield f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_value(state[-2])}"
+            yield f"{self.name}_count{_format_labels(key)} {state[-1]}"
+
+def _register(metric):
+    with _lock:
+        return _registry.setdefault(metric.name, metric)
+
+def counter(name, help_text):
+    """Return the registered Counter called name, creating it if needed."""
+    return _register(Counter(name, help_text))
+
+def gauge(name, help_text):
+    """Return the registered Gauge called name, creating it if needed."""
+    return _register(Gauge(name, help_text))
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """Return the registered Histogram called name, creating it if needed."""
+    return _register(Histogram(name, help_text, buckets))
+
+# ---------------------------
+# Pipeline Metrics
+# ---------------------------
+STAGE_DURATION = histogram("pipeline_stage_duration_seconds", "Wall-clock duration of a pipeline stage.")
+ROWS = counter("pipeline_rows_total", "Rows processed by a pipeline stage.")
+BYTES = counter("pipeline_bytes_total", "Bytes read or written by a pipeline stage.")
+BACKLOG = gauge("pipeline_backlog_files", "Files waiting to be processed by a stage.")
+DB_ROUNDTRIPS = counter("pipeline_db_roundtrips_total", "Database round trips issued by a stage.")
+DB_CONNECTS = counter("pipeline_db_connects_total", "New database connections opened, by outcome.")
+HTTP_LATENCY = histogram("pipeline_http_request_seconds", "ThingSpeak HTTP request latency.")
+UPLOAD_LAG = gauge("pipeline_thingspeak_lag_seconds", "Seconds since a channel's last accepted ThingSpeak update.")
+SCHEDULER_LAG = histogram("pipeline_scheduler_lag_seconds", "Delay between a job being triggered and starting.")
+QUARANTINED = counter("pipeline_quarantined_rows_total", "Readings rejected by validation, by reason.")
+JOB_FAILURES = counter("pipeline_job_failures_total", "Scheduled job runs that raised an exception.")
+
+def set_constant_labels(**labels):
+    """
+    Label every sample of this process, e.g. shard="2" in a shard worker
+    (shards.py), so the textfiles of parallel processes do not collide.
+    """
+    global _constant_labels
+    _constant_labels = tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def timed(stage):
+    """Context manager recording the duration of a stage in STAGE_DURATION."""
+    return STAGE_DURATION.time(stage=stage)
+
+# ---------------------------
+# Exposition
+# ---------------------------
+def render():
+    """
+    Render every registered metric in the Prometheus text format.
+
+    Returns:
+        str: Exposition text ending with a newline
+    """
+    lines = []
+    with _lock:
+        for metric in _registry.values():
+            if not metric.values:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+def write_textfile(name):
+    """
+    Atomically write the current metrics to METRICS_DIR/<name>.prom.
+
+    Failures are swallowed: metrics must never break a pipeline run.
+    """
+    try:
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        target = METRICS_DIR / f"{name}.prom"
+        tmp_file = target.with_suffix(".tmp")
+        tmp_file.write_text(render())
+        os.replace(tmp_file, target)
+    except OSError:
+        pass
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_http_server(port, host="127.0.0.1"):
+    """
+    Serve /metrics from a daemon thread; intended for long-running processes.
+
+    Returns:
+        ThreadingHTTPServer: The running server (call shutdown() to stop it)
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
@@ -0,0 +1,160 @@
+"""
+partitions.py
+
+Monthly RANGE partitioning of the Sensor_Data table.
+
+Sensor_Data is partitioned on UNIX_TIMESTAMP(Timestamp), one partition per
+UTC calendar month, with (Sensor_ID, Timestamp) as the primary (clustering)
+key:
+
+- pYYYYMM holds the rows of that month (the oldest partition also holds
+  anything earlier); p_future (VALUES LESS THAN MAXVALUE) is kept empty by
+  creating months ahead of time, so splitting it never moves data
+- Bounds are written as epoch integers computed here, so they do not depend
+  on the MySQL session time zone
+- Expired months are removed with DROP PARTITION (a metadata operation)
+  instead of DELETE, optionally after EXCHANGE PARTITION into a standalone
+  Sensor_Data_pYYYYMM table that can be dumped or kept as an archive
+
+MySQL does not allow foreign keys on partitioned tables, so Sensor_Data no
+longer references Sensors; upload_to_sql.py only inserts mapped Sensor_IDs.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+# ---------------------------
+# Constants
+# ---------------------------
+TABLE = "Sensor_Data"
+FUTURE_PARTITION = "p_future"
+MONTHS_AHEAD = 2
+
+PARTITION_BY = "PARTITION BY RANGE (UNIX_TIMESTAMP(Timestamp))"
+
+# ---------------------------
+# Month Arithmetic
+# ---------------------------
+def month_start(moment):
+    """First instant (UTC, aware) of the month containing moment."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    moment = moment.astimezone(timezone.utc)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def add_months(month, count):
+    """Shift a month_start() value by count months."""
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+def partition_name(month):
+    return f"p{month:%Y%m}"
+
+def partition_clause(month):
+    """Partition definition holding month (rows below the next month's start)."""
+    bound = int(add_months(month, 1).timestamp())
+    return f"PARTITION {partition_name(month)} VALUES LESS THAN ({bound})"
+
+def future_clause():
+    return f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE"
+
+def partition_ddl(first_month, last_month):
+    """
+    PARTITION BY clause with monthly partitions from first_month to
+    last_month (inclusive) plus p_future.
+    """
+    clauses = []
+    month = month_start(first_month)
+    while month <= month_start(last_month):
+        clauses.append(partition_clause(month))
+        month = add_months(month, 1)
+    clauses.append(future_clause())
+    return PARTITION_BY + " (\n    " + ",\n    ".join(clauses) + "\n)"
+
+# ---------------------------
+# Planning
+# ---------------------------
+def plan_future_partitions(partitions, now=None, months_ahead=MONTHS_AHEAD):
+    """
+    Months that must be split off p_future so the table covers the current
+    month plus months_ahead.
+
+    Args:
+        partitions (list): [(name, upper_bound_epoch or None for MAXVALUE)]
+
+    Returns:
+        list: month_start() values to create, oldest first
+    """
+    now = now or datetime.now(timezone.utc)
+    bounds = [bound for _, bound in partitions if bound is not None]
+    if bounds:
+        month = month_start(datetime.fromtimestamp(max(bounds), timezone.utc))
+    else:
+        month = month_start(now)
+    last = add_months(month_start(now), months_ahead)
+
+    months = []
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+def expired_partitions(partitions, retention_days, now=None):
+    """
+    Names of monthly partitions whose rows are all older than the retention.
+
+    A partition expires once its upper bound is at or before now - retention.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=retention_days)).timestamp()
+    return [name for name, bound in partitions if bound is not None and bound <= cutoff]
+
+# ---------------------------
+# Database Operations
+# ---------------------------
+def list_partitions(cursor, table=TABLE):
+    """
+    Return the table's partitions in order.
+
+    Returns:
+        list: [(name, upper_bound_epoch or None)]; empty if not partitioned
+    """
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (table,))
+    return [
+        (name, None if description == "MAXVALUE" else int(description))
+        for name, description in cursor.fetchall()
+    ]
+
+def ensure_future_partitions(cursor, now=None, months_ahead=MONTHS_AHEAD, table=TABLE):
+    """
+    Split the months up to now + months_ahead off p_future.
+
+    Returns:
+        list: Names of the partitions created
+    """
+    months = plan_future_partitions(list_partitions(cursor, table), now, months_ahead)
+    if not months:
+        return []
+    clauses = [partition_clause(month) for month in months] + [future_clause()]
+    cursor.execute(
+        f"ALTER TABLE {table} REORGANIZE PARTITION {FUTURE_PARTITION} INTO ({', '.join(clauses)})"
+    )
+    return [partition_name(month) for month in months]
+
+def drop_partitions(cursor, names, exchange=False, table=TABLE):
+    """
+    Remove whole partitions, optionally exchanging each into a standalone
+    <table>_<partition> table first so its rows are kept outside the table.
+    """
+    if not names:
+        return
+    if exchange:
+        for name in names:
+            archive_table = f"{table}_{name}"
+            cursor.execute(f"CREATE TABLE {archive_table} LIKE {table}")  # fails if it exists
+            cursor.execute(f"ALTER TABLE {archive_table} REMOVE PARTITIONING")
+            cursor.execute(f"ALTER TABLE {table} EXCHANGE PARTITION {name} WITH TABLE {archive_table}")
+    cursor.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(names)}")
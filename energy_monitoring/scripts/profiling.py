@@ -0,0 +1,298 @@
+"""
+profiling.py
+
+Opt-in profiling of the pipeline entry points, for finding out where a slow
+run on the Pi spends its time without editing any script.
+
+Enabled with the PROFILE environment variable (or cron_manager.py --profile),
+a comma-separated list of modes:
+
+- cprofile: deterministic cProfile of the entry point's thread
+  -> <stage>-<time>.pstats (python -m pstats, snakeviz)
+- sample: statistical sampler walking every thread's stack each
+  PROFILE_SAMPLE_INTERVAL seconds -> <stage>-<time>.collapsed
+  (flamegraph.pl / speedscope "collapsed stack" format, one line per stack)
+- tracemalloc: Python allocations, peak and top allocation sites
+  -> <stage>-<time>.tracemalloc.txt
+- spans: wall-clock time per phase (read, transform, write, db, http) as
+  marked by span()/timed_iter() in the scripts -> <stage>-<time>.spans.json;
+  phases run by worker threads are summed, so they can exceed the wall time
+- all: every mode above
+
+    PROFILE=spans,sample python scripts/upload_to_sql.py
+
+Profiles are written to logs/profiles/ (PROFILE_DIR); only the newest
+PROFILE_KEEP runs of each stage are kept. When PROFILE is empty the wrappers
+cost one set lookup per call: span() returns a shared no-op context manager
+and timed_iter() returns its iterable unchanged.
+
+Only the standard library is used.
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", Path(__file__).parent.parent / "logs" / "profiles"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 20))                          # runs kept per stage
+SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.01))        # seconds
+TRACEMALLOC_FRAMES = 8
+TRACEMALLOC_TOP = 40
+
+MODES = ("cprofile", "sample", "tracemalloc", "spans")
+
+_NULL_SPAN = nullcontext()
+_lock = threading.Lock()
+_modes = frozenset()
+_active = set()         # stages currently being profiled
+_spans = {}             # stage -> {phase: [seconds, calls]}
+_tracemalloc_users = 0
+_tracemalloc_owned = False     # started here, so stopped here
+
+def parse_modes(text):
+    """
+    Returns:
+        frozenset: Modes named in a comma-separated string ("all" = every mode)
+
+    Raises:
+        ValueError: For an unknown mode
+    """
+    modes = {m.strip().lower() for m in (text or "").split(",") if m.strip()}
+    if "all" in modes:
+        return frozenset(MODES)
+    unknown = modes.difference(MODES)
+    if unknown:
+        raise ValueError(f"Unknown profiling mode(s) {sorted(unknown)}; expected {', '.join(MODES)} or all")
+    return frozenset(modes)
+
+def configure(modes):
+    """Enable the given modes (string or iterable) for this process; empty disables."""
+    global _modes
+    _modes = parse_modes(modes if isinstance(modes, str) else ",".join(modes or ()))
+    return _modes
+
+def enabled(mode=None):
+    return bool(_modes) if mode is None else mode in _modes
+
+try:
+    configure(os.environ.get("PROFILE", ""))
+except ValueError as e:
+    logging.error(f"PROFILE ignored: {e}")
+
+# ---------------------------
+# Phase Spans
+# ---------------------------
+@contextmanager
+def _span(stage, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            if stage in _active:
+                entry = _spans.setdefault(stage, {}).setdefault(phase, [0.0, 0])
+                entry[0] += elapsed
+                entry[1] += 1
+
+def span(stage, phase):
+    """with span("upload_parquet_to_sql", "db"): ... -- times one phase of a run."""
+    if "spans" not in _modes:
+        return _NULL_SPAN
+    return _span(stage, phase)
+
+def timed_iter(stage, phase, iterable):
+    """Iterate, attributing the time spent producing each item to phase."""
+    if "spans" not in _modes:
+        return iterable
+    return _timed_iter(stage, phase, iterable)
+
+def _timed_iter(stage, phase, iterable):
+    iterator = iter(iterable)
+    while True:
+        with _span(stage, phase):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+# ---------------------------
+# Sampling Profiler
+# ---------------------------
+class StackSampler:
+    """Collect the stacks of every other thread every interval seconds."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="profile-sampler")
+
+    def start(self):
+        self.thread.start()
+
+    def close(self):
+        self.stop.set()
+        self.thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{Path(code.co_filename).name}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+# ---------------------------
+# Entry Point Wrapper
+# ---------------------------
+def profiled(stage):
+    """
+    Decorator for a pipeline entry point; profiles each call with the
+    enabled modes and writes the results to PROFILE_DIR.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _modes:
+                return fn(*args, **kwargs)
+            return _run_profiled(stage, fn, args, kwargs)
+        return wrapper
+    return decorator
+
+def _run_profiled(stage, fn, args, kwargs):
+    global _tracemalloc_users, _tracemalloc_owned
+    modes = _modes
+    profiler = sampler = None
+    with _lock:
+        _active.add(stage)
+        _spans.pop(stage, None)
+        if "tracemalloc" in modes:
+            if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                _tracemalloc_owned = True
+            _tracemalloc_users += 1
+            tracemalloc.reset_peak()
+    if "sample" in modes:
+        sampler = StackSampler()
+        sampler.start()
+    if "cprofile" in modes:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:     # another profiler is active in this thread
+            logging.warning(f"[{stage}] cProfile unavailable: {e}")
+            profiler = None
+
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+        if sampler:
+            sampler.close()
+        snapshot = peak = None
+        with _lock:
+            _active.discard(stage)
+            spans = _spans.pop(stage, {}) if "spans" in modes else None
+            if "tracemalloc" in modes:
+                snapshot = tracemalloc.take_snapshot()
+                peak = tracemalloc.get_traced_memory()[1]
+                _tracemalloc_users -= 1
+                if _tracemalloc_users == 0 and _tracemalloc_owned:
+                    tracemalloc.stop()
+                    _tracemalloc_owned = False
+        try:
+            write_profiles(stage, started_at, seconds, profiler, sampler, snapshot, peak, spans)
+        except OSError as e:
+            logging.error(f"[{stage}] Could not write profile: {e}")
+
+# ---------------------------
+# Output
+# ---------------------------
+def write_profiles(stage, started_at, seconds, profiler, sampler, snapshot, peak, spans):
+    """
+    Write one run's profiles as PROFILE_DIR/<stage>-<time>.* and rotate old runs.
+
+    Args:
+        profiler (cProfile.Profile): Disabled profiler, or None
+        sampler (StackSampler): Stopped sampler, or None
+        snapshot (tracemalloc.Snapshot): Allocations at the end of the run, or None
+        peak (int): Peak traced bytes during the run
+        spans (dict): {phase: [seconds, calls]}, or None when spans are off
+
+    Returns:
+        Path: Common path prefix of the written files
+    """
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    base = PROFILE_DIR / f"{stage}-{started_at.strftime('%Y%m%dT%H%M%S%fZ')}"
+    written = []
+
+    if profiler:
+        profiler.dump_stats(f"{base}.pstats")
+        written.append(f"{base.name}.pstats")
+    if sampler:
+        Path(f"{base}.collapsed").write_text(sampler.collapsed())
+        written.append(f"{base.name}.collapsed")
+    if snapshot:
+        lines = [f"stage {stage}  wall {seconds:.3f}s  traced peak {peak / 2**20:.1f} MiB", ""]
+        for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+            frame = stat.traceback[0]
+            lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+        Path(f"{base}.tracemalloc.txt").write_text("\n".join(lines) + "\n")
+        written.append(f"{base.name}.tracemalloc.txt")
+    if spans is not None:
+        document = {
+            "stage": stage,
+            "started_at": started_at.replace(microsecond=0).isoformat(),
+            "seconds": round(seconds, 6),
+            "phases": {
+                phase: {"seconds": round(total, 6), "calls": calls}
+                for phase, (total, calls) in sorted(spans.items(), key=lambda item: -item[1][0])
+            },
+        }
+        Path(f"{base}.spans.json").write_text(json.dumps(document, indent=1) + "\n")
+        written.append(f"{base.name}.spans.json")
+
+    rotate(stage)
+    if written:
+        logging.info(f"[{stage}] Profile written ({seconds:.2f}s): {', '.join(written)}")
+    return base
+
+def rotate(stage, keep=None):
+    """Delete all but the newest `keep` runs of a stage (all files of a run together)."""
+    keep = PROFILE_KEEP if keep is None else keep
+    runs = {}
+    for path in PROFILE_DIR.glob(f"{stage}-*"):
+        runs.setdefault(path.name.split(".", 1)[0], []).append(path)
+    names = sorted(runs)
+    for run in names[:max(len(names) - keep, 0)]:
+        for path in runs[run]:
+            path.unlink(missing_ok=True)
@@ -0,0 +1,348 @@
+import sys
+import argparse
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import unquote
+
+import pandas as pd
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+try:
+    from scripts import archive, sketches
+except ImportError:  # executed directly as scripts/<name>.py
+    import archive
+    import sketches
+
+"""
+query_archive.py
+
+Local analytical queries over the processed Parquet archive (data/processed/),
+so ad-hoc analysis never touches the operational MySQL instance.
+
+- Filters on time range, projects and sensors are pushed down to the dataset
+  scan: date= / project= partitions are pruned and, because files are sorted
+  by sensor and time, most row groups are skipped from their statistics
+- Resampling to fixed intervals (30s, 5min, 1h, 1d, ...) is computed batch by
+  batch into small partial aggregates, so a month of data is never loaded
+  into memory at once
+- Results come back as long Arrow tables or, for several sensors, as one
+  aligned wide DataFrame indexed by bucket time
+- Percentiles of voltage, current and wind speed are answered by merging the
+  hourly sketches stored with the archive (sketches.py), never by rescanning
+  raw values; accuracy is relative (1% by default) and ranges snap to hours
+
+Example:
+    python scripts/query_archive.py --project HAWT --sensor Irr_1 \\
+        --start 2025-06-03 --end 2025-06-04 --interval 1h --agg mean
+"""
+
+
+# ---------------------------
+# Constants
+# ---------------------------
+PROCESSED_DIR = archive.PROCESSED_DIR
+
+TIMESTAMP_TYPE = pa.timestamp("s", tz="UTC")
+
+AGGREGATIONS = ("mean", "min", "max", "sum", "count")
+
+# Partial aggregate rows kept before they are combined again
+COMBINE_ROWS = 256 * 1024
+
+INTERVAL_UNITS = {"s": 1, "min": 60, "m": 60, "h": 3600, "d": 86400}
+
+# ---------------------------
+# Helpers
+# ---------------------------
+def parse_interval(text):
+    """
+    Parse an interval such as "30s", "5min", "1h" or "1d".
+
+    Returns:
+        int: Interval length in seconds
+    """
+    text = str(text).strip().lower()
+    for unit in sorted(INTERVAL_UNITS, key=len, reverse=True):
+        if text.endswith(unit) and text[:-len(unit)].isdigit():
+            seconds = int(text[:-len(unit)]) * INTERVAL_UNITS[unit]
+            if seconds > 0:
+                return seconds
+    raise ValueError(f"Invalid interval: {text!r} (expected e.g. 30s, 5min, 1h, 1d)")
+
+def to_utc(value):
+    """Convert a datetime or ISO-8601 string to an aware UTC datetime (naive = UTC)."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def build_filter(start=None, end=None, sensors=None, projects=None):
+    """
+    Build the dataset filter expression for a query.
+
+    Args:
+        start (datetime): Inclusive lower bound on timestamp
+        end (datetime): Exclusive upper bound on timestamp
+        sensors (list): sensor_id values to keep
+        projects (list): project_id values to keep
+
+    Returns:
+        pyarrow.dataset.Expression or None
+    """
+    # Partition keys are null for flat files not yet moved by compact_parquet.py
+    def partition(name, condition):
+        return ds.field(name).is_null() | condition
+
+    conditions = []
+    if start is not None:
+        start = to_utc(start)
+        conditions.append(partition("date", ds.field("date") >= start.strftime("%Y-%m-%d")))
+        conditions.append(ds.field("timestamp") >= pa.scalar(start, type=TIMESTAMP_TYPE))
+    if end is not None:
+        end = to_utc(end)
+        conditions.append(partition("date", ds.field("date") <= end.strftime("%Y-%m-%d")))
+        conditions.append(ds.field("timestamp") < pa.scalar(end, type=TIMESTAMP_TYPE))
+    if sensors:
+        conditions.append(ds.field("sensor_id").isin(list(sensors)))
+    if projects:
+        conditions.append(partition("project", ds.field("project").isin(list(projects))))
+        conditions.append(ds.field("project_id").isin(list(projects)))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+# ---------------------------
+# Query API
+# ---------------------------
+def scan(start=None, end=None, sensors=None, projects=None, base=None, batch_size=128 * 1024):
+    """
+    Stream the matching readings as record batches.
+
+    Yields:
+        pyarrow.RecordBatch: timestamp, project_id, sensor_id, value columns
+    """
+    dataset = archive.open_dataset(base)
+    yield from dataset.to_batches(
+        columns=["timestamp", "project_id", "sensor_id", "value"],
+        filter=build_filter(start, end, sensors, projects),
+        batch_size=batch_size
+    )
+
+def readings(start=None, end=None, sensors=None, projects=None, base=None):
+    """
+    Return the matching raw readings, sorted by project, sensor and time.
+
+    Returns:
+        pyarrow.Table: timestamp, project_id, sensor_id, value
+    """
+    batches = list(scan(start, end, sensors, projects, base))
+    schema = pa.schema([archive.ARCHIVE_SCHEMA.field(n) for n in ("timestamp", "project_id", "sensor_id", "value")])
+    table = pa.Table.from_batches(batches, schema=schema).combine_chunks()
+    keys = pa.table({
+        "project_id": table["project_id"].cast(pa.string()),
+        "sensor_id": table["sensor_id"].cast(pa.string()),
+        "timestamp": table["timestamp"],
+    })
+    order = pc.sort_indices(keys, sort_keys=[(n, "ascending") for n in keys.column_names])
+    return table.take(order)
+
+def _partial_aggregate(batch, interval):
+    """Per-bucket sum/count/min/max of one batch."""
+    epoch = pc.cast(batch.column("timestamp"), pa.int64())
+    bucket = pc.multiply(pc.divide(epoch, interval), interval)
+    table = pa.table({
+        "project_id": batch.column("project_id").cast(pa.string()),
+        "sensor_id": batch.column("sensor_id").cast(pa.string()),
+        "bucket": bucket,
+        "value": batch.column("value"),
+    })
+    return table.group_by(["project_id", "sensor_id", "bucket"]).aggregate([
+        ("value", "sum"), ("value", "count"), ("value", "min"), ("value", "max")
+    ])
+
+def _combine(partials):
+    """Merge partial aggregates that may share buckets."""
+    table = pa.concat_tables(partials)
+    combined = table.group_by(["project_id", "sensor_id", "bucket"]).aggregate([
+        ("value_sum", "sum"), ("value_count", "sum"), ("value_min", "min"), ("value_max", "max")
+    ])
+    return pa.table({
+        "project_id": combined["project_id"],
+        "sensor_id": combined["sensor_id"],
+        "bucket": combined["bucket"],
+        "value_sum": combined["value_sum_sum"],
+        "value_count": combined["value_count_sum"],
+        "value_min": combined["value_min_min"],
+        "value_max": combined["value_max_max"],
+    })
+
+def resample(interval, start=None, end=None, sensors=None, projects=None, agg="mean", base=None):
+    """
+    Aggregate readings into fixed, epoch-aligned time buckets out of core.
+
+    Args:
+        interval (str|int): Bucket size, e.g. "5min", or seconds
+        start, end (datetime|str): Time range [start, end), UTC
+        sensors (list): sensor_id filter
+        projects (list): project_id filter
+        agg (str): One of AGGREGATIONS
+        base (Path): Archive root, defaults to data/processed/
+
+    Returns:
+        pyarrow.Table: project_id, sensor_id, timestamp (bucket start), value
+    """
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation {agg!r}; expected one of {AGGREGATIONS}")
+    seconds = interval if isinstance(interval, int) else parse_interval(interval)
+
+    partials, partial_rows = [], 0
+    for batch in scan(start, end, sensors, projects, base):
+        if batch.num_rows == 0:
+            continue
+        partial = _partial_aggregate(batch, seconds)
+        partials.append(partial)
+        partial_rows += partial.num_rows
+        if partial_rows >= COMBINE_ROWS:
+            partials = [_combine(partials)]
+            partial_rows = partials[0].num_rows
+
+    if not partials:
+        return pa.table({
+            "project_id": pa.array([], pa.string()), "sensor_id": pa.array([], pa.string()),
+            "timestamp": pa.array([], TIMESTAMP_TYPE), "value": pa.array([], pa.float64()),
+        })
+
+    result = _combine(partials)
+    if agg == "mean":
+        value = pc.divide(result["value_sum"], pc.cast(result["value_count"], pa.float64()))
+    elif agg == "count":
+        value = result["value_count"]
+    else:
+        value = result[f"value_{agg}"]
+    table = pa.table({
+        "project_id": result["project_id"],
+        "sensor_id": result["sensor_id"],
+        "timestamp": pc.cast(result["bucket"], TIMESTAMP_TYPE),
+        "value": value,
+    })
+    order = pc.sort_indices(table, sort_keys=[("project_id", "ascending"), ("sensor_id", "ascending"),
+                                              ("timestamp", "ascending")])
+    return table.take(order)
+
+def aligned(interval, start=None, end=None, sensors=None, projects=None, agg="mean", base=None):
+    """
+    Resample several sensors onto a shared time index.
+
+    Returns:
+        pandas.DataFrame: One column per "<project_id>/<sensor_id>", indexed by
+        bucket start; buckets without data for a sensor are NaN
+    """
+    df = resample(interval, start, end, sensors, projects, agg, base).to_pandas()
+    df["series"] = df["project_id"] + "/" + df["sensor_id"]
+    wide = df.pivot(index="timestamp", columns="series", values="value")
+    wide.columns.name = None
+    return wide
+
+def quantiles(qs, start=None, end=None, sensors=None, projects=None, interval=None, base=None):
+    """
+    Estimate percentiles over a range by merging stored hourly sketches.
+
+    Args:
+        qs (list): Quantiles in [0, 1], e.g. [0.05, 0.5, 0.95]
+        start, end (datetime|str): Time range [start, end), UTC; hours
+            overlapping the range are included whole
+        sensors (list): sensor_id filter
+        projects (list): project_id filter
+        interval (str): Optional per-bucket breakdown ("1h", "1d", ...);
+            None merges the whole range
+        base (Path): Archive root, defaults to data/processed/
+
+    Returns:
+        pandas.DataFrame: project_id, sensor_id, [timestamp,] count, mean, min,
+        max and one "p<q*100>" column per quantile
+    """
+    start = to_utc(start) if start is not None else None
+    end = to_utc(end) if end is not None else None
+    low = pd.Timestamp(start).floor(sketches.BUCKET) if start else None
+    seconds = parse_interval(interval) if interval else None
+
+    merged = {}
+    for partition in archive.iter_partition_dirs(base or PROCESSED_DIR):
+        date_str = partition.parent.name.split("=", 1)[1]
+        project = unquote(partition.name.split("=", 1)[1])
+        if projects and project not in projects:
+            continue
+        if (start and date_str < start.strftime("%Y-%m-%d")) or (end and date_str > end.strftime("%Y-%m-%d")):
+            continue
+        for path in sorted((partition / sketches.SKETCH_DIR_NAME).glob("*.parquet")):
+            for (sensor_id, bucket), sketch in sketches.read_sketches(path).items():
+                if sensors and sensor_id not in sensors:
+                    continue
+                if (low is not None and bucket < low) or (end is not None and bucket >= end):
+                    continue
+                key = (project, sensor_id)
+                if seconds:
+                    key += (pd.Timestamp(bucket.value // 10**9 // seconds * seconds, unit="s", tz="UTC"),)
+                if key in merged:
+                    merged[key].merge(sketch)
+                else:
+                    merged[key] = sketches.QuantileSketch(sketch.alpha).merge(sketch)
+
+    names = [f"p{q * 100:g}" for q in qs]
+    key_columns = ["project_id", "sensor_id"] + (["timestamp"] if seconds else [])
+    rows = []
+    for key, sketch in sorted(merged.items()):
+        row = dict(zip(key_columns, key))
+        row.update(count=sketch.count, mean=sketch.sum / sketch.count, min=sketch.min, max=sketch.max)
+        row.update(zip(names, sketch.quantiles(qs)))
+        rows.append(row)
+    return pd.DataFrame(rows, columns=key_columns + ["count", "mean", "min", "max"] + names)
+
+# ---------------------------
+# Command Line
+# ---------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query the local Parquet archive.")
+    parser.add_argument("--start", help="inclusive start (ISO-8601, UTC); default: 24h ago")
+    parser.add_argument("--end", help="exclusive end (ISO-8601, UTC); default: now")
+    parser.add_argument("--sensor", action="append", help="sensor_id to include (repeatable)")
+    parser.add_argument("--project", action="append", help="project_id to include (repeatable)")
+    parser.add_argument("--interval", help="resample to fixed buckets, e.g. 30s, 5min, 1h, 1d")
+    parser.add_argument("--agg", choices=AGGREGATIONS, default="mean")
+    parser.add_argument("--wide", action="store_true", help="one column per sensor (needs --interval)")
+    parser.add_argument("--quantiles", help="comma-separated quantiles from the stored sketches, e.g. 0.05,0.5,0.95")
+    parser.add_argument("--output", type=Path, help="write CSV (or .parquet) here instead of stdout")
+    parser.add_argument("--base", type=Path, default=None, help="archive root directory")
+    args = parser.parse_args(argv)
+
+    end = to_utc(args.end) if args.end else datetime.now(timezone.utc)
+    start = to_utc(args.start) if args.start else end - timedelta(days=1)
+
+    if args.quantiles:
+        qs = [float(q) for q in args.quantiles.split(",")]
+        df = quantiles(qs, start, end, args.sensor, args.project, args.interval, args.base)
+    elif args.interval and args.wide:
+        df = aligned(args.interval, start, end, args.sensor, args.project, args.agg, args.base)
+    elif args.interval:
+        df = resample(args.interval, start, end, args.sensor, args.project, args.agg, args.base).to_pandas()
+    else:
+        df = readings(start, end, args.sensor, args.project, args.base).to_pandas()
+
+    if args.output and args.output.suffix == ".parquet":
+        df.to_parquet(args.output)
+    elif args.output:
+        df.to_csv(args.output, index=args.wide)
+    else:
+        df.to_csv(sys.stdout, index=args.wide)
+
+# ---------------------------
+# Entrypoint
+# ---------------------------
+if __name__ == "__main__":
+    main()
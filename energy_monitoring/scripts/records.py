@@ -0,0 +1,242 @@
+"""
+records.py
+
+Compact in-memory representation of sensor readings, shared by the
+generators and the SQL loader.
+
+A batch of readings is three parallel NumPy arrays (Readings):
+
+- keys: int32 sensor key, an index into a SensorCatalog
+- timestamps: int64 epoch seconds (UTC); NO_TIMESTAMP marks a missing one
+- values: float32 (the precision of MySQL's FLOAT Value column); NaN if missing
+
+16 bytes per reading, against several Python string objects per row for the
+same data in an object-dtype DataFrame. The repeated metadata (project_id,
+sensor_id, sensor_type, unit) lives once per sensor in the SensorCatalog.
+
+The on-disk layout (segment_log.RAW_SCHEMA, the Parquet archive) is the same
+idea in Arrow terms: metadata columns are dictionary-encoded, i.e. int32
+indices into per-column dictionaries, and timestamps are native
+timestamp[s]. to_record_batch() and from_table() convert between the two by
+gathering indices, without materializing a string per row; only legacy
+files with ISO-8601 text timestamps are parsed.
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+try:
+    from scripts import segment_log
+except ImportError:  # executed directly as scripts/<name>.py
+    import segment_log
+
+# ---------------------------
+# Constants
+# ---------------------------
+META_COLUMNS = ("project_id", "sensor_id", "sensor_type", "unit")
+NO_TIMESTAMP = np.iinfo(np.int64).min      # same bit pattern as NaT
+
+_SECONDS_PER_UNIT = {"s": 1, "ms": 1000, "us": 1000 ** 2, "ns": 1000 ** 3}
+
+# ---------------------------
+# Sensor Catalog
+# ---------------------------
+class SensorCatalog:
+    """
+    Side dictionary of sensor metadata, indexed by sensor key.
+
+    Keys are assigned in insertion order to distinct (project_id, sensor_id)
+    pairs. Every metadata column is kept as a dictionary of distinct values
+    plus one dictionary index per key, which is exactly what an Arrow
+    DictionaryArray needs.
+    """
+
+    def __init__(self):
+        self.keys = {}                                          # (project_id, sensor_id) -> key
+        self.dictionaries = {name: [] for name in META_COLUMNS}   # distinct values per column
+        self._positions = {name: {} for name in META_COLUMNS}     # value -> dictionary index
+        self._codes = {name: [] for name in META_COLUMNS}         # key -> dictionary index
+        self._arrays = None
+
+    @classmethod
+    def from_config(cls, sensor_configs):
+        """Catalog of config/sensor_config.json entries, keyed in list order."""
+        catalog = cls()
+        for s in sensor_configs:
+            catalog.add(s["project_id"], s["sensor_id"], s.get("sensor_type"), s.get("unit"))
+        return catalog
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, project_id, sensor_id, sensor_type=None, unit=None):
+        """
+        Returns:
+            int: Key of the sensor, added if it is not in the catalog yet
+        """
+        key = self.keys.get((project_id, sensor_id))
+        if key is not None:
+            return key
+        key = self.keys[(project_id, sensor_id)] = len(self.keys)
+        for name, value in zip(META_COLUMNS, (project_id, sensor_id, sensor_type, unit)):
+            positions = self._positions[name]
+            if value not in positions:
+                positions[value] = len(self.dictionaries[name])
+                self.dictionaries[name].append(value)
+            self._codes[name].append(positions[value])
+        self._arrays = None
+        return key
+
+    def names(self):
+        """Returns: list: (project_id, sensor_id) of every key, in key order"""
+        return list(self.keys)
+
+    def dictionary_array(self, name, keys):
+        """
+        Metadata column for the given sensor keys as an Arrow DictionaryArray.
+        """
+        if self._arrays is None:
+            self._arrays = {
+                column: (np.asarray(self._codes[column], dtype=np.int32),
+                         pa.array(self.dictionaries[column], type=pa.string()))
+                for column in META_COLUMNS
+            }
+        codes, dictionary = self._arrays[name]
+        return pa.DictionaryArray.from_arrays(pa.array(codes[keys], type=pa.int32()), dictionary)
+
+# ---------------------------
+# Readings
+# ---------------------------
+class Readings:
+    """Parallel arrays of sensor key, epoch second and value (see the module docstring)."""
+
+    __slots__ = ("keys", "timestamps", "values")
+
+    def __init__(self, keys, timestamps, values):
+        self.keys = np.asarray(keys, dtype=np.int32)
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.timestamps.nbytes + self.values.nbytes
+
+    def take(self, selection):
+        """Readings at an index array or boolean mask."""
+        return Readings(self.keys[selection], self.timestamps[selection], self.values[selection])
+
+# ---------------------------
+# Arrow Conversion
+# ---------------------------
+def to_record_batch(readings, catalog):
+    """
+    Build a segment_log.RAW_SCHEMA record batch without per-row strings.
+
+    Returns:
+        pyarrow.RecordBatch: One row per reading
+    """
+    timestamps = pa.array(readings.timestamps, type=pa.int64(), mask=readings.timestamps == NO_TIMESTAMP)
+    columns = {
+        "timestamp": timestamps.cast(segment_log.RAW_SCHEMA.field("timestamp").type),
+        "value": pa.array(readings.values, type=pa.float32()).cast(pa.float64()),
+    }
+    for name in META_COLUMNS:
+        columns[name] = catalog.dictionary_array(name, readings.keys)
+    return pa.RecordBatch.from_arrays(
+        [columns[name] for name in segment_log.RAW_SCHEMA.names], schema=segment_log.RAW_SCHEMA
+    )
+
+def _indices(column):
+    """(int64 dictionary index per row with -1 for null, list of dictionary values)"""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if not pa.types.is_dictionary(column.type):
+        column = column.dictionary_encode()
+    indices = column.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64)
+    return indices, column.dictionary.to_pylist()
+
+def epoch_seconds(column):
+    """
+    Timestamps as int64 epoch seconds, NO_TIMESTAMP where missing.
+
+    Native Arrow timestamps are reinterpreted in place; text (legacy files
+    with ISO-8601 timestamps) is parsed once for the whole column.
+    """
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if pa.types.is_timestamp(column.type):
+        missing = column.is_null().to_numpy(zero_copy_only=False)
+        seconds = pc.cast(column, pa.int64()).fill_null(0).to_numpy(zero_copy_only=False)
+        seconds = seconds // _SECONDS_PER_UNIT[column.type.unit]
+        seconds[missing] = NO_TIMESTAMP
+        return seconds
+    parsed = pd.to_datetime(column.to_pandas(), utc=True, errors="coerce", format="ISO8601")
+    return parsed.dt.tz_localize(None).to_numpy(dtype="datetime64[s]").view(np.int64)
+
+def float_values(column):
+    """Values as float32, NaN where missing or not numeric."""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if pa.types.is_floating(column.type) or pa.types.is_integer(column.type):
+        return pc.cast(column, pa.float32()).to_numpy(zero_copy_only=False)
+    return pd.to_numeric(column.to_pandas(), errors="coerce").to_numpy(dtype=np.float32, na_value=np.nan)
+
+def from_table(table):
+    """
+    Convert readings in the raw layout (at least timestamp, project_id,
+    sensor_id and value; sensor_type and unit are optional) to the compact
+    format.
+
+    Args:
+        table (pyarrow.Table | pyarrow.RecordBatch): Readings
+
+    Returns:
+        tuple: (Readings, SensorCatalog of the sensors present)
+    """
+    if isinstance(table, pa.RecordBatch):
+        table = pa.Table.from_batches([table])
+    columns = {name: _indices(table[name]) for name in META_COLUMNS if name in table.column_names}
+    project_index = columns["project_id"][0]
+    sensor_index = columns["sensor_id"][0]
+
+    # One catalog entry per distinct (project, sensor) index pair, keyed in order of appearance
+    pairs = (project_index + 1) * (len(columns["sensor_id"][1]) + 1) + sensor_index + 1
+    _, first, inverse = np.unique(pairs, return_index=True, return_inverse=True)
+    catalog = SensorCatalog()
+    pair_keys = np.empty(len(first), dtype=np.int32)
+    for i in np.argsort(first):
+        row = first[i]
+        metadata = []
+        for name in META_COLUMNS:
+            indices, dictionary = columns.get(name, (None, None))
+            metadata.append(dictionary[indices[row]] if indices is not None and indices[row] >= 0 else None)
+        pair_keys[i] = catalog.add(*metadata)
+
+    readings = Readings(
+        pair_keys[inverse.reshape(-1)],
+        epoch_seconds(table["timestamp"]),
+        float_values(table["value"]),
+    )
+    return readings, catalog
+
+def to_csv_frame(readings, catalog):
+    """
+    Readings in the legacy raw CSV layout (ISO-8601 'Z' timestamps, one
+    string column per metadata field), for writers of data/raw/YYYY-MM-DD/.
+
+    Returns:
+        DataFrame: Columns timestamp, project_id, sensor_id, sensor_type, value, unit
+    """
+    stamps, stamp_index = np.unique(readings.timestamps, return_inverse=True)
+    text = np.char.add(np.datetime_as_string(stamps.astype("datetime64[s]"), unit="s"), "Z")
+    frame = {"timestamp": pd.Categorical.from_codes(stamp_index.reshape(-1), text)}
+    for name in META_COLUMNS:
+        array = catalog.dictionary_array(name, readings.keys)
+        frame[name] = pd.Categorical.from_codes(array.indices.to_numpy(), array.dictionary.to_pylist())
+    frame["value"] = readings.values
+    return pd.DataFrame(frame, columns=segment_log.RAW_SCHEMA.names)
@@ -0,0 +1,118 @@
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+try:
+    from scripts import metrics, partitions, storage
+except ImportError:  # executed directly as scripts/<name>.py
+    import metrics
+    import partitions
+    import storage
+
+"""
+retention.py
+
+Partition maintenance and retention for the Sensor_Data table.
+
+- Splits monthly partitions off p_future so the current month and the next
+  MONTHS_AHEAD months always have their own partition
+- Removes whole monthly partitions once all their rows are older than
+  SENSOR_DATA_RETENTION_DAYS (default 365), with DROP PARTITION instead of
+  row-by-row DELETEs
+- With SENSOR_DATA_RETENTION_MODE=exchange, each expired partition is first
+  exchanged into a standalone Sensor_Data_pYYYYMM table (kept for export)
+  instead of being discarded
+
+With STORAGE_BACKEND=sqlite there are no partitions; expired rows are
+deleted per sensor instead (a range scan of the clustered primary key).
+
+The raw readings remain in the Parquet archive (data/processed/), so the
+database only needs to hold the history dashboards query.
+
+This script is intended to be triggered once a day via cron_manager.py.
+"""
+
+
+# ---------------------------
+# Logging Setup
+# ---------------------------
+LOG_FILE = Path(__file__).parent.parent / "logs" / "retention.log"
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    handlers=[
+        logging.FileHandler(LOG_FILE),
+        logging.StreamHandler()
+    ]
+)
+
+def log(msg): logging.info(msg)
+def log_error(msg): logging.error(msg)
+
+# ---------------------------
+# Constants
+# ---------------------------
+RETENTION_DAYS = int(os.environ.get("SENSOR_DATA_RETENTION_DAYS", 365))
+RETENTION_MODE = os.environ.get("SENSOR_DATA_RETENTION_MODE", "drop")   # "drop" or "exchange"
+
+# ---------------------------
+# Main Function
+# ---------------------------
+@metrics.timed("retention")
+def apply_retention(retention_days=RETENTION_DAYS, mode=RETENTION_MODE):
+    """
+    Create upcoming Sensor_Data partitions and remove expired ones.
+    """
+    if storage.STORAGE_BACKEND == "sqlite":
+        apply_sqlite_retention(retention_days)
+        return
+
+    store = None
+    try:
+        store = storage.MySQLStore()
+        conn = store.conn
+        cursor = conn.cursor()
+        current = partitions.list_partitions(cursor)
+        metrics.DB_ROUNDTRIPS.inc(stage="retention")
+        if not current:
+            log_error("Sensor_Data is not partitioned; run scripts/init_db.py to migrate it.")
+            return
+
+        created = partitions.ensure_future_partitions(cursor)
+        if created:
+            log(f"Created partitions: {', '.join(created)}")
+
+        expired = partitions.expired_partitions(current, retention_days)
+        metrics.BACKLOG.set(len(expired), stage="retention")
+        if not expired:
+            log(f"No Sensor_Data partitions older than {retention_days} days.")
+            return
+        partitions.drop_partitions(cursor, expired, exchange=(mode == "exchange"))
+        conn.commit()
+        action = "Exchanged and dropped" if mode == "exchange" else "Dropped"
+        log(f"{action} partitions: {', '.join(expired)}")
+    except Exception as e:
+        log_error(f"Retention failed: {e}")
+    finally:
+        if store:
+            store.close()
+
+def apply_sqlite_retention(retention_days=RETENTION_DAYS):
+    """
+    Delete Sensor_Data rows older than the retention from the SQLite store.
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=retention_days)
+    try:
+        with storage.SQLiteStore() as store:
+            deleted = store.delete_readings_before(cutoff)
+        log(f"Deleted {deleted} Sensor_Data rows older than {retention_days} days.")
+    except Exception as e:
+        log_error(f"Retention failed: {e}")
+
+# ---------------------------
+# Entrypoint
+# ---------------------------
+if __name__ == "__main__":
+    apply_retention()
+    metrics.write_textfile("retention")
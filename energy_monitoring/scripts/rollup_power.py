@@ -0,0 +1,316 @@
+import os
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+try:
+    from scripts import archive, metrics, query_archive, sensor_registry, storage
+except ImportError:  # executed directly as scripts/<name>.py
+    import archive
+    import metrics
+    import query_archive
+    import sensor_registry
+    import storage
+
+"""
+rollup_power.py
+
+Incremental rollup stage that populates the Power_Generation table.
+
+- Power per project is derived from the voltage/current sensor pairs listed in
+  config/sensor_config.json (Volt_1 pairs with Amp_1, Volt_2 with Amp_2, ...):
+  P = sum(V * I), in watts, from the 30s means of each sensor
+- Rollups are computed at every Aggregation_Interval: '30s' from the readings,
+  then '5min', 'hourly' and 'daily' as the mean power over the bucket
+- Input is the local Parquet archive (see query_archive.py), not Sensor_Data,
+  so rollups never scan the raw MySQL table
+- Incremental: archive files seen since the last run mark the time range they
+  cover as dirty; only the buckets of each interval that overlap a dirty
+  range are recomputed and upserted, so late data also updates its buckets
+- Upserts on the unique (Project_ID, Aggregation_Interval, Timestamp) key of
+  the configured storage backend (storage.py);
+  Derived_From_Sensor is the voltage sensor of the project's first pair
+
+The list of processed archive files is kept in data/rollup_state.json and is
+only advanced after a successful write.
+"""
+
+
+# ---------------------------
+# Logging Setup
+# ---------------------------
+LOG_FILE = Path(__file__).parent.parent / "logs" / "rollup_power.log"
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] [%(levelname)s] %(message)s',
+    handlers=[
+        logging.FileHandler(LOG_FILE),
+        logging.StreamHandler()
+    ]
+)
+
+def log(msg): logging.info(msg)
+def log_error(msg): logging.error(msg)
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+CONFIG_PATH = Path(__file__).parent.parent / "config" / "sensor_config.json"
+PROCESSED_DIR = archive.PROCESSED_DIR
+STATE_FILE = PROCESSED_DIR.parent / "rollup_state.json"
+
+# Aggregation_Interval value -> pandas bucket frequency
+INTERVALS = {"30s": "30s", "5min": "5min", "hourly": "1h", "daily": "1D"}
+
+WRITE_BATCH_ROWS = 5000
+
+# ---------------------------
+# Configuration
+# ---------------------------
+def load_power_pairs(config_path=CONFIG_PATH):
+    """
+    Pair each project's voltage and current sensors by their numeric suffix.
+
+    Returns:
+        dict: {project_id: [(voltage_sensor_id, current_sensor_id), ...]}
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        sensors = json.load(f)
+
+    by_type = {}
+    for s in sensors:
+        if s["sensor_type"] in ("voltage", "current"):
+            suffix = s["sensor_id"].rsplit("_", 1)[-1]
+            by_type.setdefault((s["project_id"], suffix), {})[s["sensor_type"]] = s["sensor_id"]
+
+    pairs = {}
+    for (project, _), found in sorted(by_type.items()):
+        if "voltage" in found and "current" in found:
+            pairs.setdefault(project, []).append((found["voltage"], found["current"]))
+    return pairs
+
+# ---------------------------
+# Incremental State
+# ---------------------------
+def load_state():
+    """Return {archive file: mtime_ns} of the files already rolled up."""
+    if not STATE_FILE.exists():
+        return {}
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f).get("files", {})
+    except (OSError, ValueError) as e:
+        log_error(f"Could not read rollup state, starting empty: {e}")
+        return {}
+
+def save_state(files):
+    """Persist the processed file list atomically."""
+    tmp_file = STATE_FILE.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"files": files}, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, STATE_FILE)
+
+def list_archive_files(base):
+    """Return {relative path: mtime_ns} for every archive data file."""
+    return {f.relative_to(base).as_posix(): f.stat().st_mtime_ns for f in archive.iter_data_files(base)}
+
+def file_time_range(path):
+    """
+    Read the timestamp range of a Parquet file from its row-group statistics.
+
+    Falls back to reading the column when statistics are missing (e.g. legacy
+    files that stored timestamps as strings).
+
+    Returns:
+        tuple: (min, max) as naive UTC Timestamps, or None for an empty file
+    """
+    meta = pq.ParquetFile(path).metadata
+    index = meta.schema.names.index("timestamp")
+    lows, highs = [], []
+    for i in range(meta.num_row_groups):
+        stats = meta.row_group(i).column(index).statistics
+        if stats is None or not stats.has_min_max or isinstance(stats.min, str):
+            break
+        lows.append(stats.min)
+        highs.append(stats.max)
+    else:
+        if not lows:
+            return None
+        return _naive(pd.Timestamp(min(lows))), _naive(pd.Timestamp(max(highs)))
+
+    times = archive.read_readings(path)["timestamp"].to_pandas()
+    if times.empty:
+        return None
+    return _naive(times.min()), _naive(times.max())
+
+def _naive(ts):
+    return ts.tz_convert("UTC").tz_localize(None) if ts.tzinfo else ts
+
+def dirty_windows(ranges):
+    """
+    Merge dirty (min, max) ranges into day-aligned windows.
+
+    Daily buckets need the whole day, so windows are widened to midnight.
+
+    Returns:
+        list: [(start, end)] naive UTC Timestamps, end exclusive
+    """
+    days = sorted(
+        (low.floor("1D"), high.floor("1D") + pd.Timedelta(days=1)) for low, high in ranges
+    )
+    windows = []
+    for start, end in days:
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return windows
+
+# ---------------------------
+# Rollup Computation
+# ---------------------------
+def compute_power(start, end, pairs, base=None):
+    """
+    Compute 30s power per project over [start, end) from the archive.
+
+    Returns:
+        DataFrame: project_id, timestamp (naive UTC bucket start), power
+    """
+    sensors = sorted({s for project_pairs in pairs.values() for pair in project_pairs for s in pair})
+    means = query_archive.resample(
+        "30s", start.to_pydatetime(), end.to_pydatetime(),
+        sensors=sensors, projects=sorted(pairs), base=base
+    ).to_pandas()
+    if means.empty:
+        return pd.DataFrame(columns=["project_id", "timestamp", "power"])
+
+    means["timestamp"] = means["timestamp"].dt.tz_convert("UTC").dt.tz_localize(None)
+    wide = means.pivot_table(index=["project_id", "timestamp"], columns="sensor_id", values="value")
+
+    frames = []
+    for project, project_pairs in pairs.items():
+        if project not in wide.index.get_level_values(0):
+            continue
+        sub = wide.loc[project]
+        power = None
+        for volt, amp in project_pairs:
+            if volt not in sub or amp not in sub:
+                continue
+            pair_power = sub[volt] * sub[amp]
+            power = pair_power if power is None else power.add(pair_power, fill_value=0)
+        if power is None:
+            continue
+        power = power.dropna()
+        frames.append(pd.DataFrame({"project_id": project, "timestamp": power.index, "power": power.values}))
+    if not frames:
+        return pd.DataFrame(columns=["project_id", "timestamp", "power"])
+    return pd.concat(frames, ignore_index=True)
+
+def rollup(power, interval):
+    """
+    Mean power per project over buckets of one Aggregation_Interval.
+
+    Returns:
+        DataFrame: project_id, timestamp, power
+    """
+    if power.empty:
+        return power
+    buckets = power.assign(timestamp=power["timestamp"].dt.floor(INTERVALS[interval]))
+    return buckets.groupby(["project_id", "timestamp"], as_index=False)["power"].mean()
+
+def touched_buckets(frame, interval, ranges):
+    """Keep only the buckets of frame that overlap one of the dirty ranges."""
+    if frame.empty:
+        return frame
+    freq = INTERVALS[interval]
+    mask = pd.Series(False, index=frame.index)
+    for low, high in ranges:
+        mask |= (frame["timestamp"] >= low.floor(freq)) & (frame["timestamp"] <= high.floor(freq))
+    return frame[mask]
+
+# ---------------------------
+# Database Rows
+# ---------------------------
+def build_rows(rollups, pairs, projects):
+    """
+    Turn {interval: DataFrame} into Power_Generation rows, skipping projects
+    missing from the database. Names are matched after normalization, so the
+    config's "Solar_Facade" finds the "Solar Facade" project.
+    """
+    normalize = sensor_registry.normalize_name
+    projects = {
+        normalize(name): (project_id, {normalize(code): sid for code, sid in codes.items()})
+        for name, (project_id, codes) in projects.items()
+    }
+    rows = []
+    for interval, frame in rollups.items():
+        if frame.empty:
+            continue
+        for project, group in frame.groupby("project_id"):
+            if normalize(project) not in projects:
+                log_error(f"Project not found in database: {project}")
+                continue
+            project_id, sensor_ids = projects[normalize(project)]
+            derived = sensor_ids.get(normalize(pairs[project][0][0]))
+            rows.extend(
+                (project_id, ts.to_pydatetime(), float(power), interval, derived)
+                for ts, power in zip(group["timestamp"], group["power"])
+            )
+    return rows
+
+# ---------------------------
+# Main Function
+# ---------------------------
+@metrics.timed("rollup_power")
+def rollup_power(base=None):
+    """
+    Recompute and upsert the Power_Generation buckets touched by archive
+    files added or rewritten since the last run.
+    """
+    base = Path(base or PROCESSED_DIR)
+    pairs = load_power_pairs()
+    if not pairs:
+        log("No voltage/current sensor pairs configured; nothing to roll up.")
+        return
+
+    seen = load_state()
+    current = list_archive_files(base) if base.exists() else {}
+    changed = [name for name, mtime in current.items() if seen.get(name) != mtime]
+    metrics.BACKLOG.set(len(changed), stage="rollup_power")
+    if not changed:
+        log("No new archive files to roll up.")
+        return
+
+    ranges = [r for r in (file_time_range(base / name) for name in changed) if r]
+    rollups = {interval: [] for interval in INTERVALS}
+    for start, end in dirty_windows(ranges):
+        power = compute_power(start, end, pairs, base)
+        for interval in INTERVALS:
+            rollups[interval].append(touched_buckets(rollup(power, interval), interval, ranges))
+    rollups = {
+        interval: pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        for interval, frames in rollups.items()
+    }
+
+    try:
+        with storage.open_store() as store:
+            rows = build_rows(rollups, pairs, sensor_registry.get_registry().project_map(store))
+            store.upsert_power_generation(rows, WRITE_BATCH_ROWS)
+            metrics.DB_ROUNDTRIPS.inc(len(range(0, len(rows), WRITE_BATCH_ROWS)), stage="rollup_power")
+    except Exception as e:
+        log_error(f"Rollup failed: {e}")
+        return
+
+    save_state(current)
+    metrics.ROWS.inc(len(rows), stage="rollup_power")
+    log(f"Upserted {len(rows)} Power_Generation rows from {len(changed)} archive file(s).")
+
+# ---------------------------
+# Entrypoint
+# ---------------------------
+if __name__ == "__main__":
+    rollup_power()
+    metrics.write_textfile("rollup_power")
@@ -0,0 +1,282 @@
+"""
+segment_log.py
+
+Append-only segment log for raw sensor readings.
+
+Replaces the one-small-CSV-per-sample raw layer with a few rotating segment
+files under data/raw/segments/:
+
+- Each append writes one length-prefixed frame holding a complete Arrow IPC
+  stream (schema + one record batch), so a segment can be appended to by
+  successive processes and read back without any CSV parsing
+- The writer keeps exactly one segment open (seg-<epoch_ms>.open) and seals it
+  (rename to .seg) once it exceeds MAX_SEGMENT_BYTES or MAX_SEGMENT_AGE
+- fsync is batched: data is written to the OS on every append but only forced
+  to disk every FSYNC_INTERVAL seconds, on rotation and on close
+- Readers consume sealed segments through a memory map; a torn final frame
+  (e.g. after a power cut) is ignored, and the writer truncates it on reopen
+
+Only the writer seals segments while it is alive: it holds an exclusive
+flock on its open segment, in this process or another. seal_stale_segments()
+lets the consumer seal an open segment that no live writer holds and that has
+not been written to for STALE_SEGMENT_AGE, so the last readings are not
+stranded when sampling stops.
+"""
+
+import os
+import time
+import struct
+import threading
+from pathlib import Path
+
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # Windows: a file open in a writer cannot be renamed anyway
+    fcntl = None
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+SEGMENT_DIR = Path(__file__).parent.parent / "data" / "raw" / "segments"
+
+MAX_SEGMENT_BYTES = 16 * 1024 * 1024
+MAX_SEGMENT_AGE = 60          # seconds an open segment may collect data
+STALE_SEGMENT_AGE = 180       # seconds without writes before a consumer may seal
+FSYNC_INTERVAL = 30           # seconds between forced flushes to disk
+
+# Legacy raw CSVs (data/raw/YYYY-MM-DD/HH-MM-SS.csv) are only aggregated from
+# today's directory and for this long after they were written
+LEGACY_CSV_WINDOW = 30 * 60   # seconds
+
+OPEN_SUFFIX = ".open"
+SEALED_SUFFIX = ".seg"
+
+_FRAME_HEADER = struct.Struct("<Q")
+
+# Record format of raw readings (dictionary-encoded repeated strings)
+RAW_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("s", tz="UTC")),
+    ("project_id", pa.dictionary(pa.int32(), pa.string())),
+    ("sensor_id", pa.dictionary(pa.int32(), pa.string())),
+    ("sensor_type", pa.dictionary(pa.int32(), pa.string())),
+    ("value", pa.float64()),
+    ("unit", pa.dictionary(pa.int32(), pa.string())),
+])
+
+# ---------------------------
+# Frame Encoding
+# ---------------------------
+def encode_frame(batch):
+    """Serialize a RecordBatch as a length-prefixed Arrow IPC stream."""
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, batch.schema) as writer:
+        writer.write_batch(batch)
+    payload = sink.getvalue()
+    return _FRAME_HEADER.pack(payload.size) + payload.to_pybytes()
+
+def iter_frames(buffer):
+    """
+    Yield (end_offset, RecordBatch) for every complete frame in a buffer.
+
+    Stops at the first incomplete or unreadable frame.
+    """
+    offset = 0
+    while offset + _FRAME_HEADER.size <= buffer.size:
+        (length,) = _FRAME_HEADER.unpack(buffer.slice(offset, _FRAME_HEADER.size).to_pybytes())
+        start = offset + _FRAME_HEADER.size
+        if length == 0 or start + length > buffer.size:
+            return
+        try:
+            reader = pa.ipc.open_stream(buffer.slice(start, length))
+            batches = list(reader)
+        except pa.ArrowInvalid:
+            return
+        offset = start + length
+        for batch in batches:
+            yield offset, batch
+
+def valid_length(path):
+    """Return the byte length of the complete frames at the start of a segment."""
+    if path.stat().st_size == 0:
+        return 0
+    end = 0
+    with pa.memory_map(str(path), "r") as source:
+        for end, _ in iter_frames(source.read_buffer()):
+            pass
+    return end
+
+# ---------------------------
+# Writer
+# ---------------------------
+def _try_lock(file):
+    """
+    Take an exclusive, non-blocking flock on an open segment.
+
+    Returns:
+        bool: False if another open file (a live writer) holds the lock
+    """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+def writer_alive(path):
+    """
+    Returns:
+        bool: True if a live SegmentWriter (any process) holds the open segment
+    """
+    try:
+        with open(path, "rb") as f:
+            return not _try_lock(f)
+    except FileNotFoundError:
+        return False
+
+def _segment_start(path):
+    """Creation time (epoch seconds) encoded in a segment file name."""
+    try:
+        return int(path.stem.split("-")[1]) / 1000.0
+    except (IndexError, ValueError):
+        return path.stat().st_mtime
+
+class SegmentWriter:
+    """
+    Appends record batches to the open segment, rotating and syncing as needed.
+
+    Safe to share between threads; one writer per segment directory and
+    process is expected.
+    """
+
+    def __init__(self, segment_dir=None, max_bytes=MAX_SEGMENT_BYTES,
+                 max_age=MAX_SEGMENT_AGE, fsync_interval=FSYNC_INTERVAL):
+        self.segment_dir = Path(segment_dir or SEGMENT_DIR)
+        self.segment_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.path = None
+        self.file = None
+        self.last_fsync = time.monotonic()
+
+    def _open(self, now):
+        """Resume the existing open segment or start a new one."""
+        existing = [p for p in sorted(self.segment_dir.glob(f"*{OPEN_SUFFIX}")) if not writer_alive(p)]
+        for extra in existing[:-1]:
+            self._seal_path(extra)
+        if existing:
+            path = existing[-1]
+            length = valid_length(path)
+            if path.stat().st_size != length:
+                os.truncate(path, length)  # drop a torn tail frame
+            if length >= self.max_bytes or now - _segment_start(path) >= self.max_age:
+                self._seal_path(path)
+            else:
+                self.path = path
+        if self.path is None:
+            stamp = int(now * 1000)
+            while (self.segment_dir / f"seg-{stamp:015d}{SEALED_SUFFIX}").exists():
+                stamp += 1  # rotated within the same millisecond: never overwrite a sealed segment
+            self.path = self.segment_dir / f"seg-{stamp:015d}{OPEN_SUFFIX}"
+        self.file = open(self.path, "ab")
+        if not _try_lock(self.file):  # taken by another writer since the scan
+            self.file.close()
+            self.path = self.segment_dir / f"seg-{int(now * 1000):015d}-{os.getpid()}{OPEN_SUFFIX}"
+            self.file = open(self.path, "ab")
+            _try_lock(self.file)
+
+    def _seal_path(self, path):
+        try:
+            os.replace(path, path.with_suffix(SEALED_SUFFIX))
+        except FileNotFoundError:
+            pass  # already sealed by seal_stale_segments()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_fsync = time.monotonic()
+
+    def _rotate(self):
+        try:
+            self._sync()
+            self.file.close()
+            self._seal_path(self.path)
+        finally:
+            self.path = self.file = None
+
+    def append(self, batch):
+        """
+        Append one RecordBatch to the log.
+
+        Returns:
+            Path: Segment the data was written to
+        """
+        now = time.time()
+        with self.lock:
+            if self.file is not None and (
+                self.file.tell() >= self.max_bytes or now - _segment_start(self.path) >= self.max_age
+            ):
+                self._rotate()
+            if self.file is None:
+                self._open(now)
+            self.file.write(encode_frame(batch))
+            self.file.flush()
+            if time.monotonic() - self.last_fsync >= self.fsync_interval:
+                self._sync()
+            return self.path
+
+    def close(self):
+        """Flush and fsync the open segment, leaving it open for later appends."""
+        with self.lock:
+            if self.file is not None:
+                try:
+                    self._sync()
+                    self.file.close()
+                finally:
+                    self.file = self.path = None
+
+# ---------------------------
+# Consumer Helpers
+# ---------------------------
+def seal_stale_segments(segment_dir=None, stale_after=STALE_SEGMENT_AGE):
+    """
+    Seal open segments that have not been written to for stale_after seconds
+    and are not held by a live writer.
+
+    Returns:
+        int: Number of segments sealed
+    """
+    segment_dir = Path(segment_dir or SEGMENT_DIR)
+    sealed = 0
+    now = time.time()
+    for path in segment_dir.glob(f"*{OPEN_SUFFIX}"):
+        try:
+            if now - path.stat().st_mtime < stale_after or writer_alive(path):
+                continue
+            length = valid_length(path)
+            if path.stat().st_size != length:
+                os.truncate(path, length)
+            os.replace(path, path.with_suffix(SEALED_SUFFIX))
+        except (FileNotFoundError, PermissionError):
+            continue  # sealed by its writer meanwhile, or open in it (Windows)
+        sealed += 1
+    return sealed
+
+def list_sealed_segments(segment_dir=None):
+    """Return sealed segment paths, oldest first."""
+    segment_dir = Path(segment_dir or SEGMENT_DIR)
+    return sorted(segment_dir.glob(f"*{SEALED_SUFFIX}"))
+
+def read_segment(path):
+    """
+    Read every record batch of a segment through a memory map.
+
+    Returns:
+        list: RecordBatches backed by the mapped file (no copy, no parsing)
+    """
+    source = pa.memory_map(str(path), "r")
+    return [batch for _, batch in iter_frames(source.read_buffer())]
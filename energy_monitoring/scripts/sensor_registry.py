@@ -0,0 +1,223 @@
+"""
+sensor_registry.py
+
+Cached (project, sensor_code) -> Sensor_ID registry shared by the uploaders
+and rollups, with bulk auto-registration from config/sensor_config.json.
+
+- Names are normalized before they are compared: surrounding whitespace is
+  stripped, runs of spaces, hyphens and underscores become one underscore,
+  and case is folded (MySQL's default collation is case-insensitive too), so
+  "Solar Facade", "solar-facade" and "Solar_Facade" are the same project
+- The mapping is kept in memory for the life of the process and in
+  data/sensor_registry.json between processes, tagged with a version of the
+  Projects/Sensors tables (store.fetch_registry_version(): CHECKSUM TABLE on
+  MySQL, row counts and max IDs on SQLite). Within REGISTRY_TTL seconds a
+  lookup costs nothing; after that one cheap version query decides whether
+  the full Sensors JOIN Projects query has to run again
+- Projects and sensors listed in the config but missing from the database
+  are inserted in one transaction (store.register_sensors()) whenever the
+  config file or the tables change, instead of being reported as
+  "Sensor not found" on every run. New projects get the config's optional
+  "source_type" (default "Other")
+"""
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+try:
+    from scripts import metrics
+except ImportError:  # executed directly as scripts/<name>.py
+    import metrics
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+CONFIG_PATH = Path(__file__).parent.parent / "config" / "sensor_config.json"
+CACHE_FILE = Path(__file__).parent.parent / "data" / "sensor_registry.json"
+
+REGISTRY_TTL = int(os.environ.get("SENSOR_REGISTRY_TTL", 300))   # seconds between version checks
+DEFAULT_SOURCE_TYPE = "Other"
+
+_SEPARATORS = re.compile(r"[\s_\-]+")
+
+# ---------------------------
+# Name Normalization
+# ---------------------------
+@lru_cache(maxsize=65536)
+def normalize_name(name):
+    """Canonical form of a project name or sensor code."""
+    return _SEPARATORS.sub("_", str(name).strip()).casefold()
+
+def normalize_key(project, sensor_code):
+    return normalize_name(project), normalize_name(sensor_code)
+
+# ---------------------------
+# Registry
+# ---------------------------
+class SensorRegistry:
+    """Process-wide cache of the sensor mapping (see the module docstring)."""
+
+    def __init__(self, config_path=CONFIG_PATH, cache_file=CACHE_FILE, ttl=REGISTRY_TTL, config_filter=None):
+        self.config_path = Path(config_path)
+        self.cache_file = Path(cache_file)
+        self.ttl = ttl
+        self.config_filter = config_filter    # sensor config -> bool: which sensors this process registers
+        self.lock = threading.Lock()
+        self.backend = None
+        self.version = None
+        self.projects = {}        # {project: Project_ID}, normalized names
+        self.sensors = {}         # {(project, sensor_code): Sensor_ID}, normalized names
+        self.checked_at = None
+        self.config_mtime = None
+
+    def sensor_map(self, store):
+        """
+        Returns:
+            dict: {(project, sensor_code): sensor_id} with normalized names
+        """
+        with self.lock:
+            self.refresh(store)
+            return self.sensors
+
+    def project_map(self, store):
+        """
+        Returns:
+            dict: {project: (project_id, {sensor_code: sensor_id})} with normalized names
+        """
+        with self.lock:
+            self.refresh(store)
+            projects = {name: (project_id, {}) for name, project_id in self.projects.items()}
+            for (project, code), sensor_id in self.sensors.items():
+                projects[project][1][code] = sensor_id
+            return projects
+
+    def invalidate(self):
+        with self.lock:
+            self.checked_at = None
+            self.version = None
+
+    def refresh(self, store, force=False):
+        """Re-check the tables and the config if the TTL expired."""
+        config_mtime = self.config_path.stat().st_mtime_ns if self.config_path.exists() else None
+        fresh = (
+            self.checked_at is not None
+            and time.monotonic() - self.checked_at < self.ttl
+            and config_mtime == self.config_mtime
+            and self.backend == store.name
+        )
+        if fresh and not force:
+            return
+
+        if self.version is None or self.backend != store.name:
+            self._load_cache(store.name)
+        version = store.fetch_registry_version()
+        metrics.DB_ROUNDTRIPS.inc(stage="sensor_registry")
+        changed = version != self.version
+        if changed:
+            self._reload(store, version)
+
+        if changed or config_mtime != self.config_mtime:
+            if self.register(store, self.load_config()):
+                self._reload(store, store.fetch_registry_version())
+                metrics.DB_ROUNDTRIPS.inc(stage="sensor_registry")
+        self.config_mtime = config_mtime
+        self.checked_at = time.monotonic()
+
+    def load_config(self):
+        if not self.config_path.exists():
+            return []
+        with open(self.config_path, "r", encoding="utf-8") as f:
+            sensor_configs = json.load(f)
+        if self.config_filter:
+            sensor_configs = [s for s in sensor_configs if self.config_filter(s)]
+        return sensor_configs
+
+    def register(self, store, sensor_configs):
+        """
+        Insert configured projects and sensors that are missing, in one
+        transaction.
+
+        Returns:
+            int: Number of sensors registered
+        """
+        new_projects, new_sensors = {}, {}
+        for s in sensor_configs:
+            project, code = normalize_key(s["project_id"], s["sensor_id"])
+            if (project, code) in self.sensors or (project, code) in new_sensors:
+                continue
+            if project not in self.projects and project not in new_projects:
+                new_projects[project] = (s["project_id"].strip(), s.get("source_type", DEFAULT_SOURCE_TYPE))
+            project_key = self.projects.get(project, new_projects.get(project, (None,))[0])
+            new_sensors[(project, code)] = (project_key, s["sensor_id"].strip(), s["sensor_type"], s["unit"])
+        if not new_sensors:
+            return 0
+
+        try:
+            store.register_sensors(list(new_projects.values()), list(new_sensors.values()))
+        except Exception as e:
+            logging.error(f"Sensor registration failed ({len(new_sensors)} sensors): {e}")
+            return 0
+        metrics.DB_ROUNDTRIPS.inc(3, stage="sensor_registry")
+        logging.info(f"Registered {len(new_projects)} project(s) and {len(new_sensors)} sensor(s) from the config.")
+        return len(new_sensors)
+
+    def _reload(self, store, version):
+        projects = store.fetch_projects()
+        metrics.DB_ROUNDTRIPS.inc(stage="sensor_registry")
+        self.projects, self.sensors = {}, {}
+        for name, (project_id, codes) in projects.items():
+            project = normalize_name(name)
+            self.projects.setdefault(project, project_id)
+            for code, sensor_id in codes.items():
+                self.sensors.setdefault((project, normalize_name(code)), sensor_id)
+        self.version = version
+        self.backend = store.name
+        self._save_cache()
+
+    def _load_cache(self, backend):
+        try:
+            with open(self.cache_file, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+        if cached.get("backend") != backend:
+            return
+        self.backend = backend
+        self.version = cached["version"]
+        self.projects = cached["projects"]
+        self.sensors = {(project, code): sensor_id for project, code, sensor_id in cached["sensors"]}
+
+    def _save_cache(self):
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.cache_file.with_suffix(".tmp")
+            with open(tmp_file, "w") as f:
+                json.dump({
+                    "backend": self.backend,
+                    "version": self.version,
+                    "projects": self.projects,
+                    "sensors": [[p, c, sid] for (p, c), sid in sorted(self.sensors.items())],
+                }, f, indent=1)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logging.error(f"Could not write sensor registry cache: {e}")
+
+# ---------------------------
+# Process-wide Registry
+# ---------------------------
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry():
+    """Return the process-wide registry, creating it on first use."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = SensorRegistry()
+        return _registry
@@ -0,0 +1,303 @@
+"""
+shards.py
+
+Sharding of the ingest pipeline (generate -> aggregate -> upload to SQL) by
+project, so many sites are processed in parallel by worker processes, one
+per shard, and a slow project only holds up the projects of its own shard.
+
+- A project belongs to shard crc32(normalized project name) % count, stable
+  across processes and restarts (Python's hash() is salted per process)
+- Each shard works in its own directory, data/shards/shard-<k>/:
+    raw/segments/            segment log written by the shard's generator
+    quarantine/              rows rejected by the shard's aggregation runs
+    upload_ledger.json       archive files uploaded by the shard's uploader
+    sensor_registry.json     the shard's sensor registry cache
+    progress.json            last run of every stage (time, duration, outcome)
+- Aggregation writes into the shared archive, data/processed/: its
+  date=/project= partitions already keep projects apart, so two shards never
+  write the same partition, and compaction, query_archive.py and the rollups
+  keep reading one dataset. Wide tables are per project as well; each shard
+  queues its own SQL sync (data/wide/_sql_pending.shard-<k>.json)
+- Every ledger is read by every uploader and by compact_parquet.py, so files
+  uploaded before sharding (or by another shard) are never sent twice.
+  Flat files at the root of data/processed/ (written before partitioning)
+  belong to no shard: upload them with one unsharded upload_to_sql.py run
+- configure() points the pipeline modules at one shard inside a process.
+  ShardPool keeps one single-process executor per shard, initialized with
+  configure(), so each worker imports the pipeline once and the shards' jobs
+  run side by side on separate cores
+
+cron_manager.py --shards N is the coordinator: SHARDED_JOBS are scheduled
+once per shard on a ShardPool, the other jobs (ThingSpeak, rollups,
+compaction, retention) run once for all projects as before. Change the
+shard count only after the raw segments of the old layout were aggregated.
+
+    python scripts/shards.py --shards 4                      # shard of every project + progress
+    python scripts/shards.py --shards 4 --shard 1 --run aggregate_recent_csv
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import logging
+import argparse
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    from scripts import sensor_registry
+except ImportError:  # executed directly as scripts/<name>.py
+    import sensor_registry
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+SHARD_ROOT = Path(__file__).parent.parent / "data" / "shards"
+CONFIG_PATH = Path(__file__).parent.parent / "config" / "sensor_config.json"
+LOG_DIR = Path(__file__).parent.parent / "logs"
+
+SHARD_COUNT = max(1, int(os.environ.get("PIPELINE_SHARDS", 1)))
+
+# Jobs run once per shard: name -> (module, entry point)
+SHARDED_JOBS = {
+    "generate_sample": ("generate_sample_data", "generate_sample"),
+    "aggregate_recent_csv": ("aggregate_parquet", "aggregate_recent_csv"),
+    "upload_parquet_to_sql": ("upload_to_sql", "upload_parquet_to_sql"),
+}
+
+_current = None     # (shard, count, root) configured in this process
+
+# ---------------------------
+# Assignment
+# ---------------------------
+def shard_of(project, count=None):
+    """
+    Returns:
+        int: Shard of a project
+    """
+    count = count or SHARD_COUNT
+    if count == 1:
+        return 0
+    return zlib.crc32(sensor_registry.normalize_name(project).encode("utf-8")) % count
+
+def owns(shard, count):
+    """
+    Returns:
+        callable: project -> True if the project belongs to shard. Legacy
+        flat archive files have no project and belong to no shard
+    """
+    return lambda project: project is not None and shard_of(project, count) == shard
+
+def shard_dir(shard, root=None):
+    return Path(root or SHARD_ROOT) / f"shard-{shard}"
+
+def assignments(sensor_configs, count=None):
+    """
+    Returns:
+        dict: {shard: [project_id, ...]} for the projects of a sensor config
+    """
+    count = count or SHARD_COUNT
+    shards = {shard: [] for shard in range(count)}
+    for project in dict.fromkeys(s["project_id"] for s in sensor_configs):
+        shards[shard_of(project, count)].append(project)
+    return shards
+
+def load_sensor_config(path=None):
+    with open(path or CONFIG_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+# ---------------------------
+# Worker Configuration
+# ---------------------------
+def configure(shard, count=None, root=None):
+    """
+    Point the pipeline modules of this process at one shard: its projects'
+    sensors, its raw/quarantine/ledger/cache paths, its SQL sync queue and a
+    shard label on every metric and log line. Called once per worker process
+    (ShardPool initializer, or the --run command line).
+    """
+    global _current
+    count = count or SHARD_COUNT
+    directory = shard_dir(shard, root)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # Before the pipeline modules are imported, so their basicConfig() calls are no-ops
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"[%(asctime)s] [%(levelname)s] [shard {shard}] %(message)s",
+        handlers=[logging.FileHandler(LOG_DIR / f"shard_{shard}.log"), logging.StreamHandler()],
+    )
+    try:
+        from scripts import (aggregate_parquet, generate_sample_data, metrics, records, upload_to_sql,
+                             validation, wide_tables)
+    except ImportError:  # executed directly as scripts/<name>.py
+        import aggregate_parquet
+        import generate_sample_data
+        import metrics
+        import records
+        import upload_to_sql
+        import validation
+        import wide_tables
+
+    in_shard = owns(shard, count)
+    sensor_configs = [s for s in load_sensor_config() if in_shard(s["project_id"])]
+    raw_dir = directory / "raw"
+
+    generate_sample_data.SENSOR_CONFIG = sensor_configs
+    generate_sample_data.SENSOR_CATALOG = records.SensorCatalog.from_config(sensor_configs)
+    generate_sample_data.RAW_DATA_DIR = raw_dir
+    generate_sample_data._segment_writer = None
+
+    aggregate_parquet.RAW_DIR = raw_dir
+    aggregate_parquet.SEGMENT_DIR = raw_dir / "segments"
+    validation.QUARANTINE_DIR = directory / "quarantine"
+    wide_tables.PENDING_FILE_NAME = f"_sql_pending.shard-{shard}.json"
+
+    upload_to_sql.LEDGER_FILE = directory / "upload_ledger.json"
+    upload_to_sql.PROJECT_FILTER = in_shard
+    sensor_registry._registry = sensor_registry.SensorRegistry(
+        config_path=CONFIG_PATH,
+        cache_file=directory / "sensor_registry.json",
+        config_filter=lambda s: in_shard(s["project_id"]),
+    )
+
+    metrics.set_constant_labels(shard=shard)
+    _current = (shard, count, root)
+    logging.info(f"Shard {shard}/{count}: {len({s['project_id'] for s in sensor_configs})} project(s), "
+                 f"{len(sensor_configs)} sensor(s)")
+
+def run_job(name):
+    """
+    Run one SHARDED_JOBS entry point in this (configured) process and record
+    it in the shard's progress file. Exceptions are recorded and re-raised.
+    """
+    try:
+        from scripts import metrics
+    except ImportError:  # executed directly as scripts/<name>.py
+        import metrics
+    shard, _, root = _current
+    module_name, func_name = SHARDED_JOBS[name]
+    if __package__:
+        module_name = f"{__package__}.{module_name}"
+    func = getattr(importlib.import_module(module_name), func_name)
+
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    error = None
+    try:
+        func()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        backlog = metrics.BACKLOG.values.get((("stage", name),))
+        record_progress(shard, name, started_at, time.perf_counter() - start, error, backlog, root)
+        metrics.write_textfile(f"shard_{shard}")
+
+# ---------------------------
+# Progress
+# ---------------------------
+def record_progress(shard, stage, started_at, seconds, error=None, backlog=None, root=None):
+    """Update the stage's entry in data/shards/shard-<k>/progress.json."""
+    path = shard_dir(shard, root) / "progress.json"
+    progress = read_progress(shard, root)
+    entry = progress.setdefault(stage, {"runs": 0, "failures": 0})
+    entry["runs"] += 1
+    entry["failures"] += 1 if error else 0
+    entry.update(
+        last_run=started_at.replace(microsecond=0).isoformat(),
+        seconds=round(seconds, 3),
+        ok=error is None,
+        error=error,
+        backlog=backlog,
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(progress, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, path)
+
+def read_progress(shard, root=None):
+    """Returns: dict: {stage: {runs, failures, last_run, seconds, ok, error, backlog}}"""
+    path = shard_dir(shard, root) / "progress.json"
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def format_status(count, sensor_configs, root=None):
+    """Text table of every shard's projects and the last run of each stage."""
+    lines = []
+    for shard, projects in assignments(sensor_configs, count).items():
+        lines.append(f"shard {shard}: {', '.join(projects) or '-'}")
+        for stage, entry in sorted(read_progress(shard, root).items()):
+            state = "ok" if entry["ok"] else f"FAILED ({entry['error']})"
+            backlog = "" if entry.get("backlog") is None else f", backlog {entry['backlog']}"
+            lines.append(f"  {stage:<24} {entry['last_run']}  {entry['seconds']:8.3f}s  "
+                         f"{entry['runs']} runs, {entry['failures']} failed{backlog}  {state}")
+    return "\n".join(lines)
+
+# ---------------------------
+# Worker Pool
+# ---------------------------
+class ShardPool:
+    """
+    One single-process executor per shard. Workers are spawned (not forked
+    from the threaded scheduler) and configured once; a worker that dies is
+    replaced on the next run of its shard.
+    """
+
+    def __init__(self, count, root=None):
+        self.count = count
+        self.root = root
+        self.context = multiprocessing.get_context("spawn")
+        self.executors = [self._executor(shard) for shard in range(count)]
+
+    def _executor(self, shard):
+        return ProcessPoolExecutor(
+            max_workers=1, mp_context=self.context,
+            initializer=configure, initargs=(shard, self.count, self.root),
+        )
+
+    def run(self, shard, name):
+        """Run a sharded job in the shard's worker and wait for it."""
+        try:
+            return self.executors[shard].submit(run_job, name).result()
+        except BrokenProcessPool:
+            self.executors[shard].shutdown(wait=False, cancel_futures=True)
+            self.executors[shard] = self._executor(shard)
+            raise
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+# ---------------------------
+# Entrypoint
+# ---------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shard the ingest pipeline by project.")
+    parser.add_argument("--shards", type=int, default=SHARD_COUNT, help="number of shards")
+    parser.add_argument("--shard", type=int, default=None, help="shard to run --run for")
+    parser.add_argument("--run", choices=sorted(SHARDED_JOBS), default=None,
+                        help="run one job for --shard in this process")
+    args = parser.parse_args(argv)
+
+    if args.run is None:
+        print(format_status(args.shards, load_sensor_config()))
+        return 0
+    if args.shard is None or not 0 <= args.shard < args.shards:
+        parser.error(f"--run needs --shard between 0 and {args.shards - 1}")
+    configure(args.shard, args.shards)
+    run_job(args.run)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
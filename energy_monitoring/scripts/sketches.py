@@ -0,0 +1,267 @@
+"""
+sketches.py
+
+Mergeable quantile sketches per sensor and hour, stored next to the archive.
+
+The sketch is a relative-error log histogram (the DDSketch construction):
+every value x is counted in bucket ceil(log_gamma(|x|)) of a positive or
+negative store, with gamma = (1 + ALPHA) / (1 - ALPHA).
+
+- Error bound: for any q, the returned quantile v' satisfies
+  |v' - v| <= ALPHA * |v|, where v is the exact q-quantile of the values
+  summarised (relative accuracy ALPHA, 1% by default). Values with
+  |x| < MIN_VALUE are counted as exactly 0
+- Mergeable without loss: merging two sketches adds their bucket counts, so
+  an hourly sketch merged over a month has the same bound as a sketch built
+  from the month's raw values
+- Size: about log_gamma(max/min) buckets, i.e. a few hundred integers per
+  sensor per hour for typical voltage/current/wind speed ranges
+- Exact count, sum, min and max are kept alongside the buckets
+
+aggregate_parquet.py writes one sketch file per archive file, in the hidden
+_sketches/ directory of the partition (same file name), with one row per
+(sensor_id, hour). compact_parquet.py merges them like the data files, and
+query_archive.quantiles() merges the stored rows of a range instead of
+rescanning raw values. Ranges are therefore resolved to whole hours.
+"""
+
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ---------------------------
+# Constants
+# ---------------------------
+ALPHA = 0.01
+MIN_VALUE = 1e-9
+
+SKETCH_DIR_NAME = "_sketches"
+BUCKET = "1h"
+
+# Sensor types that get sketches during aggregation
+SKETCH_SENSOR_TYPES = ("voltage", "current", "wind_speed")
+
+SKETCH_SCHEMA = pa.schema([
+    ("sensor_id", pa.string()),
+    ("bucket", pa.timestamp("s", tz="UTC")),
+    ("alpha", pa.float64()),
+    ("count", pa.int64()),
+    ("sum", pa.float64()),
+    ("min", pa.float64()),
+    ("max", pa.float64()),
+    ("zero_count", pa.int64()),
+    ("pos_keys", pa.list_(pa.int32())),
+    ("pos_counts", pa.list_(pa.int64())),
+    ("neg_keys", pa.list_(pa.int32())),
+    ("neg_counts", pa.list_(pa.int64())),
+])
+
+# ---------------------------
+# Sketch
+# ---------------------------
+def _merge_store(keys_a, counts_a, keys_b, counts_b):
+    keys = np.concatenate([keys_a, keys_b]).astype(np.int32)
+    counts = np.concatenate([counts_a, counts_b]).astype(np.int64)
+    if keys.size == 0:
+        return keys, counts
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=counts).astype(np.int64)
+
+class QuantileSketch:
+    """Relative-error quantile sketch; see the module docstring for bounds."""
+
+    def __init__(self, alpha=ALPHA):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.zero_count = 0
+        self.pos_keys = self.neg_keys = np.empty(0, np.int32)
+        self.pos_counts = self.neg_counts = np.empty(0, np.int64)
+
+    def _keys(self, magnitudes):
+        return np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int32)
+
+    def add(self, values):
+        """Add an array of values (NaNs are ignored)."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return self
+        self.count += int(values.size)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        positive = values[values >= MIN_VALUE]
+        negative = -values[values <= -MIN_VALUE]
+        self.zero_count += int(values.size - positive.size - negative.size)
+        for name, magnitudes in (("pos", positive), ("neg", negative)):
+            if magnitudes.size:
+                keys, counts = np.unique(self._keys(magnitudes), return_counts=True)
+                merged = _merge_store(getattr(self, f"{name}_keys"), getattr(self, f"{name}_counts"),
+                                      keys, counts)
+                setattr(self, f"{name}_keys", merged[0])
+                setattr(self, f"{name}_counts", merged[1])
+        return self
+
+    def merge(self, other):
+        """Merge another sketch with the same alpha into this one."""
+        if other.alpha != self.alpha:
+            raise ValueError(f"Cannot merge sketches with alpha {self.alpha} and {other.alpha}")
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.zero_count += other.zero_count
+        self.pos_keys, self.pos_counts = _merge_store(self.pos_keys, self.pos_counts,
+                                                      other.pos_keys, other.pos_counts)
+        self.neg_keys, self.neg_counts = _merge_store(self.neg_keys, self.neg_counts,
+                                                      other.neg_keys, other.neg_counts)
+        return self
+
+    def _bucket_values(self):
+        """Representative value and count of every bucket, in ascending order."""
+        neg_values = -2 * self.gamma ** self.neg_keys[::-1].astype(np.float64) / (self.gamma + 1)
+        pos_values = 2 * self.gamma ** self.pos_keys.astype(np.float64) / (self.gamma + 1)
+        values = np.concatenate([neg_values, [0.0], pos_values])
+        counts = np.concatenate([self.neg_counts[::-1], [self.zero_count], self.pos_counts])
+        return values, counts
+
+    def quantiles(self, qs):
+        """
+        Estimate quantiles.
+
+        Args:
+            qs (list): Quantiles in [0, 1]
+
+        Returns:
+            list: Estimated values (NaN for an empty sketch), clamped to [min, max]
+        """
+        if self.count == 0:
+            return [math.nan for _ in qs]
+        values, counts = self._bucket_values()
+        cumulative = np.cumsum(counts)
+        ranks = np.floor(np.clip(np.asarray(qs, dtype=np.float64), 0, 1) * (self.count - 1))
+        found = values[np.searchsorted(cumulative, ranks, side="right")]
+        return np.clip(found, self.min, self.max).tolist()
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def histogram(self, edges):
+        """
+        Approximate counts of values between consecutive edges.
+
+        Each bucket is attributed to the bin holding its representative value.
+        """
+        values, counts = self._bucket_values()
+        hist, _ = np.histogram(values, bins=edges, weights=counts)
+        return hist.astype(np.int64)
+
+    # Persistence ---------------------------------------------------------
+    def to_record(self, sensor_id, bucket):
+        return {
+            "sensor_id": sensor_id, "bucket": bucket, "alpha": self.alpha,
+            "count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+            "zero_count": self.zero_count,
+            "pos_keys": self.pos_keys.tolist(), "pos_counts": self.pos_counts.tolist(),
+            "neg_keys": self.neg_keys.tolist(), "neg_counts": self.neg_counts.tolist(),
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        sketch = cls(record["alpha"])
+        sketch.count = record["count"]
+        sketch.sum = record["sum"]
+        sketch.min = record["min"]
+        sketch.max = record["max"]
+        sketch.zero_count = record["zero_count"]
+        sketch.pos_keys = np.asarray(record["pos_keys"], np.int32)
+        sketch.pos_counts = np.asarray(record["pos_counts"], np.int64)
+        sketch.neg_keys = np.asarray(record["neg_keys"], np.int32)
+        sketch.neg_counts = np.asarray(record["neg_counts"], np.int64)
+        return sketch
+
+# ---------------------------
+# Building and Persistence
+# ---------------------------
+def build_sketches(table, sketches=None, sensor_types=SKETCH_SENSOR_TYPES):
+    """
+    Add the readings of a raw table to per-(sensor_id, hour) sketches.
+
+    Args:
+        table (pyarrow.Table): Readings of a single (date, project) partition
+        sketches (dict): Existing {(sensor_id, bucket): QuantileSketch} to update
+
+    Returns:
+        dict: {(sensor_id, bucket Timestamp): QuantileSketch}
+    """
+    sketches = {} if sketches is None else sketches
+    df = table.select(["timestamp", "sensor_id", "sensor_type", "value"]).to_pandas()
+    df = df[df["sensor_type"].astype(str).isin(sensor_types)]
+    if df.empty:
+        return sketches
+    df["bucket"] = df["timestamp"].dt.floor(BUCKET)
+    for (sensor_id, bucket), values in df.groupby([df["sensor_id"].astype(str), "bucket"])["value"]:
+        sketches.setdefault((sensor_id, bucket), QuantileSketch()).add(values.to_numpy())
+    return sketches
+
+def sketch_path(data_path):
+    """Sketch file belonging to an archive data file."""
+    data_path = Path(data_path)
+    return data_path.parent / SKETCH_DIR_NAME / data_path.name
+
+def write_sketches(sketches, path):
+    """Write {(sensor_id, bucket): sketch} to path atomically."""
+    records = [sketch.to_record(sensor_id, bucket) for (sensor_id, bucket), sketch in sorted(sketches.items())]
+    table = pa.Table.from_pylist(records, schema=SKETCH_SCHEMA)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f".{path.name}.tmp")
+    pq.write_table(table, tmp_file, compression="zstd")
+    tmp_file.replace(path)
+
+def read_sketches(path, sketches=None):
+    """
+    Read a sketch file, merging its rows into sketches.
+
+    Returns:
+        dict: {(sensor_id, bucket Timestamp): QuantileSketch}
+    """
+    sketches = {} if sketches is None else sketches
+    for record in pq.read_table(path, schema=SKETCH_SCHEMA).to_pylist():
+        key = (record["sensor_id"], pd.Timestamp(record["bucket"]))
+        sketch = QuantileSketch.from_record(record)
+        if key in sketches:
+            sketches[key].merge(sketch)
+        else:
+            sketches[key] = sketch
+    return sketches
+
+def merge_sketch_files(sources, target):
+    """
+    Merge the sketch files of compacted data files into target's sketch file.
+
+    Args:
+        sources (list): Data files that were merged
+        target (Path): Data file they were merged into
+    """
+    target_sketch = sketch_path(target)
+    inputs = [sketch_path(f) for f in sources if sketch_path(f) != target_sketch]
+    inputs = [p for p in inputs if p.exists()]
+    if not inputs:
+        return
+    sketches = read_sketches(target_sketch) if target_sketch.exists() else {}
+    for p in inputs:
+        read_sketches(p, sketches)
+    write_sketches(sketches, target_sketch)
+    for p in inputs:
+        p.unlink()
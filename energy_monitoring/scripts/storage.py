@@ -0,0 +1,525 @@
+"""
+storage.py
+
+Storage backends for the pipeline's relational data (Projects, Sensors,
+Sensor_Data, Power_Generation).
+
+- MySQLStore: the deployment database (see init_db.py for its schema),
+  on a connection borrowed from the shared pool in db.py
+- SQLiteStore: an embedded single-file database for Pi-only sites and for
+  testing the pipeline end to end without a server. It is tuned for small,
+  frequent batch writes:
+    - WAL journal with synchronous=NORMAL, so readers never block the writer
+      and commits do not fsync the main database file
+    - Sensor_Data is a WITHOUT ROWID table clustered on (Sensor_ID, Timestamp)
+      so a reading is stored once, in key order, with no separate index
+    - Each batch is one transaction written with executemany(), which
+      prepares the INSERT once and binds every row to it
+    - Timestamps are stored as 'YYYY-MM-DD HH:MM:SS' UTC text
+
+Per-project wide tables (Wide_<project>, see wide_tables.py) are created
+and widened on demand by ensure_wide_table() and filled with
+upsert_wide_rows(), which only overwrites the cells a row carries.
+
+Both backends expose the same methods, so upload_to_sql.py,
+upload_thingspeak.py and rollup_power.py only depend on open_store(). The
+backend is chosen with the STORAGE_BACKEND environment variable ("mysql" by
+default, or "sqlite"; the database file is SQLITE_PATH).
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+try:
+    from scripts import db
+except ImportError:  # executed directly as scripts/<name>.py
+    import db
+
+# ---------------------------
+# Configuration
+# ---------------------------
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mysql").lower()
+SQLITE_PATH = Path(os.environ.get("SQLITE_PATH", Path(__file__).parent.parent / "db" / "energy_monitoring.db"))
+
+SQLITE_BUSY_TIMEOUT = 30    # seconds to wait for another writer
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Projects (
+    Project_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Project_Name TEXT NOT NULL,
+    Source_Type TEXT NOT NULL,
+    Location TEXT,
+    Description TEXT,
+    Created_At TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS Sensors (
+    Sensor_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Project_ID INTEGER NOT NULL,
+    Sensor_Code TEXT NOT NULL,
+    Sensor_Type TEXT NOT NULL,
+    Unit TEXT NOT NULL,
+    Created_At TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (Project_ID) REFERENCES Projects(Project_ID) ON DELETE CASCADE
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_project_sensor_code ON Sensors (Project_ID, Sensor_Code);
+
+CREATE TABLE IF NOT EXISTS Sensor_Data (
+    Sensor_ID INTEGER NOT NULL,
+    Timestamp TEXT NOT NULL,
+    Value REAL NOT NULL,
+    PRIMARY KEY (Sensor_ID, Timestamp)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS Power_Generation (
+    Generation_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Project_ID INTEGER NOT NULL,
+    Timestamp TIMESTAMP NOT NULL,
+    Power_Generated REAL NOT NULL,
+    Aggregation_Interval TEXT DEFAULT 'hourly',
+    Derived_From_Sensor INTEGER,
+    FOREIGN KEY (Project_ID) REFERENCES Projects(Project_ID),
+    FOREIGN KEY (Derived_From_Sensor) REFERENCES Sensors(Sensor_ID)
+);
+"""
+
+# ---------------------------
+# Shared Queries
+# ---------------------------
+SENSOR_MAP_SQL = """
+    SELECT s.Sensor_ID, p.Project_Name, s.Sensor_Code
+    FROM Sensors s
+    JOIN Projects p ON s.Project_ID = p.Project_ID
+"""
+
+PROJECTS_SQL = """
+    SELECT p.Project_ID, p.Project_Name, s.Sensor_ID, s.Sensor_Code
+    FROM Projects p
+    LEFT JOIN Sensors s ON s.Project_ID = p.Project_ID
+"""
+
+class BaseStore:
+    """Queries shared by every backend; subclasses set the dialect."""
+
+    placeholder = "%s"
+    insert_ignore = "INSERT IGNORE"
+    identifier_quote = "`"
+    wide_value_type = "FLOAT"
+
+    def __init__(self):
+        self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _placeholders(self, count):
+        return ", ".join([self.placeholder] * count)
+
+    def _to_db_time(self, value):
+        return value
+
+    def _from_db_time(self, value):
+        return value
+
+    def _identifier(self, name):
+        q = self.identifier_quote
+        return f"{q}{name.replace(q, q + q)}{q}"
+
+    def fetch_sensor_ids(self):
+        """
+        Returns:
+            dict: {(project_name, sensor_code): sensor_id}
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(SENSOR_MAP_SQL)
+        return {
+            (proj_name.strip(), sensor_code.strip()): sid
+            for (sid, proj_name, sensor_code) in cursor.fetchall()
+        }
+
+    def fetch_projects(self):
+        """
+        Returns:
+            dict: {project_name: (project_id, {sensor_code: sensor_id})}
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(PROJECTS_SQL)
+        projects = {}
+        for project_id, name, sensor_id, code in cursor.fetchall():
+            entry = projects.setdefault(name.strip(), (project_id, {}))
+            if sensor_id is not None:
+                entry[1][code.strip()] = sensor_id
+        return projects
+
+    def fetch_registry_version(self):
+        """
+        Cheap fingerprint of Projects and Sensors for sensor_registry.py.
+
+        Returns:
+            list: Changes whenever projects or sensors are added or removed
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT
+                (SELECT COUNT(*) FROM Projects), (SELECT COALESCE(MAX(Project_ID), 0) FROM Projects),
+                (SELECT COUNT(*) FROM Sensors), (SELECT COALESCE(MAX(Sensor_ID), 0) FROM Sensors)
+        """)
+        return [int(v) for v in cursor.fetchone()]
+
+    def register_sensors(self, projects, sensors):
+        """
+        Create projects and sensors in one transaction.
+
+        Args:
+            projects (list): [(project_name, source_type)] to create
+            sensors (list): [(project, sensor_code, sensor_type, unit)] where
+                project is a Project_ID or the name of a project in projects
+
+        Returns:
+            int: Number of sensors inserted (existing codes are ignored)
+        """
+        cursor = self.conn.cursor()
+        try:
+            new_ids = {}
+            if projects:
+                cursor.executemany(
+                    f"INSERT INTO Projects (Project_Name, Source_Type) VALUES ({self._placeholders(2)})",
+                    projects
+                )
+                names = [name for name, _ in projects]
+                cursor.execute(
+                    f"SELECT Project_Name, MAX(Project_ID) FROM Projects "
+                    f"WHERE Project_Name IN ({self._placeholders(len(names))}) GROUP BY Project_Name",
+                    names
+                )
+                new_ids = dict(cursor.fetchall())
+            cursor.executemany(
+                f"{self.insert_ignore} INTO Sensors (Project_ID, Sensor_Code, Sensor_Type, Unit) "
+                f"VALUES ({self._placeholders(4)})",
+                [(new_ids.get(project, project), code, sensor_type, unit)
+                 for project, code, sensor_type, unit in sensors]
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return cursor.rowcount
+
+    def fetch_existing_records(self, sensor_ids, start_ts, end_ts):
+        """
+        (Sensor_ID, Timestamp) pairs already stored for the given sensors
+        within [start_ts, end_ts] (naive UTC), served by the primary key.
+
+        Returns:
+            set: {(sensor_id, datetime)}
+        """
+        sensor_ids = sorted(set(sensor_ids))
+        if not sensor_ids:
+            return set()
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"SELECT Sensor_ID, Timestamp FROM Sensor_Data "
+            f"WHERE Sensor_ID IN ({self._placeholders(len(sensor_ids))}) "
+            f"AND Timestamp BETWEEN {self.placeholder} AND {self.placeholder}",
+            (*sensor_ids, self._to_db_time(start_ts), self._to_db_time(end_ts))
+        )
+        return {(sid, self._from_db_time(ts)) for sid, ts in cursor.fetchall()}
+
+    def insert_readings(self, rows):
+        """
+        Insert (sensor_id, datetime, value) rows in one transaction, ignoring
+        rows whose (Sensor_ID, Timestamp) already exists.
+
+        Returns:
+            int: Number of rows inserted
+        """
+        if not rows:
+            return 0
+        cursor = self.conn.cursor()
+        cursor.executemany(
+            f"{self.insert_ignore} INTO Sensor_Data (Sensor_ID, Timestamp, Value) "
+            f"VALUES ({self._placeholders(3)})",
+            [(sid, self._to_db_time(ts), value) for sid, ts, value in rows]
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def fetch_latest_values(self, sensor_ids):
+        """
+        Most recent reading of many sensors in one group-wise max query.
+
+        Returns:
+            dict: {sensor_id: value} for sensors with at least one reading
+        """
+        return {sid: value for sid, (_, value) in self.fetch_latest_readings(sensor_ids).items()}
+
+    def fetch_latest_readings(self, sensor_ids):
+        """
+        Returns:
+            dict: {sensor_id: (timestamp, value)} of the most recent reading
+            of every sensor with at least one (naive UTC datetime)
+        """
+        sensor_ids = sorted(set(sensor_ids))
+        if not sensor_ids:
+            return {}
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT d.Sensor_ID, d.Timestamp, d.Value
+            FROM Sensor_Data d
+            JOIN (
+                SELECT Sensor_ID, MAX(Timestamp) AS Latest
+                FROM Sensor_Data
+                WHERE Sensor_ID IN ({self._placeholders(len(sensor_ids))})
+                GROUP BY Sensor_ID
+            ) m ON d.Sensor_ID = m.Sensor_ID AND d.Timestamp = m.Latest
+            """,
+            sensor_ids
+        )
+        return {sid: (self._from_db_time(ts), value) for sid, ts, value in cursor.fetchall()}
+
+    def upsert_power_generation(self, rows, batch_rows=5000):
+        """
+        Upsert (Project_ID, Timestamp, Power_Generated, Aggregation_Interval,
+        Derived_From_Sensor) rows on the unique rollup key.
+        """
+        cursor = self.conn.cursor()
+        sql = self.power_upsert_sql()
+        for i in range(0, len(rows), batch_rows):
+            cursor.executemany(sql, [
+                (pid, self._to_db_time(ts), power, interval, derived)
+                for pid, ts, power, interval, derived in rows[i:i + batch_rows]
+            ])
+        self.conn.commit()
+
+    def ensure_wide_table(self, table, columns):
+        """
+        Create a wide table (Timestamp primary key) if needed and add any
+        missing sensor columns, nullable.
+        """
+        cursor = self.conn.cursor()
+        existing = {c.casefold() for c in self.fetch_table_columns(table)}
+        if not existing:
+            cursor.execute(self.wide_table_sql(table))
+            existing = {"timestamp"}
+        for column in columns:
+            if column.casefold() not in existing:
+                cursor.execute(
+                    f"ALTER TABLE {self._identifier(table)} "
+                    f"ADD COLUMN {self._identifier(column)} {self.wide_value_type} NULL"
+                )
+                existing.add(column.casefold())
+        self.conn.commit()
+
+    def upsert_wide_rows(self, table, columns, rows, batch_rows=1000):
+        """
+        Upsert (datetime, value, ...) rows into a wide table; a None value
+        keeps the cell already stored.
+        """
+        cursor = self.conn.cursor()
+        sql = self.wide_upsert_sql(table, columns)
+        for i in range(0, len(rows), batch_rows):
+            cursor.executemany(sql, [
+                (self._to_db_time(ts), *values) for ts, *values in rows[i:i + batch_rows]
+            ])
+        self.conn.commit()
+
+# ---------------------------
+# MySQL
+# ---------------------------
+class MySQLStore(BaseStore):
+    """Sensor storage in the MySQL deployment database."""
+
+    name = "mysql"
+
+    def __init__(self, pool=None):
+        super().__init__()
+        self.pool = pool or db.get_pool()
+        self.conn = self.pool.get()
+
+    def fetch_registry_version(self):
+        """Live checksums of Projects and Sensors (also catches renames)."""
+        cursor = self.conn.cursor()
+        cursor.execute("CHECKSUM TABLE Projects, Sensors")
+        return [checksum for _, checksum in cursor.fetchall()]
+
+    def close(self):
+        """Return the connection to the pool instead of closing it."""
+        if self.conn is not None:
+            self.pool.put(self.conn)
+            self.conn = None
+
+    def power_upsert_sql(self):
+        return """
+            INSERT INTO Power_Generation
+                (Project_ID, Timestamp, Power_Generated, Aggregation_Interval, Derived_From_Sensor)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                Power_Generated = VALUES(Power_Generated),
+                Derived_From_Sensor = VALUES(Derived_From_Sensor)
+        """
+
+    def fetch_table_columns(self, table):
+        """Returns: list: Column names of a table, empty if it does not exist"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION",
+            (table,)
+        )
+        return [name for (name,) in cursor.fetchall()]
+
+    def wide_table_sql(self, table):
+        return f"CREATE TABLE IF NOT EXISTS {self._identifier(table)} (Timestamp DATETIME NOT NULL PRIMARY KEY)"
+
+    def wide_upsert_sql(self, table, columns):
+        names = [self._identifier(c) for c in columns]
+        return (
+            f"INSERT INTO {self._identifier(table)} (Timestamp, {', '.join(names)}) "
+            f"VALUES ({self._placeholders(len(names) + 1)}) "
+            f"ON DUPLICATE KEY UPDATE "
+            + ", ".join(f"{n} = COALESCE(VALUES({n}), {n})" for n in names)
+        )
+
+# ---------------------------
+# SQLite
+# ---------------------------
+class SQLiteStore(BaseStore):
+    """Embedded sensor storage tuned for edge devices (see module docstring)."""
+
+    name = "sqlite"
+    placeholder = "?"
+    insert_ignore = "INSERT OR IGNORE"
+    identifier_quote = '"'
+    wide_value_type = "REAL"
+
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = Path(path or SQLITE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, cached_statements=256)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.ensure_schema()
+
+    def _to_db_time(self, value):
+        return value.strftime(TIMESTAMP_FORMAT) if isinstance(value, datetime) else value
+
+    def _from_db_time(self, value):
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+    def ensure_schema(self):
+        """
+        Create missing tables and upgrade databases created from the original
+        db/energy_monitoring.db layout (rowid Sensor_Data, no rollup key).
+        """
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'Sensor_Data'"
+            ).fetchone()
+            if row and "WITHOUT ROWID" not in row[0].upper():
+                self.conn.execute("ALTER TABLE Sensor_Data RENAME TO Sensor_Data_rowid")
+                self.conn.executescript(SQLITE_SCHEMA)
+                self.conn.execute("""
+                    INSERT OR IGNORE INTO Sensor_Data (Sensor_ID, Timestamp, Value)
+                    SELECT Sensor_ID, strftime('%Y-%m-%d %H:%M:%S', Timestamp), Value
+                    FROM Sensor_Data_rowid ORDER BY Data_ID
+                """)
+                self.conn.execute("DROP TABLE Sensor_Data_rowid")
+            else:
+                self.conn.executescript(SQLITE_SCHEMA)
+            has_key = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_project_interval_time'"
+            ).fetchone()
+            if not has_key:
+                self.conn.execute("""
+                    DELETE FROM Power_Generation WHERE Generation_ID NOT IN (
+                        SELECT MAX(Generation_ID) FROM Power_Generation
+                        GROUP BY Project_ID, Aggregation_Interval, Timestamp
+                    )
+                """)
+                self.conn.execute("""
+                    CREATE UNIQUE INDEX idx_project_interval_time
+                    ON Power_Generation (Project_ID, Aggregation_Interval, Timestamp)
+                """)
+
+    def insert_readings(self, rows):
+        before = self.conn.total_changes
+        super().insert_readings(rows)
+        return self.conn.total_changes - before
+
+    def power_upsert_sql(self):
+        return """
+            INSERT INTO Power_Generation
+                (Project_ID, Timestamp, Power_Generated, Aggregation_Interval, Derived_From_Sensor)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (Project_ID, Aggregation_Interval, Timestamp) DO UPDATE SET
+                Power_Generated = excluded.Power_Generated,
+                Derived_From_Sensor = excluded.Derived_From_Sensor
+        """
+
+    def fetch_table_columns(self, table):
+        """Returns: list: Column names of a table, empty if it does not exist"""
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({self._identifier(table)})")]
+
+    def wide_table_sql(self, table):
+        return f"CREATE TABLE IF NOT EXISTS {self._identifier(table)} (Timestamp TEXT NOT NULL PRIMARY KEY)"
+
+    def wide_upsert_sql(self, table, columns):
+        names = [self._identifier(c) for c in columns]
+        return (
+            f"INSERT INTO {self._identifier(table)} (Timestamp, {', '.join(names)}) "
+            f"VALUES ({self._placeholders(len(names) + 1)}) "
+            f"ON CONFLICT (Timestamp) DO UPDATE SET "
+            + ", ".join(f"{n} = COALESCE(excluded.{n}, {n})" for n in names)
+        )
+
+    def delete_readings_before(self, cutoff):
+        """
+        Delete Sensor_Data rows older than cutoff (naive UTC), per sensor so
+        each DELETE is a range scan of the clustered key.
+
+        Returns:
+            int: Rows deleted
+        """
+        before = self.conn.total_changes
+        with self.conn:
+            sensor_ids = [sid for (sid,) in self.conn.execute("SELECT Sensor_ID FROM Sensors")]
+            for sid in sensor_ids:
+                self.conn.execute("DELETE FROM Sensor_Data WHERE Sensor_ID = ? AND Timestamp < ?",
+                                  (sid, self._to_db_time(cutoff)))
+        return self.conn.total_changes - before
+
+# ---------------------------
+# Factory
+# ---------------------------
+BACKENDS = {"mysql": MySQLStore, "sqlite": SQLiteStore}
+
+def open_store(backend=None):
+    """
+    Open the configured storage backend.
+
+    Args:
+        backend (str): "mysql" or "sqlite"; defaults to STORAGE_BACKEND
+
+    Returns:
+        BaseStore: Open store; use as a context manager or call close()
+    """
+    backend = (backend or STORAGE_BACKEND).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {backend!r}; expected one of {sorted(BACKENDS)}")
+    return BACKENDS[backend]()
@@ -0,0 +1,149 @@
+"""
+thingspeak_outbox.py
+
+Durable store-and-forward queue of ThingSpeak channel updates.
+
+upload_thingspeak.py appends one entry per channel and run, stamped with
+the time of the channel's newest reading, and drains the queue through ThingSpeak's bulk JSON update endpoint
+(POST /channels/<id>/bulk_update.json), up to BULK_MAX_ENTRIES entries per
+request. Entries are deleted only after ThingSpeak accepted them, so a
+network outage (or a restart during one) delays the upload instead of losing
+it, and the backlog is backfilled with its original timestamps once the
+connection returns.
+
+- Single SQLite file (data/thingspeak_outbox.db) in WAL mode; entries are
+  kept in insertion order per channel
+- Only the field values are queued; the write API key is read from
+  config/thingspeak_channels.json when the entry is sent
+- At most MAX_ENTRIES_PER_CHANNEL entries are kept per channel; beyond that
+  the oldest are dropped (about 70 days at one entry per minute)
+- An entry not newer than the last one queued for its channel is skipped,
+  so stale readings (generation or database behind) are not queued again
+"""
+
+import os
+import json
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+OUTBOX_FILE = Path(os.environ.get(
+    "THINGSPEAK_OUTBOX", Path(__file__).parent.parent / "data" / "thingspeak_outbox.db"
+))
+
+BULK_MAX_ENTRIES = 960          # ThingSpeak limit per bulk update (free tier)
+MAX_ENTRIES_PER_CHANNEL = int(os.environ.get("THINGSPEAK_OUTBOX_MAX", 100000))
+CREATED_AT_FORMAT = "%Y-%m-%d %H:%M:%S +0000"
+
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS Outbox (
+    Entry_ID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Project TEXT NOT NULL,
+    Created_At TEXT NOT NULL,
+    Fields TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_project ON Outbox (Project, Entry_ID);
+
+CREATE TABLE IF NOT EXISTS Last_Queued (
+    Project TEXT PRIMARY KEY,
+    Created_At TEXT NOT NULL
+);
+"""
+
+# ---------------------------
+# Outbox
+# ---------------------------
+class Outbox:
+    """Pending channel updates on disk; use as a context manager."""
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES_PER_CHANNEL):
+        self.path = Path(path or OUTBOX_FILE)
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(OUTBOX_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def enqueue(self, updates, created_at=None):
+        """
+        Queue one entry per channel, unless the channel already has an entry
+        this new or newer.
+
+        Args:
+            updates (dict): {project: {fieldN: value}}
+            created_at (datetime): Time of the readings (naive means UTC),
+                defaults to now
+
+        Returns:
+            list: Projects queued
+        """
+        created_at = created_at or datetime.now(timezone.utc)
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        stamp = created_at.astimezone(timezone.utc).strftime(CREATED_AT_FORMAT)
+        last_queued = dict(self.conn.execute("SELECT Project, Created_At FROM Last_Queued"))
+        updates = {
+            project: fields for project, fields in updates.items()
+            if fields and stamp > last_queued.get(project, "")
+        }
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO Outbox (Project, Created_At, Fields) VALUES (?, ?, ?)",
+                [(project, stamp, json.dumps(fields)) for project, fields in updates.items()]
+            )
+            self.conn.executemany(
+                "INSERT INTO Last_Queued (Project, Created_At) VALUES (?, ?) "
+                "ON CONFLICT (Project) DO UPDATE SET Created_At = excluded.Created_At",
+                [(project, stamp) for project in updates]
+            )
+            for project in updates:
+                self.conn.execute("""
+                    DELETE FROM Outbox WHERE Project = ? AND Entry_ID <= (
+                        SELECT Entry_ID FROM Outbox WHERE Project = ?
+                        ORDER BY Entry_ID DESC LIMIT 1 OFFSET ?
+                    )
+                """, (project, project, self.max_entries))
+        return list(updates)
+
+    def pending(self):
+        """
+        Returns:
+            dict: {project: number of queued entries}
+        """
+        return dict(self.conn.execute("SELECT Project, COUNT(*) FROM Outbox GROUP BY Project"))
+
+    def peek(self, project, limit=BULK_MAX_ENTRIES):
+        """
+        Oldest queued entries of a channel.
+
+        Returns:
+            list: [(entry_id, created_at, {fieldN: value})], oldest first
+        """
+        rows = self.conn.execute(
+            "SELECT Entry_ID, Created_At, Fields FROM Outbox WHERE Project = ? ORDER BY Entry_ID LIMIT ?",
+            (project, limit)
+        )
+        return [(entry_id, created_at, json.loads(fields)) for entry_id, created_at, fields in rows]
+
+    def ack(self, project, last_entry_id):
+        """Delete a channel's entries up to and including last_entry_id."""
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM Outbox WHERE Project = ? AND Entry_ID <= ?", (project, last_entry_id)
+            )
@@ -1,20 +1,46 @@
+import os
 import json
+import time
 import logging
+import threading
 import requests
 import pandas as pd
-import pymysql
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from scripts import metrics, profiling, sensor_registry, storage, thingspeak_outbox, wide_tables
+except ImportError:  # executed directly as scripts/<name>.py
+    import metrics
+    import profiling
+    import sensor_registry
+    import storage
+    import thingspeak_outbox
+    import wide_tables
 
 """
 upload_thingspeak.py
 
-Uploads the latest sensor readings from the MySQL database to the ThingSpeak cloud API.
+Uploads the latest sensor readings from the database (MySQL or SQLite, see
+storage.py) to the ThingSpeak cloud API.
 
 - Loads sensor metadata and mapping from sensor_config.json and thingspeak_channels.json
-- Retrieves the most recent value for each sensor from Sensor_Data table
+- Reads the most recent value of every sensor from the newest row of its
+  project's wide table (wide_tables.py, one column per sensor); sensors
+  missing there are looked up in Sensor_Data in one query
 - Groups sensors by project and prepares payloads using field mapping
-- Sends an HTTP POST request to the appropriate ThingSpeak channel using API keys
+- Posts to all due channels concurrently over a pooled keep-alive session,
+  with timeouts, retry with backoff, and per-channel update-interval tracking
+- Channels with a "channel_id" in thingspeak_channels.json go through the
+  durable outbox (thingspeak_outbox.py): every run queues an entry stamped
+  with the time of the channel's newest reading (none if nothing newer was
+  read since the last one), and the queue is drained with bulk JSON updates,
+  so readings taken while the network is down are backfilled instead of
+  lost. Channels without one
+  receive only the latest values through the single-update endpoint
 
 This script is intended to be scheduled (e.g., every 5 or 10 minutes) via cron_manager.py.
 """
@@ -35,15 +61,24 @@ log = logging.info
 log_error = logging.error
 
 # ----------------------
-# MySQL Connection Config
+# ThingSpeak HTTP Settings
 # ----------------------
-DB_CONFIG = {
-    "host": "localhost",
-    "port": 3306,
-    "user": "root",
-    "password": "Grid2030.",
-    "database": "energy_monitoring"
-}
+# Overridable so the uploader can be pointed at a local stub server
+THINGSPEAK_URL = os.environ.get("THINGSPEAK_URL", "https://api.thingspeak.com/update")
+THINGSPEAK_BULK_URL = os.environ.get(
+    "THINGSPEAK_BULK_URL", "https://api.thingspeak.com/channels/{channel_id}/bulk_update.json"
+)
+
+# ThingSpeak rejects channel updates sent faster than this (free tier: 15 s).
+# A channel may override it with "update_interval" in thingspeak_channels.json.
+MIN_UPDATE_INTERVAL = 15
+
+HTTP_TIMEOUT = (3.05, 10)   # (connect, read) seconds
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5          # seconds, doubled on each retry
+HTTP_MAX_WORKERS = 8
+
+CHANNEL_STATE_FILE = Path(__file__).parent.parent / "data" / "thingspeak_state.json"
 
 # ----------------------
 # Load Config Files
@@ -71,59 +106,295 @@ def load_thingspeak_config():
         return json.load(f)
 
 # ----------------------
-# Get Latest Value for Sensor
+# Get Latest Values for Sensors
 # ----------------------
-def fetch_latest_value(conn, sensor_id):
+def fetch_latest_readings(store, sensor_ids):
     """
-    Fetch the most recent reading for a given sensor from the database.
+    Fetch the most recent reading for many sensors in a single query.
+
+    Uses a group-wise max (see storage.BaseStore.fetch_latest_values): the
+    inner MAX(Timestamp) ... GROUP BY Sensor_ID is resolved from the
+    (Sensor_ID, Timestamp) key, and the join back on it returns exactly one
+    row per sensor.
 
     Args:
-        conn (pymysql.Connection): Open database connection
-        sensor_id (int): Sensor ID
+        store (storage.BaseStore): Open storage backend
+        sensor_ids (iterable): Sensor IDs to look up
 
     Returns:
-        float or None: The most recent value, or None if no record exists
+        dict: {sensor_id: (timestamp, value)} for sensors that have at least
+        one reading
     """
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT Value FROM Sensor_Data WHERE Sensor_ID = %s ORDER BY Timestamp DESC LIMIT 1",
-        (sensor_id,)
-    )
-    row = cursor.fetchone()
-    return row[0] if row else None
+    latest = store.fetch_latest_readings(sensor_ids)
+    metrics.DB_ROUNDTRIPS.inc(stage="upload_to_thingspeak")
+    return latest
+
+# ----------------------
+# HTTP Session and Channel Scheduling
+# ----------------------
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Return the shared requests.Session used for all ThingSpeak calls.
+
+    The session keeps keep-alive connections pooled across channels (and
+    across runs when the module stays imported), and retries connection
+    errors and 429/5xx responses with exponential backoff.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["POST"]),
+                respect_retry_after_header=True
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_MAX_WORKERS,
+                pool_maxsize=HTTP_MAX_WORKERS,
+                max_retries=retry
+            )
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+def load_channel_state():
+    """
+    Load the last successful update time (epoch seconds) of each channel.
+
+    Returns:
+        dict: {project: last_update_epoch}
+    """
+    if not CHANNEL_STATE_FILE.exists():
+        return {}
+    try:
+        with open(CHANNEL_STATE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        log_error(f"Could not read ThingSpeak channel state: {e}")
+        return {}
+
+def save_channel_state(state):
+    """Persist channel update times atomically."""
+    CHANNEL_STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = CHANNEL_STATE_FILE.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, CHANNEL_STATE_FILE)
+
+def post_update(session, project, payload, url=None):
+    """
+    POST one channel update.
+
+    Args:
+        session (requests.Session): Pooled session from get_session()
+        project (str): Project name, used for logging
+        payload (dict): Form data including api_key and fieldN values
+        url (str): Update endpoint, defaults to THINGSPEAK_URL
+
+    Returns:
+        bool: True if ThingSpeak accepted the update
+    """
+    start = time.perf_counter()
+    try:
+        response = session.post(url or THINGSPEAK_URL, data=payload, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, status="error")
+        log_error(f"[{project}] HTTP request error: {e}")
+        return False
+    metrics.HTTP_LATENCY.observe(time.perf_counter() - start, status=str(response.status_code))
+
+    # ThingSpeak answers "0" when it rejects an update (e.g. rate limited)
+    if response.status_code == 200 and response.text.strip() not in ("", "0"):
+        log(f"[{project}] Uploaded successfully. Entry ID: {response.text}")
+        return True
+    log_error(f"[{project}] Upload failed. Status: {response.status_code}, Body: {response.text}")
+    return False
+
+def send_updates(updates, url=None, now=None):
+    """
+    Send channel updates concurrently, skipping channels that are not due yet.
+
+    A channel is due once its update interval has elapsed since its last
+    accepted update; posting earlier would only be rejected by ThingSpeak
+    and burn a request.
+
+    Args:
+        updates (dict): {project: (payload, update_interval_seconds)}
+        url (str): Update endpoint, defaults to THINGSPEAK_URL
+        now (float): Current epoch time, for testing
+
+    Returns:
+        dict: {project: True/False} for every channel that was posted
+    """
+    now = time.time() if now is None else now
+    state = load_channel_state()
+
+    due = {}
+    for project, (payload, interval) in updates.items():
+        elapsed = now - state.get(project, 0)
+        if elapsed < interval:
+            log(f"[{project}] Skipping, next update allowed in {interval - elapsed:.0f}s")
+            continue
+        due[project] = payload
+
+    if not due:
+        return {}
+
+    session = get_session()
+    with ThreadPoolExecutor(max_workers=min(HTTP_MAX_WORKERS, len(due))) as pool:
+        futures = {
+            project: pool.submit(post_update, session, project, payload, url)
+            for project, payload in due.items()
+        }
+        results = {project: future.result() for project, future in futures.items()}
+
+    for project, ok in results.items():
+        if ok:
+            state[project] = now
+    save_channel_state(state)
+    for project in updates:
+        if project in state:
+            metrics.UPLOAD_LAG.set(now - state[project], project=project)
+    return results
+
+def post_bulk_update(session, project, channel_id, api_key, entries, url=None):
+    """
+    POST queued entries to a channel's bulk JSON update endpoint.
+
+    Args:
+        session (requests.Session): Pooled session from get_session()
+        project (str): Project name, used for logging
+        channel_id (int|str): ThingSpeak channel ID
+        api_key (str): Channel write API key
+        entries (list): [(entry_id, created_at, {fieldN: value})] from Outbox.peek()
+        url (str): Endpoint template with {channel_id}, defaults to THINGSPEAK_BULK_URL
+
+    Returns:
+        bool: True if ThingSpeak accepted the batch
+    """
+    body = {
+        "write_api_key": api_key,
+        "updates": [dict(fields, created_at=created_at) for _, created_at, fields in entries]
+    }
+    start = time.perf_counter()
+    try:
+        response = session.post(
+            (url or THINGSPEAK_BULK_URL).format(channel_id=channel_id), json=body, timeout=HTTP_TIMEOUT
+        )
+    except requests.RequestException as e:
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - start, status="error")
+        log_error(f"[{project}] Bulk update error: {e}")
+        return False
+    metrics.HTTP_LATENCY.observe(time.perf_counter() - start, status=str(response.status_code))
+
+    try:
+        accepted = response.status_code in (200, 202) and response.json().get("success") is True
+    except (ValueError, AttributeError):
+        accepted = False
+    if accepted:
+        log(f"[{project}] Bulk update accepted ({len(entries)} entries).")
+        return True
+    log_error(f"[{project}] Bulk update failed. Status: {response.status_code}, Body: {response.text}")
+    return False
+
+def drain_outbox(channels, url=None, now=None, outbox_path=None):
+    """
+    Send the oldest queued entries of every due channel, one bulk request
+    (up to BULK_MAX_ENTRIES entries) per channel and run.
+
+    Entries are removed from the outbox only once ThingSpeak accepted them.
+
+    Args:
+        channels (dict): thingspeak_channels.json contents
+        url (str): Bulk endpoint template, defaults to THINGSPEAK_BULK_URL
+        now (float): Current epoch time, for testing
+        outbox_path (Path): Outbox file, defaults to thingspeak_outbox.OUTBOX_FILE
+
+    Returns:
+        dict: {project: True/False} for every channel that was posted
+    """
+    now = time.time() if now is None else now
+    state = load_channel_state()
+    with thingspeak_outbox.Outbox(outbox_path) as outbox:
+        pending = outbox.pending()
+        metrics.BACKLOG.set(sum(pending.values()), stage="thingspeak_outbox")
+
+        batches = {}
+        for project in pending:
+            channel = channels.get(project, {})
+            if not channel.get("channel_id"):
+                log_error(f"[{project}] Queued entries but no channel_id configured; keeping them.")
+                continue
+            elapsed = now - state.get(project, 0)
+            interval = channel.get("update_interval", MIN_UPDATE_INTERVAL)
+            if elapsed < interval:
+                log(f"[{project}] Skipping, next update allowed in {interval - elapsed:.0f}s")
+                continue
+            batches[project] = outbox.peek(project)
+        if not batches:
+            return {}
+
+        session = get_session()
+        with ThreadPoolExecutor(max_workers=min(HTTP_MAX_WORKERS, len(batches))) as pool:
+            futures = {
+                project: pool.submit(
+                    post_bulk_update, session, project, channels[project]["channel_id"],
+                    channels[project].get("write_api_key"), entries, url
+                )
+                for project, entries in batches.items()
+            }
+            results = {project: future.result() for project, future in futures.items()}
+
+        for project, ok in results.items():
+            if ok:
+                outbox.ack(project, batches[project][-1][0])
+                state[project] = now
+                pending[project] -= len(batches[project])
+        metrics.BACKLOG.set(sum(pending.values()), stage="thingspeak_outbox")
+    save_channel_state(state)
+    for project in results:
+        if project in state:
+            metrics.UPLOAD_LAG.set(now - state[project], project=project)
+    return results
 
 # ----------------------
 # Upload Logic
 # ----------------------
+@profiling.profiled("upload_to_thingspeak")
+@metrics.timed("upload_to_thingspeak")
 def upload_to_thingspeak():
     """
     Load sensor values and upload them to the ThingSpeak API.
 
     This function:
-    - Connects to the MySQL database
-    - Maps (project, sensor_code) → Sensor_ID
-    - Reads most recent values from Sensor_Data
+    - Opens the configured storage backend (MySQL or SQLite)
+    - Maps (project, sensor_code) → Sensor_ID via the cached sensor registry,
+      which also registers configured sensors missing from the database
+    - Reads most recent values from the wide tables, falling back to
+      Sensor_Data (single set-based query) for sensors not found there
     - Constructs ThingSpeak payloads by project
-    - Sends updates to each channel via HTTP POST
+    - Queues them for channels with a channel_id and drains the outbox with
+      bulk updates; sends the rest via send_updates()
     """
-    sensor_configs = load_sensor_config()
-    thingspeak_config = load_thingspeak_config()
+    with profiling.span("upload_to_thingspeak", "read"):
+        sensor_configs = load_sensor_config()
+        thingspeak_config = load_thingspeak_config()
+    updates = {}
+    read_at = {}    # project -> time of the newest reading in its payload
 
+    store = None
     try:
-        conn = pymysql.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-
-        # Build mapping of Sensor_IDs by (project, sensor_code)
-        cursor.execute("""
-        SELECT s.Sensor_ID, p.Project_Name, s.Sensor_Code
-        FROM Sensors s
-        JOIN Projects p ON s.Project_ID = p.Project_ID
-        """)
-        rows = cursor.fetchall()
-        sensor_map = {
-        (proj_name.strip(), sensor_code.strip()): sensor_id
-        for (sensor_id, proj_name, sensor_code) in rows
-    }
+        with profiling.span("upload_to_thingspeak", "db"):
+            store = storage.open_store()
+
+            # Mapping of Sensor_IDs by normalized (project, sensor_code)
+            sensor_map = sensor_registry.get_registry().sensor_map(store)
 
         # Group sensors by project
         grouped = {}
@@ -131,7 +402,28 @@ def upload_to_thingspeak():
             proj = sensor["project_id"]
             grouped.setdefault(proj, []).append(sensor)
 
-        # Upload per project
+        # Latest value of every configured sensor: wide table columns first,
+        # then one round trip for the rest
+        with profiling.span("upload_to_thingspeak", "read"):
+            try:
+                wide_readings = wide_tables.latest_readings()
+            except Exception as e:
+                log_error(f"Could not read wide tables: {e}")
+                wide_readings = {}
+        latest_readings = {}
+        missing_ids = []
+        for s in sensor_configs:
+            key = sensor_registry.normalize_key(s["project_id"], s["sensor_id"])
+            sid = sensor_map.get(key)
+            if sid and key in wide_readings:
+                latest_readings[sid] = wide_readings[key]
+            elif sid:
+                missing_ids.append(sid)
+        if missing_ids:
+            with profiling.span("upload_to_thingspeak", "db"):
+                latest_readings.update(fetch_latest_readings(store, missing_ids))
+
+        # Build payload per project
         for project, sensors in grouped.items():
             ts_info = thingspeak_config.get(project)
             if not ts_info:
@@ -144,16 +436,17 @@ def upload_to_thingspeak():
 
             for s in sensors:
                 key = (s["project_id"].strip(), s["sensor_id"].strip())
-                sensor_id = sensor_map.get(key)
+                sensor_id = sensor_map.get(sensor_registry.normalize_key(*key))
 
                 if not sensor_id:
                     log_error(f"[{project}] Sensor not found in DB: {key}")
                     continue
 
-                value = fetch_latest_value(conn, sensor_id)
-                if value is None:
+                reading = latest_readings.get(sensor_id)
+                if reading is None:
                     log_error(f"[{project}] No recent value found for: {key}")
                     continue
+                timestamp, value = reading
 
                 field_name = field_map.get(s["sensor_id"])
                 if not field_name:
@@ -161,28 +454,37 @@ def upload_to_thingspeak():
                     continue
 
                 payload[field_name] = value
+                read_at[project] = max(read_at.get(project, timestamp), timestamp)
 
             # Log the full payload
-            log(f"[{project}] Sending payload: {payload}")
-
-            # POST to ThingSpeak
-            try:
-                response = requests.post("https://api.thingspeak.com/update", data=payload)
-                if response.status_code == 200 and response.text != "0":
-                    log(f"[{project}] Uploaded successfully. Entry ID: {response.text}")
-                else:
-                    log_error(f"[{project}] Upload failed. Status: {response.status_code}, Body: {response.text}")
-            except Exception as e:
-                log_error(f"[{project}] HTTP request error: {e}")
+            log(f"[{project}] Prepared payload: {payload}")
+            interval = ts_info.get("update_interval", MIN_UPDATE_INTERVAL)
+            updates[project] = (payload, interval)
 
     except Exception as e:
         log_error(f"Database connection failed: {e}")
+        updates = {}    # still drain what earlier runs queued
     finally:
-        if conn:
-            conn.close()
+        if store:
+            store.close()
+
+    queued = {
+        project: {k: v for k, v in payload.items() if k != "api_key"}
+        for project, (payload, _) in updates.items()
+        if thingspeak_config[project].get("channel_id")
+    }
+    if queued:
+        with profiling.span("upload_to_thingspeak", "write"), thingspeak_outbox.Outbox() as outbox:
+            for project, fields in queued.items():
+                if not outbox.enqueue({project: fields}, created_at=read_at.get(project)):
+                    log(f"[{project}] No reading newer than the last queued entry; nothing queued.")
+    with profiling.span("upload_to_thingspeak", "http"):
+        drain_outbox(thingspeak_config)
+        send_updates({project: update for project, update in updates.items() if project not in queued})
 
 # ----------------------
 # Entrypoint
 # ----------------------
 if __name__ == "__main__":
     upload_to_thingspeak()
+    metrics.write_textfile("upload_thingspeak")
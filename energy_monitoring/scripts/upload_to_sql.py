@@ -1,23 +1,49 @@
 import os
+import json
 import logging
+import numpy as np
 import pandas as pd
-import pymysql
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    from scripts import archive, metrics, profiling, records, sensor_registry, storage, wide_tables
+except ImportError:  # executed directly as scripts/<name>.py
+    import archive
+    import metrics
+    import profiling
+    import records
+    import sensor_registry
+    import storage
+    import wide_tables
 
 
 """
 upload_to_sql.py
 
-Reads the latest Parquet file containing sensor data and uploads its contents
-into the MySQL database, avoiding duplicates based on (Sensor_ID, Timestamp).
+Uploads every Parquet file in data/processed/ that has not been loaded yet
+into the configured storage backend (MySQL by default, or the embedded SQLite
+database, see storage.py), avoiding duplicates based on (Sensor_ID, Timestamp).
 
 Steps:
-- Reads the most recent .parquet file in the data/processed/ directory
-- Maps (project_name, sensor_code) to Sensor_ID using the Sensors table
-- Verifies for duplicate entries in Sensor_Data table
-- Inserts only new rows for each sensor
+- Compares data/processed/ against a local ledger of already-uploaded files
+- Drains the pending files oldest first, in bounded row batches and with a
+  configurable number of concurrent workers
+- Reads each batch straight into the compact record format (records.py):
+  dictionary indices become sensor keys and native timestamps epoch seconds,
+  so no string is parsed or compared per row
+- Maps (project_name, sensor_code) to Sensor_ID using the Sensors table,
+  once per distinct sensor of the batch
+- Checks for duplicates only within the sensors and time range of the batch
+- Inserts only new rows for each sensor (insert-or-ignore on the unique key)
 - Skips any rows with invalid mappings or missing values
+- Records each fully uploaded file in the ledger, so a MySQL outage is caught
+  up on the next run instead of losing the files written meanwhile
+- Upserts the per-project wide tables (Wide_<project>) changed by the last
+  aggregation runs, as queued by wide_tables.py
 
 This script is intended to be triggered every 30 or 60 minutes via cron_manager.py.
 """
@@ -40,136 +66,387 @@ log = logging.info
 log_error = logging.error
 
 # --------------------------
-# MySQL Connection Config
+# Paths and Constants
 # --------------------------
-DB_CONFIG = {
-    "host": "localhost",
-    "port": 3306,
-    "user": "root",
-    "password": "Grid2030.", 
-    "database": "energy_monitoring"
-}
-
 PROCESSED_DIR = Path(__file__).parent.parent / "data" / "processed"
+LEDGER_FILE = PROCESSED_DIR.parent / "upload_ledger.json"
+# Ledgers of the sharded uploaders (see shards.py), relative to data/
+SHARD_LEDGER_GLOB = "shards/shard-*/upload_ledger.json"
+
+# Projects uploaded by this process: callable(project_id) -> bool, or None
+# for all. Set by shards.configure() in a shard worker.
+PROJECT_FILTER = None
+
+# Rows per INSERT batch and number of files uploaded in parallel
+UPLOAD_BATCH_ROWS = int(os.environ.get("UPLOAD_BATCH_ROWS", 20000))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 2))
+
+REQUIRED_COLS = {"timestamp", "project_id", "sensor_id", "value"}
+
+# Set by compact_parquet.py on files whose rows are all in MySQL already
+UPLOADED_METADATA_KEY = b"grid.uploaded"
 
 # --------------------------
-# Get Latest Parquet File
+# Upload Ledger
 # --------------------------
-def get_latest_parquet_file():
+def ledger_files():
     """
-    Finds the most recent .parquet file from the processed data directory.
+    Returns:
+        list: This uploader's ledger, then the other ledgers of data/ (the
+        unsharded one and every shard's), whichever exist
+    """
+    root = PROCESSED_DIR.parent
+    others = [root / "upload_ledger.json"] + sorted(root.glob(SHARD_LEDGER_GLOB))
+    return [LEDGER_FILE] + [path for path in others if path != LEDGER_FILE]
+
+def load_ledger():
+    """
+    Load the record of Parquet files that have already been uploaded.
+
+    Every ledger is read, so a file uploaded before sharding or by another
+    shard's uploader is not sent again; only LEDGER_FILE is written.
 
     Returns:
-        Path or None: Path to the latest file, or None if no files exist
+        dict: {relative_path: {"rows": int, "uploaded_at": str, "size": int,
+        "mtime_ns": int}}; size and mtime_ns are missing from older entries
     """
-    parquet_files = sorted(PROCESSED_DIR.glob("*.parquet"), reverse=True)
-    return parquet_files[0] if parquet_files else None
+    ledger = {}
+    for path in reversed(ledger_files()):
+        if not path.exists():
+            continue
+        try:
+            with open(path, "r") as f:
+                ledger.update(json.load(f))
+        except (OSError, ValueError) as e:
+            log_error(f"Could not read upload ledger {path.name}, ignoring it: {e}")
+    return ledger
 
-# --------------------------
-# Fetch Sensor Map
-# --------------------------
-def fetch_sensor_ids(conn):
+def prune_ledger(ledger, files=None):
     """
-    Build a mapping from (project_name, sensor_code) to Sensor_ID.
+    Drop entries for files that no longer exist in data/processed/, so the
+    ledger stays proportional to the processed directory. Done once per run.
 
     Args:
-        conn (Connection): MySQL connection
+        files (list): Result of iter_parquet_files(), scanned if None
 
     Returns:
-        dict: {(project_name, sensor_code): sensor_id}
-    """
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT s.Sensor_ID, p.Project_Name, s.Sensor_Code
-        FROM Sensors s
-        JOIN Projects p ON s.Project_ID = p.Project_ID
-    """)
-    rows = cursor.fetchall()
-    return {
-    (proj_name.strip(), sensor_code.strip()): sid
-    for (sid, proj_name, sensor_code) in rows
-}
+        dict: The pruned ledger
+    """
+    present = {ledger_key(f) for f in (iter_parquet_files() if files is None else files)}
+    return {name: entry for name, entry in ledger.items() if name in present}
+
+def save_ledger(ledger):
+    """Persist the ledger atomically (write to a temp file, then rename)."""
+    LEDGER_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = LEDGER_FILE.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(ledger, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, LEDGER_FILE)
+
+def ledger_key(parquet_file):
+    """Ledger key of a file: its path relative to data/processed/ (posix)."""
+    return parquet_file.relative_to(PROCESSED_DIR).as_posix()
+
+def iter_parquet_files():
+    """Yield every data file of the partitioned archive (of PROJECT_FILTER's projects, if set)."""
+    if PROJECT_FILTER is None:
+        return archive.iter_data_files(PROCESSED_DIR)
+    return (
+        f for f in archive.iter_data_files(PROCESSED_DIR)
+        if PROJECT_FILTER(archive.partition_project(f))
+    )
+
+def is_recorded(ledger, parquet_file):
+    """True if the ledger holds parquet_file as it is now, not a file it replaced."""
+    entry = ledger.get(ledger_key(parquet_file))
+    return entry is not None and archive.matches_stamp(entry, parquet_file)
+
+def get_pending_parquet_files(ledger, files=None):
+    """
+    List processed Parquet files that are not yet in the ledger, or were
+    replaced since they were recorded (rows already in MySQL are skipped on
+    insert, so reading such a file again is safe).
+
+    Args:
+        files (list): Result of iter_parquet_files(), scanned if None
+
+    Returns:
+        list: Paths sorted oldest first (file names are timestamp-ordered)
+    """
+    files = iter_parquet_files() if files is None else files
+    pending = [f for f in files if not is_recorded(ledger, f)]
+    return sorted(pending, key=lambda f: (f.name, ledger_key(f)))
+
+def is_already_uploaded(parquet_file):
+    """
+    True for files written by compact_parquet.py, which only merges files
+    that were uploaded already; their rows must not be sent again.
+    """
+    metadata = pq.read_schema(parquet_file).metadata or {}
+    return metadata.get(UPLOADED_METADATA_KEY) == b"true"
 
 # --------------------------
-# Fetch Existing Records
+# Batch Transform
 # --------------------------
-def fetch_existing_records(conn):
+def transform_batch(df, sensor_map):
+    """
+    Convert a DataFrame of readings into Sensor_Data rows (see transform_table()).
+
+    Args:
+        df (DataFrame): Columns timestamp, project_id, sensor_id, value
+        sensor_map (dict): {(project_name, sensor_code): sensor_id}; names are
+            normalized here, so raw or registry keys both work
+
+    Returns:
+        DataFrame: Columns Sensor_ID (int64), Timestamp (naive UTC), Value (float64),
+        free of duplicate (Sensor_ID, Timestamp) pairs
+    """
+    df = df[["timestamp", "project_id", "sensor_id", "value"]].assign(
+        value=pd.to_numeric(df["value"], errors="coerce")
+    )
+    return transform_table(pa.Table.from_pandas(df, preserve_index=False), sensor_map)
+
+def sensor_ids_for(catalog, sensor_map):
+    """
+    Sensor_ID of every key of a records.SensorCatalog, -1 where unmapped.
+
+    Returns:
+        ndarray: int64, indexed by sensor key
+    """
+    lookup = {sensor_registry.normalize_key(*k): sensor_id for k, sensor_id in sensor_map.items()}
+    return np.array(
+        [lookup.get(sensor_registry.normalize_key(p, s), -1) for p, s in catalog.names()],
+        dtype=np.int64
+    )
+
+def transform_table(table, sensor_map):
     """
-    Get all (Sensor_ID, Timestamp) combinations already present in the DB.
+    Convert Arrow readings into Sensor_Data rows through the compact record
+    format (records.from_table()).
+
+    Sensor names are looked up once per distinct (project, sensor) of the
+    batch and gathered by sensor key; timestamps are used as native epoch
+    seconds. Same output and logging as transform_batch().
 
     Args:
-        conn (Connection): MySQL connection
+        table (pyarrow.RecordBatch | pyarrow.Table): timestamp, project_id, sensor_id, value
+        sensor_map (dict): {(project_name, sensor_code): sensor_id}
 
     Returns:
-        set: Set of (sensor_id, timestamp) tuples
+        DataFrame: Columns Sensor_ID (int64), Timestamp (naive UTC), Value (float64),
+        free of duplicate (Sensor_ID, Timestamp) pairs
     """
-    cursor = conn.cursor()
-    cursor.execute("SELECT Sensor_ID, Timestamp FROM Sensor_Data")
-    return set(cursor.fetchall())
+    readings, catalog = records.from_table(table)
+    sensor_ids = sensor_ids_for(catalog, sensor_map)[readings.keys]
+
+    unmapped = sensor_ids < 0
+    if unmapped.any():
+        names = catalog.names()
+        counts = np.bincount(readings.keys[unmapped], minlength=len(catalog))
+        for key in np.flatnonzero(counts):
+            log_error(f"Sensor not found: {names[key]} ({counts[key]} rows)")
+
+    invalid = ~unmapped & ((readings.timestamps == records.NO_TIMESTAMP) | np.isnan(readings.values))
+    if invalid.any():
+        log_error(f"Skipping {int(invalid.sum())} rows with unparsable timestamp or value.")
+
+    keep = ~unmapped & ~invalid
+    batch = pd.DataFrame({
+        "Sensor_ID": sensor_ids[keep],
+        "Timestamp": readings.timestamps[keep].astype("datetime64[s]"),
+        "Value": readings.values[keep].astype(np.float64),
+    })
+    return batch.drop_duplicates(subset=["Sensor_ID", "Timestamp"], ignore_index=True)
+
+def drop_existing(batch, existing):
+    """
+    Remove rows whose (Sensor_ID, Timestamp) is already stored.
+
+    Args:
+        batch (DataFrame): Output of transform_batch()
+        existing (set): (sensor_id, timestamp) tuples from store.fetch_existing_records()
+
+    Returns:
+        DataFrame: Rows of batch not present in existing
+    """
+    if not existing:
+        return batch
+    stored = pd.MultiIndex.from_tuples(list(existing))
+    stored = pd.MultiIndex.from_arrays([
+        stored.get_level_values(0).astype(np.int64),
+        pd.DatetimeIndex(stored.get_level_values(1))
+    ])
+    mask = pd.MultiIndex.from_frame(batch[["Sensor_ID", "Timestamp"]]).isin(stored)
+    return batch[~mask]
+
+def batch_to_rows(batch):
+    """
+    Build executemany() parameter tuples directly from the batch's NumPy arrays.
+
+    Args:
+        batch (DataFrame): Columns Sensor_ID, Timestamp, Value
+
+    Returns:
+        list: [(sensor_id, datetime, value), ...] with native Python types
+    """
+    return list(zip(
+        batch["Sensor_ID"].to_numpy().tolist(),
+        batch["Timestamp"].dt.to_pydatetime().tolist(),
+        batch["Value"].to_numpy().tolist()
+    ))
 
 # --------------------------
 # Upload Logic
 # --------------------------
-def upload_parquet_to_sql():
+def insert_batch(store, batch):
     """
-    Main uploader function. Reads latest Parquet data, checks for valid sensors,
-    skips duplicates, and inserts new sensor readings into the SQL database.
+    Insert one transformed batch, skipping rows already stored.
+
+    The existing-row lookup is limited to the sensors and time range of the
+    batch, so it is served by the (Sensor_ID, Timestamp) key and costs
+    O(batch) regardless of how much history Sensor_Data holds.
+
+    Args:
+        store (storage.BaseStore): Open storage backend
+        batch (DataFrame): Output of transform_batch()
+
+    Returns:
+        int: Number of rows inserted
     """
-    latest_file = get_latest_parquet_file()
-    if not latest_file:
-        log("No Parquet file found.")
-        return
+    if batch.empty:
+        return 0
 
-    log(f"Processing: {latest_file.name}")
-    df = pd.read_parquet(latest_file)
+    existing = store.fetch_existing_records(
+        batch["Sensor_ID"].unique().tolist(),
+        batch["Timestamp"].min().to_pydatetime(),
+        batch["Timestamp"].max().to_pydatetime()
+    )
+    metrics.DB_ROUNDTRIPS.inc(stage="upload_parquet_to_sql")
+    inserts = batch_to_rows(drop_existing(batch, existing))
+    if not inserts:
+        return 0
 
-    required_cols = {"timestamp", "project_id", "sensor_id", "value"}
-    if not required_cols.issubset(df.columns):
-        log_error(f"Missing required columns in parquet: {df.columns}")
-        return
-    conn = None
-    try:
-        conn = pymysql.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        sensor_map = fetch_sensor_ids(conn)
-        log(f"[DEBUG] sensor_map keys: {list(sensor_map.keys())[:10]}")
-        existing = fetch_existing_records(conn)
+    # The unique (Sensor_ID, Timestamp) key is the final guard against
+    # rows written concurrently since the lookup above.
+    inserted = store.insert_readings(inserts)
+    metrics.DB_ROUNDTRIPS.inc(stage="upload_parquet_to_sql")
+    return inserted
 
-        inserts = []
-        for _, row in df.iterrows():
-            key = (row["project_id"].strip(), row["sensor_id"].strip())
-            sensor_id = sensor_map.get(key)
+def upload_file(parquet_file, sensor_map):
+    """
+    Upload one Parquet file in batches of UPLOAD_BATCH_ROWS rows.
 
-            if not sensor_id:
-                log_error(f"Sensor not found: {key}")
-                continue
+    Each call opens its own store connection so files can be uploaded from worker
+    threads. Batches are committed individually; because inserts are
+    idempotent, a file interrupted half-way is simply re-read on the next run.
 
-            timestamp = pd.to_datetime(row["timestamp"]).to_pydatetime()
-            value = float(row["value"])
+    Args:
+        parquet_file (Path): File to upload
+        sensor_map (dict): {(project_name, sensor_code): sensor_id}
 
-            if (sensor_id, timestamp) in existing:
-                continue  # Skip duplicates
+    Returns:
+        tuple: (rows_read, rows_inserted)
+    """
+    pf = pq.ParquetFile(parquet_file)
+    if not REQUIRED_COLS.issubset(pf.schema_arrow.names):
+        raise ValueError(f"Missing required columns in parquet: {pf.schema_arrow.names}")
+
+    rows_read = rows_inserted = 0
+    batches = pf.iter_batches(batch_size=UPLOAD_BATCH_ROWS, columns=sorted(REQUIRED_COLS))
+    with storage.open_store() as store:
+        for record_batch in profiling.timed_iter("upload_parquet_to_sql", "read", batches):
+            with profiling.span("upload_parquet_to_sql", "transform"):
+                batch = transform_table(record_batch, sensor_map)
+            rows_read += record_batch.num_rows
+            with profiling.span("upload_parquet_to_sql", "db"):
+                rows_inserted += insert_batch(store, batch)
+    metrics.BYTES.inc(parquet_file.stat().st_size, stage="upload_parquet_to_sql")
+    return rows_read, rows_inserted
+
+def sync_wide_tables():
+    """
+    Upsert the wide-table ranges queued by aggregate_parquet.py into the
+    Wide_<project> tables. Ranges that fail stay queued for the next run.
+    """
+    if not wide_tables.pending_sql_sync():
+        return
+    try:
+        with profiling.span("upload_parquet_to_sql", "db"), storage.open_store() as store:
+            rows = wide_tables.sync_sql(store)
+        metrics.DB_ROUNDTRIPS.inc(stage="upload_parquet_to_sql")
+        log(f"Synced {rows} wide-table rows.")
+    except Exception as e:
+        log_error(f"Wide table sync failed: {e}")
 
-            inserts.append((sensor_id, timestamp, value))
+@profiling.profiled("upload_parquet_to_sql")
+@metrics.timed("upload_parquet_to_sql")
+def upload_parquet_to_sql():
+    """
+    Main uploader function. Uploads every processed Parquet file missing from
+    the ledger, oldest first, and records each one once it is fully loaded.
+    Pending wide-table updates are synced first. The archive is scanned once
+    per run.
+    """
+    sync_wide_tables()
 
-        if not inserts:
-            log("No new records to insert.")
-            return
+    files = list(iter_parquet_files())
+    ledger = prune_ledger(load_ledger(), files)
+    pending, compacted = [], 0
+    for parquet_file in get_pending_parquet_files(ledger, files):
+        if is_already_uploaded(parquet_file):
+            ledger[ledger_key(parquet_file)] = {
+                "rows": pq.ParquetFile(parquet_file).metadata.num_rows,
+                "uploaded_at": "compacted",
+                **archive.file_stamp(parquet_file)
+            }
+            compacted += 1
+        else:
+            if ledger_key(parquet_file) in ledger:
+                log(f"{ledger_key(parquet_file)} changed since it was uploaded; uploading it again.")
+            pending.append(parquet_file)
+    if compacted:
+        save_ledger(ledger)
+        log(f"Recorded {compacted} compacted file(s) in the ledger.")
+    metrics.BACKLOG.set(len(pending), stage="upload_parquet_to_sql")
+    if not pending:
+        log("No new Parquet files to upload.")
+        return
 
-        cursor.executemany(
-            "INSERT INTO Sensor_Data (Sensor_ID, Timestamp, Value) VALUES (%s, %s, %s)",
-            inserts
-        )
-        conn.commit()
-        log(f"Inserted {cursor.rowcount} records.")
+    log(f"{len(pending)} Parquet file(s) pending upload.")
+    try:
+        with profiling.span("upload_parquet_to_sql", "db"), storage.open_store() as store:
+            sensor_map = sensor_registry.get_registry().sensor_map(store)
+        log(f"[DEBUG] sensor_map keys: {list(sensor_map.keys())[:10]}")
     except Exception as e:
         log_error(f"Upload failed: {e}")
-    finally:
-        if conn:
-            conn.close()
+        return
+
+    remaining = len(pending)
+    stamps = {f: archive.file_stamp(f) for f in pending}    # before reading, so a later change is noticed
+    with ThreadPoolExecutor(max_workers=max(1, UPLOAD_WORKERS)) as pool:
+        futures = {pool.submit(upload_file, f, sensor_map): f for f in pending}
+        for future in as_completed(futures):
+            parquet_file = futures[future]
+            try:
+                rows_read, rows_inserted = future.result()
+            except Exception as e:
+                log_error(f"Upload failed for {ledger_key(parquet_file)}: {e}")
+                continue
+            ledger[ledger_key(parquet_file)] = {
+                "rows": rows_read,
+                "uploaded_at": datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+                **stamps[parquet_file]
+            }
+            with profiling.span("upload_parquet_to_sql", "write"):
+                save_ledger(ledger)
+            remaining -= 1
+            metrics.ROWS.inc(rows_inserted, stage="upload_parquet_to_sql")
+            metrics.BACKLOG.set(remaining, stage="upload_parquet_to_sql")
+            log(f"Processed: {ledger_key(parquet_file)} ({rows_read} rows read, {rows_inserted} inserted)")
 
 # --------------------------
 # Entrypoint
 # --------------------------
 if __name__ == "__main__":
     upload_parquet_to_sql()
+    metrics.write_textfile("upload_to_sql")
@@ -0,0 +1,205 @@
+"""
+validation.py
+
+Columnar validation of raw readings before they enter the Parquet archive.
+
+Every check runs on whole Arrow/NumPy columns, so a clean batch costs a few
+vectorized comparisons and is passed through untouched:
+
+- bad_timestamp: missing (unparsable) timestamp, or more than
+  MAX_CLOCK_SKEW ahead of the aggregation time
+- nan_value: missing or NaN value
+- out_of_range: value outside the [min, max] limits of its sensor type in
+  config/validation_limits.json (types without limits are not range-checked)
+- non_monotonic_timestamp: timestamp not later than every earlier accepted
+  reading of the same (project, sensor) in arrival order (duplicates or clock
+  jumps).
+  The aggregator passes one last_seen dict to all tables of a run, so a
+  reading older than one from an earlier segment or CSV of the same run is
+  caught too; readings archived by earlier runs are not consulted (their
+  duplicates are skipped by the Sensor_Data key on upload)
+
+A row failing several checks gets the first reason in that order. Rejected
+rows are written with a `reason` column to data/quarantine/<name>.parquet,
+outside the archive, so they are kept for inspection but never uploaded.
+"""
+
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+LIMITS_PATH = Path(__file__).parent.parent / "config" / "validation_limits.json"
+QUARANTINE_DIR = Path(__file__).parent.parent / "data" / "quarantine"
+
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+# Reason codes, in order of precedence (index 0 means the row is valid)
+REASONS = ["", "bad_timestamp", "nan_value", "out_of_range", "non_monotonic_timestamp"]
+BAD_TIMESTAMP, NAN_VALUE, OUT_OF_RANGE, NON_MONOTONIC = 1, 2, 3, 4
+
+# ---------------------------
+# Limits
+# ---------------------------
+def load_limits(path=LIMITS_PATH):
+    """
+    Returns:
+        dict: {sensor_type: (min, max)}; empty if the file does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        limits = json.load(f)
+    return {
+        sensor_type: (float(bounds.get("min", -np.inf)), float(bounds.get("max", np.inf)))
+        for sensor_type, bounds in limits.items()
+    }
+
+# ---------------------------
+# Checks
+# ---------------------------
+def _dictionary_column(table, name):
+    """Column as one DictionaryArray (indices, dictionary values)."""
+    column = table[name].combine_chunks()
+    if not pa.types.is_dictionary(column.type):
+        column = column.dictionary_encode()
+    return column.indices.fill_null(-1).to_numpy(zero_copy_only=False), column.dictionary.to_pylist()
+
+def reason_codes(table, limits, now=None, last_seen=None):
+    """
+    Compute the rejection reason of every row.
+
+    Args:
+        table (pyarrow.Table): Readings in segment_log.RAW_SCHEMA
+        limits (dict): {sensor_type: (min, max)} from load_limits()
+        now (datetime): Aggregation time (UTC), defaults to now
+        last_seen (dict): {(project, sensor): epoch seconds} of the newest
+            reading in earlier tables of the run; updated in place
+
+    Returns:
+        ndarray: int8 index into REASONS per row (0 = valid)
+    """
+    now = now or datetime.now(timezone.utc)
+    if now.tzinfo is None:
+        now = now.replace(tzinfo=timezone.utc)
+    n = table.num_rows
+    codes = np.zeros(n, dtype=np.int8)
+
+    def flag(mask, code):
+        codes[(codes == 0) & mask] = code
+
+    timestamps = table["timestamp"].combine_chunks()
+    seconds = pc.cast(timestamps, pa.int64()).to_numpy(zero_copy_only=False)    # nulls become NaN
+    missing_ts = timestamps.is_null().to_numpy(zero_copy_only=False)
+    latest = pa.scalar(now + MAX_CLOCK_SKEW, type=timestamps.type)
+    future = pc.greater(timestamps, latest).fill_null(False).to_numpy(zero_copy_only=False)
+    flag(missing_ts | future, BAD_TIMESTAMP)
+
+    values = table["value"].combine_chunks()
+    numbers = pc.cast(values, pa.float64()).to_numpy(zero_copy_only=False)      # nulls become NaN
+    flag(np.isnan(numbers), NAN_VALUE)
+
+    if limits:
+        type_index, type_names = _dictionary_column(table, "sensor_type")
+        lows = np.array([limits.get(t, (-np.inf, np.inf))[0] for t in type_names] + [-np.inf])
+        highs = np.array([limits.get(t, (-np.inf, np.inf))[1] for t in type_names] + [np.inf])
+        with np.errstate(invalid="ignore"):
+            flag((numbers < lows[type_index]) | (numbers > highs[type_index]), OUT_OF_RANGE)
+
+    # Per-sensor arrival order: stable sort by sensor, compare with the newest
+    # earlier reading that passed the checks above
+    checked = np.flatnonzero(codes == 0)
+    if checked.size > 1 or (checked.size and last_seen is not None):
+        project_index, project_names = _dictionary_column(table, "project_id")
+        sensor_index, sensor_names = _dictionary_column(table, "sensor_id")
+        keys = (project_index.astype(np.int64) + 1) * (len(sensor_names) + 1) + sensor_index + 1
+        keys = keys[checked]
+        order = checked[np.argsort(keys, kind="stable")]
+        sorted_keys = np.sort(keys, kind="stable")
+        stamps = seconds[order].astype(np.int64)
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        starts = np.flatnonzero(first)
+
+        group_names = [
+            (project_names[p] if p >= 0 else None, sensor_names[s] if s >= 0 else None)
+            for p, s in zip(project_index[order[starts]], sensor_index[order[starts]])
+        ]
+        low = int(stamps.min())
+        shifted = stamps - low
+        carried = np.array([-1 if last_seen is None or name not in last_seen else last_seen[name] - low
+                            for name in group_names], dtype=np.int64)
+
+        # Running max per sensor (seeded with the carried one) in one pass:
+        # each sensor's stamps are shifted into their own range above the
+        # previous sensor's
+        seeded = shifted.copy()
+        seeded[starts] = np.maximum(shifted[starts], carried)
+        offsets = (np.cumsum(first) - 1) * (int(seeded.max()) + 1)
+        running = np.maximum.accumulate(seeded + offsets) - offsets
+        previous = np.empty(order.size, dtype=np.int64)
+        previous[1:] = running[:-1]
+        previous[starts] = carried
+        repeated = shifted <= previous
+
+        mask = np.zeros(n, dtype=bool)
+        mask[order[repeated]] = True
+        flag(mask, NON_MONOTONIC)
+        if last_seen is not None:
+            newest = np.maximum.reduceat(seeded, starts) + low
+            last_seen.update(zip(group_names, newest.tolist()))
+    return codes
+
+def validate(table, limits, now=None, last_seen=None):
+    """
+    Split readings into clean and quarantined rows.
+
+    Args:
+        last_seen (dict): Shared by the tables of one run, see reason_codes()
+
+    Returns:
+        tuple: (clean table, quarantined table with a `reason` column or None).
+        A table without rejected rows is returned as is.
+    """
+    if table.num_rows == 0:
+        return table, None
+    codes = reason_codes(table, limits, now, last_seen)
+    rejected = codes != 0
+    if not rejected.any():
+        return table, None
+    bad = table.filter(pa.array(rejected))
+    reasons = pa.DictionaryArray.from_arrays(
+        pa.array(codes[rejected], type=pa.int8()), pa.array(REASONS)
+    )
+    return table.filter(pa.array(~rejected)), bad.append_column("reason", reasons)
+
+def count_reasons(quarantined):
+    """Returns: dict: {reason: rows}"""
+    counts = pc.value_counts(quarantined["reason"].combine_chunks().dictionary_decode())
+    return {item["values"].as_py(): item["counts"].as_py() for item in counts}
+
+def write_quarantine(tables, name, base=None):
+    """
+    Write quarantined rows of one aggregation run to <base>/<name>.
+
+    Returns:
+        Path: Written file, or None if there was nothing to write
+    """
+    tables = [t for t in tables if t is not None and t.num_rows]
+    if not tables:
+        return None
+    path = Path(base or QUARANTINE_DIR) / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    table = pa.concat_tables(tables).unify_dictionaries()
+    tmp_file = path.with_name(f".{path.name}.tmp")
+    pq.write_table(table, tmp_file, compression="zstd")
+    tmp_file.replace(path)
+    return path
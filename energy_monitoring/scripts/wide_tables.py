@@ -0,0 +1,478 @@
+"""
+wide_tables.py
+
+Per-project wide views of the readings: one row per sample-interval bucket
+and one column per sensor, for consumers that want the simultaneous
+readings of a site side by side (Power BI dashboards, ThingSpeak payloads)
+instead of pivoting the long archive at read time.
+
+- Parquet: data/wide/project=<id>/YYYY-MM-DD.parquet holds a `timestamp`
+  column (bucket start, UTC) and one float32 column per sensor_id, sorted by
+  time. aggregate_parquet.py pivots the readings it archives (WideBuffer)
+  and merges them into the day files they touch; a newer reading replaces
+  an older one in the same cell, cells it does not cover are kept
+- SQL: one table per project, Wide_<project>, with a Timestamp primary key
+  and one FLOAT column per sensor (added with ALTER TABLE when a sensor
+  first appears). The time ranges changed in Parquet are queued in
+  data/wide/_sql_pending.json and upserted by upload_to_sql.py over its own
+  database session, so aggregation never waits on the database; a failed
+  sync stays queued for the next run. The queue is only changed under a
+  file lock (data/wide/_sql.lock), so ranges queued during a sync are kept
+- Sensor ids are mapped to SQL column names once and the mapping is kept in
+  data/wide/_sql_columns.json: ids that only differ in punctuation or case
+  (PV-Volt, PV_Volt, pv_volt) get a hash suffix instead of sharing a column
+- Buckets are WIDE_INTERVAL seconds long (default 30, the sampling
+  interval); within a bucket the last reading of a sensor wins
+- latest_readings() returns the newest value of every sensor and the
+  bucket it was read in, for upload_thingspeak.py; read_wide() serves
+  dashboards and notebooks
+
+    python scripts/wide_tables.py --rebuild   # regenerate from data/processed/
+"""
+
+import os
+import re
+import json
+import zlib
+import shutil
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # Windows: the thread lock below still serializes cron jobs
+    fcntl = None
+
+try:
+    from scripts import archive, records, sensor_registry
+except ImportError:  # executed directly as scripts/<name>.py
+    import archive
+    import records
+    import sensor_registry
+
+# ---------------------------
+# Paths and Constants
+# ---------------------------
+WIDE_DIR = Path(__file__).parent.parent / "data" / "wide"
+WIDE_INTERVAL = int(os.environ.get("WIDE_INTERVAL_SECONDS", 30))    # seconds per row
+PENDING_FILE_NAME = "_sql_pending.json"
+COLUMNS_FILE_NAME = "_sql_columns.json"
+LOCK_FILE_NAME = "_sql.lock"
+
+SQL_TABLE_PREFIX = "Wide_"
+SQL_BATCH_ROWS = 1000
+COMPRESSION = "zstd"
+
+SECONDS_PER_DAY = 86400
+_SQL_UNSAFE = re.compile(r"\W+")
+_queue_lock = threading.Lock()
+
+# ---------------------------
+# Layout
+# ---------------------------
+def project_dir(base, project):
+    return Path(base) / f"project={quote(str(project), safe='')}"
+
+def wide_path(base, project, date_str):
+    """data/wide/project=<id>/YYYY-MM-DD.parquet"""
+    return project_dir(base, project) / f"{date_str}.parquet"
+
+def iter_projects(base=None):
+    """Yield (project, directory) for every project with wide files."""
+    base = Path(base or WIDE_DIR)
+    if not base.exists():
+        return
+    for path in sorted(base.glob("project=*")):
+        if path.is_dir():
+            yield unquote(path.name.split("=", 1)[1]), path
+
+def day_files(directory):
+    """Day files of one project, oldest first (temporary files excluded)."""
+    return sorted(p for p in Path(directory).glob("*.parquet") if not p.name.startswith("."))
+
+def sql_table_name(project):
+    """Returns: str: Wide_<project> with every non-word run replaced by '_'"""
+    return SQL_TABLE_PREFIX + (_SQL_UNSAFE.sub("_", str(project)).strip("_") or "project")
+
+def sql_column_name(sensor_id):
+    """Returns: str: sensor_id with every non-word run replaced by '_' (unique names: sql_columns())"""
+    return _SQL_UNSAFE.sub("_", str(sensor_id)).strip("_") or "sensor"
+
+def assign_columns(sensor_ids, assigned):
+    """
+    Give every new sensor_id a column name no other sensor of the table has,
+    case-insensitively (MySQL column names are): sql_column_name(), plus a
+    crc32 suffix of the sensor_id when that name is taken.
+
+    Args:
+        sensor_ids (iterable): Sensor ids of one table
+        assigned (dict): {sensor_id: column} already in use, updated in place
+
+    Returns:
+        list: Column name of every sensor_id, in order
+    """
+    taken = {"timestamp"} | {c.casefold() for c in assigned.values()}
+    for sensor_id in sorted(set(map(str, sensor_ids)) - set(assigned)):
+        column = sql_column_name(sensor_id)
+        salt = ""
+        while column.casefold() in taken:
+            column = f"{sql_column_name(sensor_id)}_{zlib.crc32((sensor_id + salt).encode('utf-8')):08x}"
+            salt += "#"
+        assigned[sensor_id] = column
+        taken.add(column.casefold())
+    return [assigned[str(s)] for s in sensor_ids]
+
+# ---------------------------
+# Pivot
+# ---------------------------
+def pivot(table, interval=None):
+    """
+    Pivot long readings into one wide frame per (project, date).
+
+    Args:
+        table (pyarrow.Table | pyarrow.RecordBatch): Readings in the raw layout
+        interval (int): Bucket length in seconds, defaults to WIDE_INTERVAL
+
+    Returns:
+        dict: {(project, date_str): DataFrame} indexed by bucket start
+        (datetime64[s], naive UTC) with one float32 column per sensor_id.
+        Readings without a timestamp, value or project are left out.
+    """
+    interval = interval or WIDE_INTERVAL
+    readings, catalog = records.from_table(table)
+    names = catalog.names()
+    readings = readings.take(
+        (readings.timestamps != records.NO_TIMESTAMP) & ~np.isnan(readings.values)
+    )
+    if not len(readings):
+        return {}
+
+    # Stable time order, so the last reading of a bucket is the latest one to arrive
+    readings = readings.take(np.argsort(readings.timestamps, kind="stable"))
+    buckets = readings.timestamps // interval * interval
+    days = buckets // SECONDS_PER_DAY
+
+    key_projects = np.array([project for project, _ in names], dtype=object)
+    frames = {}
+    for project in dict.fromkeys(p for p in key_projects if p is not None):
+        project_keys = np.flatnonzero(key_projects == project)
+        column_of_key = np.full(len(names), -1, dtype=np.int64)
+        column_of_key[project_keys] = np.arange(len(project_keys))
+        in_project = column_of_key[readings.keys] >= 0
+
+        for day in np.unique(days[in_project]):
+            selected = in_project & (days == day)
+            rows, row_index = np.unique(buckets[selected], return_inverse=True)
+            columns = column_of_key[readings.keys[selected]]
+            cells = row_index.reshape(-1) * len(project_keys) + columns
+            # Last reading per cell: first occurrence in the reversed order
+            _, first_reversed = np.unique(cells[::-1], return_index=True)
+            last = len(cells) - 1 - first_reversed
+
+            matrix = np.full(len(rows) * len(project_keys), np.nan, dtype=np.float32)
+            matrix[cells[last]] = readings.values[selected][last]
+            frame = pd.DataFrame(
+                matrix.reshape(len(rows), len(project_keys)),
+                index=pd.Index(rows.astype("datetime64[s]"), name="timestamp"),
+                columns=[names[k][1] for k in project_keys],
+            ).dropna(axis=1, how="all")
+            date_str = str(np.datetime64(int(day), "D"))
+            frames[(project, date_str)] = frame
+    return frames
+
+def overlay(frames):
+    """
+    Overlay wide frames, oldest first: a cell of a later frame replaces the
+    same cell of earlier ones, cells it does not have are kept.
+
+    Returns:
+        DataFrame: Union of rows and columns, sorted by time and sensor_id
+    """
+    frames = [f for f in frames if f is not None and not f.empty]
+    if len(frames) == 1:
+        merged = frames[0].sort_index()
+    else:
+        merged = pd.concat(frames).groupby(level=0, sort=True).last()    # last non-null per cell
+    return merged[sorted(merged.columns)].astype(np.float32)
+
+# ---------------------------
+# Parquet Files
+# ---------------------------
+def read_day(path):
+    """
+    Returns:
+        DataFrame: Wide day file indexed by timestamp (datetime64[s], naive UTC)
+    """
+    frame = pq.read_table(path).to_pandas()
+    frame["timestamp"] = frame["timestamp"].dt.tz_localize(None).astype("datetime64[s]")
+    return frame.set_index("timestamp")
+
+def write_day(frame, path):
+    """Write a wide frame atomically (temporary name, then rename)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    timestamps = pa.array(frame.index.to_numpy(dtype="datetime64[s]")).cast(pa.timestamp("s", tz="UTC"))
+    columns = [timestamps] + [pa.array(frame[c].to_numpy(dtype=np.float32), from_pandas=True) for c in frame.columns]
+    table = pa.Table.from_arrays(columns, names=["timestamp"] + [str(c) for c in frame.columns])
+    tmp_file = archive.temp_path(path)
+    pq.write_table(table, tmp_file, compression=COMPRESSION)
+    os.replace(tmp_file, path)
+
+class WideBuffer:
+    """
+    Wide frames of one aggregation run, merged into the day files by write().
+
+    Memory is one float32 cell per (bucket, sensor) of the run's window.
+    The frames are overlaid once per day file when written, not on every add.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or WIDE_INTERVAL
+        self.frames = {}    # (project, date_str) -> [DataFrame], in arrival order
+
+    def __len__(self):
+        return len(self.frames)
+
+    def add(self, table):
+        """Pivot a table of readings and overlay it on what was added before."""
+        for key, frame in pivot(table, self.interval).items():
+            self.frames.setdefault(key, []).append(frame)
+
+    def write(self, base=None, replace=False):
+        """
+        Merge the buffered frames into the day files (or overwrite them with
+        replace=True) and empty the buffer.
+
+        Returns:
+            list: [(project, date_str, first, last)] ISO-8601 bucket range
+            written per day file, for queue_sql_sync()
+        """
+        base = Path(base or WIDE_DIR)
+        touched = []
+        for (project, date_str), frames in sorted(self.frames.items()):
+            path = wide_path(base, project, date_str)
+            existing = read_day(path) if path.exists() and not replace else None
+            write_day(overlay([existing] + frames), path)
+            first = min(f.index.min() for f in frames)
+            last = max(f.index.max() for f in frames)
+            touched.append((project, date_str, _iso(first), _iso(last)))
+        self.frames = {}
+        return touched
+
+def _iso(timestamp):
+    return pd.Timestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%S")
+
+# ---------------------------
+# Readers
+# ---------------------------
+def read_wide(project, start=None, end=None, base=None):
+    """
+    Wide readings of one project between start and end (inclusive, naive UTC).
+
+    Returns:
+        DataFrame: Indexed by timestamp, one column per sensor_id; empty if
+        nothing was written for the project
+    """
+    directory = project_dir(base or WIDE_DIR, project)
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    frames = []
+    for path in day_files(directory):
+        day = pd.Timestamp(path.stem)
+        if (start is not None and day + pd.Timedelta(days=1) <= start) or (end is not None and day > end):
+            continue
+        frames.append(read_day(path))
+    if not frames:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="timestamp"))
+    wide = pd.concat(frames).sort_index()
+    return wide.loc[start:end]
+
+def latest_readings(base=None):
+    """
+    Newest reading of every sensor, read from the last day file of each project.
+
+    Returns:
+        dict: {(normalized project, normalized sensor_id): (datetime, float)}
+        with the start of the bucket the value was read in (naive UTC)
+    """
+    latest = {}
+    for project, directory in iter_projects(base):
+        files = day_files(directory)
+        if not files:
+            continue
+        frame = read_day(files[-1])
+        for sensor_id in frame.columns:
+            values = frame[sensor_id].dropna()
+            if not values.empty:
+                latest[sensor_registry.normalize_key(project, sensor_id)] = (
+                    values.index[-1].to_pydatetime(), float(values.iloc[-1])
+                )
+    return latest
+
+def latest_values(base=None):
+    """
+    Returns:
+        dict: {(normalized project, normalized sensor_id): float}, see latest_readings()
+    """
+    return {key: value for key, (_, value) in latest_readings(base).items()}
+
+# ---------------------------
+# SQL Sync
+# ---------------------------
+@contextmanager
+def _locked(base):
+    """
+    Hold the SQL sync lock of a wide directory: a thread lock for the cron
+    worker threads plus a flock on data/wide/_sql.lock for other processes
+    (subprocess jobs, shard workers).
+    """
+    base = Path(base or WIDE_DIR)
+    base.mkdir(parents=True, exist_ok=True)
+    with _queue_lock, open(base / LOCK_FILE_NAME, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        yield
+
+def _read_json(path, default):
+    if not path.exists():
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_json(data, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = archive.temp_path(path)
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, path)
+
+def _pending_file(base):
+    return Path(base or WIDE_DIR) / PENDING_FILE_NAME
+
+def pending_sql_sync(base=None):
+    """
+    Returns:
+        list: Queued [project, date_str, first, last] ranges not yet in SQL
+    """
+    return _read_json(_pending_file(base), [])
+
+def queue_sql_sync(touched, base=None):
+    """Add ranges returned by WideBuffer.write(), widening those already queued."""
+    if not touched:
+        return
+    with _locked(base):
+        ranges = {(p, d): [first, last] for p, d, first, last in pending_sql_sync(base)}
+        for project, date_str, first, last in touched:
+            current = ranges.get((project, date_str))
+            if current:
+                first, last = min(first, current[0]), max(last, current[1])
+            ranges[(project, date_str)] = [first, last]
+        _write_json([[p, d, *r] for (p, d), r in sorted(ranges.items())], _pending_file(base))
+
+def _dequeue(entry, base):
+    """
+    Remove a synced range from the queue, re-read under the lock. A range
+    widened by queue_sql_sync() since it was read stays queued.
+    """
+    with _locked(base):
+        pending = pending_sql_sync(base)
+        if entry in pending:
+            pending.remove(entry)
+            _write_json(pending, _pending_file(base))
+
+def sql_columns(table, sensor_ids, base=None):
+    """
+    Column names of sensor_ids in a Wide_<project> table, assigning new ones
+    (assign_columns()) and saving them in data/wide/_sql_columns.json.
+
+    Returns:
+        list: Column name of every sensor_id, in order
+    """
+    path = Path(base or WIDE_DIR) / COLUMNS_FILE_NAME
+    with _locked(base):
+        mapping = _read_json(path, {})
+        assigned = mapping.setdefault(table, {})
+        known = len(assigned)
+        columns = assign_columns(sensor_ids, assigned)
+        if len(assigned) != known:
+            _write_json(mapping, path)
+    return columns
+
+def sync_sql(store, base=None, batch_rows=SQL_BATCH_ROWS):
+    """
+    Upsert the queued ranges into the Wide_<project> tables.
+
+    Each range is removed from the queue once committed; an error stops the
+    sync and leaves it (and the rest) queued. Ranges queued meanwhile are
+    synced by the next run.
+
+    Args:
+        store (storage.BaseStore): Open storage backend
+
+    Returns:
+        int: Rows upserted
+    """
+    total = 0
+    for entry in pending_sql_sync(base):
+        project, date_str, first, last = entry
+        path = wide_path(base or WIDE_DIR, project, date_str)
+        if path.exists():
+            frame = read_day(path).loc[pd.Timestamp(first):pd.Timestamp(last)]
+            if not frame.empty:
+                table = sql_table_name(project)
+                columns = sql_columns(table, list(frame.columns), base)
+                store.ensure_wide_table(table, columns)
+                values = frame.to_numpy(dtype=np.float64).astype(object)
+                values[frame.isna().to_numpy()] = None
+                rows = [(ts.to_pydatetime(), *row) for ts, row in zip(frame.index, values.tolist())]
+                store.upsert_wide_rows(table, columns, rows, batch_rows)
+                total += len(rows)
+        _dequeue(entry, base)
+    return total
+
+# ---------------------------
+# Rebuild
+# ---------------------------
+def rebuild(base=None, processed_dir=None, interval=None):
+    """
+    Regenerate every wide file from the Parquet archive, one archive
+    partition at a time, and queue all of it for the SQL sync.
+
+    Returns:
+        int: Number of day files written
+    """
+    base = Path(base or WIDE_DIR)
+    for _, directory in iter_projects(base):
+        shutil.rmtree(directory)
+    buffer = WideBuffer(interval)
+    written = []
+    partitions = {}
+    for path in archive.iter_data_files(processed_dir):
+        partitions.setdefault(path.parent, []).append(path)
+    for files in partitions.values():
+        for path in files:
+            buffer.add(pq.read_table(path, columns=["timestamp", "project_id", "sensor_id", "value"]))
+        written += buffer.write(base)
+    queue_sql_sync(written, base)
+    return len(written)
+
+# ---------------------------
+# Entrypoint
+# ---------------------------
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Per-project wide tables")
+    parser.add_argument("--rebuild", action="store_true", help="regenerate every wide file from data/processed/")
+    args = parser.parse_args()
+    if args.rebuild:
+        logging.info(f"Rebuilt {rebuild()} wide day file(s) in {WIDE_DIR}")
+    else:
+        parser.print_help()
@@ -2,10 +2,13 @@
 
 import os
 import json
+import threading
 import pytest
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs
 
 # Paths
 BASE_DIR = Path(__file__).parent.parent
@@ -18,9 +21,36 @@ PROC_DIR = BASE_DIR / "data" / "processed"
 # ----------
 
 def most_recent_file(folder: Path, ext: str):
-    files = sorted(folder.glob(f"*.{ext}"), reverse=True)
+    files = sorted(folder.rglob(f"*.{ext}"), key=lambda f: f.name, reverse=True)
     return files[0] if files else None
 
+@pytest.fixture
+def thingspeak_stub():
+    """Local HTTP server standing in for api.thingspeak.com/update."""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+            if self.path.endswith("/bulk_update.json"):
+                received.append(dict(json.loads(body), path=self.path))
+                reply, status = b'{"success":true}', 202
+            else:
+                received.append({k: v[0] for k, v in parse_qs(body).items()})
+                reply, status = str(len(received)).encode(), 200
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/update", received
+    server.shutdown()
+
 # ----------
 # Tests
 # ----------
@@ -31,14 +61,14 @@ def test_sensor_config_loads():
     assert isinstance(config, list)
     assert all("sensor_id" in s for s in config)
 
-def test_csv_generated():
-    today = datetime.utcnow().strftime('%Y-%m-%d')
-    folder = RAW_DIR / today
-    assert folder.exists(), "Raw folder does not exist. Run generate_sample_data.py first."
-    csv = most_recent_file(folder, "csv")
-    assert csv and csv.exists(), "No CSV file found."
-    df = pd.read_csv(csv)
-    assert not df.empty and "sensor_id" in df.columns
+def test_raw_segment_generated():
+    from scripts import segment_log
+    folder = RAW_DIR / "segments"
+    assert folder.exists(), "Segment folder does not exist. Run generate_sample_data.py first."
+    segments = sorted(folder.glob("*.open")) + sorted(folder.glob("*.seg"))
+    assert segments, "No raw segment found."
+    batches = segment_log.read_segment(segments[-1])
+    assert batches and "sensor_id" in batches[0].schema.names
 
 def test_parquet_created():
     parquet = most_recent_file(PROC_DIR, "parquet")
@@ -56,3 +86,694 @@ def test_upload_thingspeak_runs():
     # Placeholder: test function runs (use a dummy API key in config)
     from scripts import upload_thingspeak
     upload_thingspeak.upload_to_thingspeak()
+
+def test_transform_batch_maps_and_dedups():
+    from scripts import upload_to_sql
+    df = pd.DataFrame({
+        "timestamp": ["2025-06-05T08:41:02Z", "2025-06-05T08:41:02Z", "2025-06-05T08:41:32Z", "not-a-time"],
+        "project_id": ["HAWT ", "HAWT", "HAWT", "HAWT"],
+        "sensor_id": ["Irr_1", "Irr_1", "Unknown_1", "Irr_1"],
+        "value": [1.0, 1.0, 2.0, 3.0],
+    })
+    batch = upload_to_sql.transform_batch(df, {("HAWT", "Irr_1"): 12})
+    assert batch["Sensor_ID"].tolist() == [12]
+    rows = upload_to_sql.batch_to_rows(batch)
+    assert rows == [(12, datetime(2025, 6, 5, 8, 41, 2), 1.0)]
+    assert upload_to_sql.drop_existing(batch, {(12, datetime(2025, 6, 5, 8, 41, 2))}).empty
+
+def test_upload_ledger_tracks_pending_files(tmp_path, monkeypatch):
+    from scripts import upload_to_sql
+    monkeypatch.setattr(upload_to_sql, "PROCESSED_DIR", tmp_path / "processed")
+    monkeypatch.setattr(upload_to_sql, "LEDGER_FILE", tmp_path / "upload_ledger.json")
+    (tmp_path / "processed").mkdir()
+    for name in ["2025-06-05_08-04.parquet", "2025-06-05_08-41.parquet"]:
+        (tmp_path / "processed" / name).touch()
+
+    ledger = upload_to_sql.load_ledger()
+    assert [f.name for f in upload_to_sql.get_pending_parquet_files(ledger)] == [
+        "2025-06-05_08-04.parquet", "2025-06-05_08-41.parquet"
+    ]
+    ledger["2025-06-05_08-04.parquet"] = {"rows": 16}
+    ledger["2025-06-04_23-59.parquet"] = {"rows": 16}  # compacted away, pruned once per run
+    upload_to_sql.save_ledger(upload_to_sql.prune_ledger(ledger))
+
+    ledger = upload_to_sql.load_ledger()
+    assert list(ledger) == ["2025-06-05_08-04.parquet"]
+    assert [f.name for f in upload_to_sql.get_pending_parquet_files(ledger)] == ["2025-06-05_08-41.parquet"]
+
+def test_thingspeak_send_updates_respects_interval(tmp_path, monkeypatch, thingspeak_stub):
+    from scripts import upload_thingspeak
+    url, received = thingspeak_stub
+    monkeypatch.setattr(upload_thingspeak, "CHANNEL_STATE_FILE", tmp_path / "thingspeak_state.json")
+    updates = {
+        "HAWT": ({"api_key": "K1", "field1": 1.5}, 15),
+        "Solar_Brick": ({"api_key": "K2", "field1": 2.5}, 15),
+    }
+
+    results = upload_thingspeak.send_updates(updates, url=url, now=1000.0)
+    assert results == {"HAWT": True, "Solar_Brick": True}
+    assert sorted(r["api_key"] for r in received) == ["K1", "K2"]
+
+    # Within the channel interval nothing is sent
+    assert upload_thingspeak.send_updates(updates, url=url, now=1010.0) == {}
+    assert len(received) == 2
+    assert len(upload_thingspeak.send_updates(updates, url=url, now=1016.0)) == 2
+
+def test_cron_job_runner_prevents_overlap(tmp_path, monkeypatch):
+    from scripts import cron_manager, metrics
+    monkeypatch.setattr(metrics, "METRICS_DIR", tmp_path)
+    runner = cron_manager.JobRunner({"slow": ("generate_sample_data", "generate_sample", 30, 5)})
+    release = threading.Event()
+    calls = []
+    runner.callables["slow"] = lambda: (calls.append(1), release.wait(5))
+
+    first = runner.submit("slow")
+    assert first is not None
+    assert runner.submit("slow") is None  # still running
+    release.set()
+    first.result(timeout=5)
+    runner.submit("slow").result(timeout=5)
+    assert len(calls) == 2
+    runner.shutdown()
+
+def test_metrics_render_prometheus_text():
+    from scripts import metrics
+    metrics.ROWS.inc(16, stage="test_stage")
+    with metrics.timed("test_stage"):
+        pass
+    text = metrics.render()
+    assert '# TYPE pipeline_rows_total counter' in text
+    assert 'pipeline_rows_total{stage="test_stage"} 16' in text
+    assert 'pipeline_stage_duration_seconds_count{stage="test_stage"} 1' in text
+
+def test_load_generator_raw_csvs_are_aggregated(tmp_path, monkeypatch):
+    from datetime import timedelta
+    from scripts import aggregate_parquet, archive, generate_sample_data as gen, validation, wide_tables
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(minutes=5)
+    if start.date() != now.date():
+        pytest.skip("legacy raw CSVs are only read from today's directory")
+    rows = gen.generate_load(40, 4, rate_hz=1, duration_s=120, start=start,
+                             chunk_seconds=60, data_dir=tmp_path, output="raw", seed=0)
+    assert rows == 40 * 120
+    files = sorted((tmp_path / "raw" / start.strftime("%Y-%m-%d")).glob("*.csv"))
+    assert [f.name for f in files] == [(start + timedelta(minutes=m)).strftime("%H-%M-%S.csv") for m in range(2)]
+    df = pd.read_csv(files[0])
+    assert df["project_id"].nunique() == 4 and len(df) == 40 * 60
+    for sensor_type, (lo, hi) in gen.SENSOR_RANGES.items():
+        values = df.loc[df["sensor_type"] == sensor_type, "value"]
+        assert values.between(lo, hi).all()
+    assert not df.duplicated(["project_id", "sensor_id", "timestamp"]).any()
+
+    # The aggregator ingests (and deletes) what the raw output writes
+    monkeypatch.setattr(aggregate_parquet, "RAW_DIR", tmp_path / "raw")
+    monkeypatch.setattr(aggregate_parquet, "SEGMENT_DIR", tmp_path / "raw" / "segments")
+    monkeypatch.setattr(aggregate_parquet, "PROCESSED_DIR", tmp_path / "processed")
+    monkeypatch.setattr(validation, "QUARANTINE_DIR", tmp_path / "quarantine")
+    monkeypatch.setattr(wide_tables, "WIDE_DIR", tmp_path / "wide")
+    aggregate_parquet.aggregate_recent_csv()
+    assert not any(f.exists() for f in files)
+    assert archive.open_dataset(tmp_path / "processed").count_rows() == rows
+
+    with pytest.raises(ValueError, match="whole-second"):     # would repeat timestamps
+        gen.generate_load(40, 4, rate_hz=2, duration_s=10, data_dir=tmp_path, output="raw")
+    with pytest.raises(ValueError, match="output='segment'"):  # backdated CSVs would never be read
+        gen.generate_load(40, 4, rate_hz=1, duration_s=120, start=datetime(2025, 6, 1, 12), data_dir=tmp_path, output="raw")
+
+def test_segment_log_roundtrip_and_aggregation(tmp_path, monkeypatch):
+    from scripts import archive, segment_log, generate_sample_data, aggregate_parquet, validation, wide_tables
+    seg_dir = tmp_path / "raw" / "segments"
+    writer = segment_log.SegmentWriter(seg_dir, max_age=3600)
+    monkeypatch.setattr(generate_sample_data, "_segment_writer", writer)
+    generate_sample_data.generate_sample()
+    generate_sample_data.generate_sample()
+    open_segment = writer.path
+    writer.close()
+
+    # A torn tail frame is ignored by readers and truncated on reopen
+    with open(open_segment, "ab") as f:
+        f.write(b"\x10\x00\x00\x00\x00\x00\x00\x00partial")
+    assert len(segment_log.read_segment(open_segment)) == 2
+    writer._open(datetime.utcnow().timestamp())
+    assert open_segment.stat().st_size == segment_log.valid_length(open_segment)
+    writer._rotate()
+    assert [p.suffix for p in seg_dir.iterdir()] == [".seg"]
+
+    monkeypatch.setattr(aggregate_parquet, "RAW_DIR", tmp_path / "raw")
+    monkeypatch.setattr(aggregate_parquet, "SEGMENT_DIR", seg_dir)
+    monkeypatch.setattr(aggregate_parquet, "PROCESSED_DIR", tmp_path / "processed")
+    monkeypatch.setattr(validation, "QUARANTINE_DIR", tmp_path / "quarantine")
+    monkeypatch.setattr(wide_tables, "WIDE_DIR", tmp_path / "wide")
+    (tmp_path / "processed").mkdir()
+    now = datetime.utcnow()
+    legacy_dir = tmp_path / "raw" / now.strftime("%Y-%m-%d")
+    legacy_dir.mkdir()
+    legacy_csv = legacy_dir / f"{now.strftime('%H-%M-%S')}.csv"
+    legacy_csv.write_text("timestamp,project_id,sensor_id,sensor_type,value,unit\n"
+                          "2025-06-05T08:41:47Z,HAWT,Irr_9,irradiance,512.5,W/m2\n")
+    aggregate_parquet.aggregate_recent_csv()
+
+    assert not list(seg_dir.iterdir()) and not legacy_csv.exists()
+    df = archive.open_dataset(tmp_path / "processed").to_table().to_pandas()
+    # Both samples may share a timestamp; the repeat is then quarantined
+    quarantined = pd.concat([pd.read_parquet(f) for f in (tmp_path / "quarantine").glob("*.parquet")] or [pd.DataFrame({"reason": []})])
+    assert set(quarantined["reason"].astype(str)) <= {"non_monotonic_timestamp"}
+    assert len(df) + len(quarantined) == 2 * len(generate_sample_data.SENSOR_CONFIG) + 1
+    assert str(df["timestamp"].dt.tz) == "UTC"
+    legacy = df[df["date"] == "2025-06-05"]
+    assert legacy["project"].tolist() == ["HAWT"] and legacy["value"].tolist() == [512.5]
+    assert (tmp_path / "processed" / "date=2025-06-05" / "project=HAWT").is_dir()
+    assert wide_tables.read_wide("HAWT", "2025-06-05", "2025-06-05 23:59:59")["Irr_9"].tolist() == [512.5]
+
+def test_aggregation_runs_in_the_same_minute_keep_their_files(tmp_path, monkeypatch):
+    from scripts import aggregate_parquet, archive, compact_parquet, generate_sample_data, segment_log, validation, wide_tables
+    seg_dir = tmp_path / "raw" / "segments"
+    monkeypatch.setattr(aggregate_parquet, "RAW_DIR", tmp_path / "raw")
+    monkeypatch.setattr(aggregate_parquet, "SEGMENT_DIR", seg_dir)
+    monkeypatch.setattr(aggregate_parquet, "PROCESSED_DIR", tmp_path / "processed")
+    monkeypatch.setattr(validation, "QUARANTINE_DIR", tmp_path / "quarantine")
+    monkeypatch.setattr(wide_tables, "WIDE_DIR", tmp_path / "wide")
+    for _ in range(2):      # e.g. a manual run next to the scheduled one
+        writer = segment_log.SegmentWriter(seg_dir)
+        monkeypatch.setattr(generate_sample_data, "_segment_writer", writer)
+        generate_sample_data.generate_sample()
+        writer.close()
+        segment_log.seal_stale_segments(seg_dir, stale_after=0)
+        aggregate_parquet.aggregate_recent_csv()
+
+    files = list(archive.iter_data_files(tmp_path / "processed"))
+    projects = {s["project_id"] for s in generate_sample_data.SENSOR_CONFIG}
+    assert len(files) == 2 * len(projects) and len({f.name for f in files}) == 2
+    assert all(compact_parquet.file_period(f)[0] == "minute" for f in files)
+    assert compact_parquet.file_period(Path("2025-06-05_08-41.parquet")) == ("minute", datetime(2025, 6, 5, 8, 41))
+
+def test_consumer_never_seals_a_live_writers_segment(tmp_path, monkeypatch):
+    from scripts import generate_sample_data, segment_log
+    seg_dir = tmp_path / "segments"
+    writer = segment_log.SegmentWriter(seg_dir, max_age=3600)
+    monkeypatch.setattr(generate_sample_data, "_segment_writer", writer)
+    generate_sample_data.generate_sample()
+    held = writer.path
+    assert segment_log.writer_alive(held)
+    assert segment_log.seal_stale_segments(seg_dir, stale_after=0) == 0 and held.exists()
+
+    # A segment sealed under the writer anyway counts as sealed; the writer moves on
+    os.replace(held, held.with_suffix(segment_log.SEALED_SUFFIX))
+    writer.max_age = 0
+    generate_sample_data.generate_sample()
+    generate_sample_data.generate_sample()
+    writer.close()
+    assert not segment_log.writer_alive(writer.path or held)
+    assert segment_log.seal_stale_segments(seg_dir, stale_after=0) == 1
+    batches = sum(len(segment_log.read_segment(p)) for p in segment_log.list_sealed_segments(seg_dir))
+    assert batches == 3
+
+def test_compaction_merges_uploaded_files(tmp_path, monkeypatch):
+    from scripts import archive, compact_parquet, generate_sample_data, upload_to_sql
+    base = tmp_path / "processed"
+    rows = generate_sample_data.generate_load(6, 2, rate_hz=0.1, duration_s=7200, start=datetime(2025, 6, 5, 8),
+                                              chunk_seconds=600, data_dir=tmp_path, output="processed", seed=1)
+    monkeypatch.setattr(upload_to_sql, "PROCESSED_DIR", base)
+    monkeypatch.setattr(upload_to_sql, "LEDGER_FILE", tmp_path / "upload_ledger.json")
+    partitions = list(archive.iter_partition_dirs(base))
+    assert len(partitions) == 2 and len(list(partitions[0].glob("*.parquet"))) == 12
+
+    not_uploaded = partitions[0] / "2025-06-05_09-10.parquet"
+    ledger = {upload_to_sql.ledger_key(f): {"rows": 0} for f in base.rglob("*.parquet") if f != not_uploaded}
+    upload_to_sql.save_ledger(ledger)
+    compact_parquet.compact_parquet(base, now=datetime(2025, 6, 5, 10, 30))
+
+    assert sorted(f.name for f in partitions[0].glob("*.parquet")) == \
+        ["2025-06-05_08.parquet"] + [f"2025-06-05_09-{m}0.parquet" for m in range(6)]
+    assert sorted(f.name for f in partitions[1].glob("*.parquet")) == ["2025-06-05_08.parquet", "2025-06-05_09.parquet"]
+    table = archive.open_dataset(base).to_table()
+    assert table.num_rows == rows
+    hourly = archive.read_readings(partitions[1] / "2025-06-05_08.parquet")
+    assert hourly.equals(archive.sort_readings(hourly))
+
+    # Compacted files are recorded by the uploader, not uploaded again
+    pending = upload_to_sql.get_pending_parquet_files(upload_to_sql.load_ledger())
+    assert [f for f in pending if not upload_to_sql.is_already_uploaded(f)] == [not_uploaded]
+
+def test_query_archive_resample_matches_pandas(tmp_path, monkeypatch):
+    from scripts import generate_sample_data, query_archive
+    generate_sample_data.generate_load(6, 2, rate_hz=0.1, duration_s=7200, start=datetime(2025, 6, 5, 8),
+                                       chunk_seconds=600, data_dir=tmp_path, output="processed", seed=1)
+    base = tmp_path / "processed"
+    raw = query_archive.readings("2025-06-05T08:15", "2025-06-05T09:45", projects=["Site_001"], base=base)
+    assert raw.num_rows == 3 * 540 and set(raw["project_id"].to_pylist()) == {"Site_001"}
+
+    monkeypatch.setattr(query_archive, "COMBINE_ROWS", 1)  # force repeated partial combines
+    resampled = query_archive.resample("30min", "2025-06-05T08:15", "2025-06-05T09:45",
+                                       projects=["Site_001"], base=base).to_pandas()
+    df = raw.to_pandas()
+    expected = df.groupby([df["sensor_id"].astype(str), df["timestamp"].dt.floor("30min")])["value"].mean()
+    assert resampled["value"].round(9).tolist() == expected.round(9).tolist()
+
+    wide = query_archive.aligned("1h", "2025-06-05T08:00", "2025-06-05T10:00", sensors=["voltage_1"],
+                                 agg="count", base=base)
+    assert list(wide.columns) == ["Site_000/voltage_1", "Site_001/voltage_1"]
+    assert wide.values.tolist() == [[360, 360], [360, 360]]
+
+def test_rollup_power_recomputes_only_touched_buckets(tmp_path):
+    import pyarrow as pa
+    from scripts import archive, rollup_power, segment_log
+
+    def write_readings(name, start, periods, volts, amps):
+        ts = pd.date_range(start, periods=periods, freq="30s", tz="UTC")
+        df = pd.concat([
+            pd.DataFrame({"timestamp": ts, "sensor_id": "Volt_1", "value": volts}),
+            pd.DataFrame({"timestamp": ts, "sensor_id": "Amp_1", "value": amps}),
+        ]).assign(project_id="P", sensor_type="x", unit="u")
+        table = pa.Table.from_pandas(df, schema=segment_log.RAW_SCHEMA, preserve_index=False)
+        path = archive.partition_dir(tmp_path, start[:10], "P") / name
+        archive.write_sorted(table, path)
+        return rollup_power.file_time_range(path)
+
+    pairs = {"P": [("Volt_1", "Amp_1")]}
+    first = write_readings("2025-06-05_08-10.parquet", "2025-06-05 08:00", 20, 10.0, 2.0)
+    late = write_readings("2025-06-05_09-00.parquet", "2025-06-05 08:05", 10, 10.0, 4.0)
+    assert first == (pd.Timestamp("2025-06-05 08:00"), pd.Timestamp("2025-06-05 08:09:30"))
+    assert rollup_power.dirty_windows([first, late]) == [(pd.Timestamp("2025-06-05"), pd.Timestamp("2025-06-06"))]
+
+    # Late readings overlap the second 5min bucket: mean of V * I from both files
+    power = rollup_power.compute_power(pd.Timestamp("2025-06-05"), pd.Timestamp("2025-06-06"), pairs, tmp_path)
+    assert len(power) == 20 and power["power"].tolist() == [20.0] * 10 + [30.0] * 10
+    five_min = rollup_power.touched_buckets(rollup_power.rollup(power, "5min"), "5min", [late])
+    assert five_min["timestamp"].tolist() == [pd.Timestamp("2025-06-05 08:05")]
+    assert five_min["power"].tolist() == [30.0]
+
+    rows = rollup_power.build_rows({"daily": rollup_power.rollup(power, "daily")}, pairs, {"P": (7, {"Volt_1": 3})})
+    assert rows == [(7, datetime(2025, 6, 5), 25.0, "daily", 3)]
+
+def test_quantile_sketches_merge_within_error_bound(tmp_path, monkeypatch):
+    import numpy as np
+    from scripts import compact_parquet, generate_sample_data, query_archive, sketches, upload_to_sql
+    values = np.random.default_rng(0).lognormal(3, 1, 20000)
+    merged = sketches.QuantileSketch().add(values[:5000]).merge(sketches.QuantileSketch().add(values[5000:]))
+    for q in (0.05, 0.5, 0.95):
+        exact = np.sort(values)[int(q * (len(values) - 1))]
+        assert abs(merged.quantile(q) - exact) <= sketches.ALPHA * exact
+    assert merged.count == 20000 and merged.histogram([0, np.inf]).tolist() == [20000]
+
+    # Sketches survive compaction and answer range queries without raw data
+    generate_sample_data.generate_load(6, 2, rate_hz=0.1, duration_s=7200, start=datetime(2025, 6, 5, 8),
+                                       chunk_seconds=600, data_dir=tmp_path, output="processed", seed=1)
+    base = tmp_path / "processed"
+    before = query_archive.quantiles([0.5], "2025-06-05T08:00", "2025-06-05T10:00", base=base)
+    monkeypatch.setattr(upload_to_sql, "PROCESSED_DIR", base)
+    monkeypatch.setattr(upload_to_sql, "LEDGER_FILE", tmp_path / "upload_ledger.json")
+    upload_to_sql.save_ledger({upload_to_sql.ledger_key(f): {} for f in upload_to_sql.iter_parquet_files()})
+    compact_parquet.compact_parquet(base, now=datetime(2025, 6, 6, 1))
+    assert len(list(base.rglob("_sketches/*.parquet"))) == 2
+    after = query_archive.quantiles([0.5], "2025-06-05T08:00", "2025-06-05T10:00", base=base)
+    assert after.equals(before) and before["count"].tolist() == [720] * 4
+
+def test_sensor_data_partition_planning():
+    from datetime import timezone
+    from scripts import partitions
+    now = datetime(2025, 11, 15, tzinfo=timezone.utc)
+    ddl = partitions.partition_ddl(datetime(2025, 6, 5), datetime(2025, 7, 1))
+    assert "PARTITION p202506 VALUES LESS THAN (1751328000)" in ddl   # 2025-07-01T00:00Z
+    assert ddl.rstrip(")").endswith("PARTITION p_future VALUES LESS THAN MAXVALUE\n")
+
+    existing = [("p202506", 1751328000), ("p202507", 1754006400), ("p_future", None)]
+    months = partitions.plan_future_partitions(existing, now, months_ahead=1)
+    assert [partitions.partition_name(m) for m in months] == ["p202508", "p202509", "p202510", "p202511", "p202512"]
+    assert partitions.plan_future_partitions([("p202601", 1769904000), ("p_future", None)], now, 1) == []
+    assert partitions.expired_partitions(existing, retention_days=120, now=now) == ["p202506"]
+
+def test_sqlite_store_upload_roundtrip(tmp_path, monkeypatch):
+    import shutil
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from scripts import storage, upload_to_sql
+    db_file = tmp_path / "edge.db"
+    shutil.copy(BASE_DIR / "db" / "energy_monitoring.db", db_file)   # original rowid layout
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(storage, "SQLITE_PATH", db_file)
+
+    with storage.open_store() as store:
+        table_sql = store.conn.execute("SELECT sql FROM sqlite_master WHERE name = 'Sensor_Data'").fetchone()[0]
+        assert "WITHOUT ROWID" in table_sql
+        assert store.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        store.conn.execute("INSERT INTO Projects (Project_Name, Source_Type) VALUES ('HAWT', 'Wind')")
+        store.conn.execute("INSERT INTO Sensors (Project_ID, Sensor_Code, Sensor_Type, Unit) VALUES (1, 'Irr_1', 'irradiance', 'W/m2')")
+        store.conn.commit()
+        sensor_map = store.fetch_sensor_ids()
+    assert sensor_map == {("HAWT", "Irr_1"): 1}
+
+    parquet_file = tmp_path / "2025-06-05_08-41.parquet"
+    pq.write_table(pa.table({
+        "timestamp": ["2025-06-05T08:41:02Z", "2025-06-05T08:41:32Z"],
+        "project_id": ["HAWT", "HAWT"],
+        "sensor_id": ["Irr_1", "Irr_1"],
+        "value": [1.0, 2.0],
+    }), parquet_file)
+    assert upload_to_sql.upload_file(parquet_file, sensor_map) == (2, 2)
+    assert upload_to_sql.upload_file(parquet_file, sensor_map) == (2, 0)
+
+    with storage.open_store() as store:
+        assert store.fetch_latest_values([1]) == {1: 2.0}
+        assert store.fetch_latest_readings([1]) == {1: (datetime(2025, 6, 5, 8, 41, 32), 2.0)}
+        row = (1, datetime(2025, 6, 5, 12), 3.5, "hourly", 1)
+        store.upsert_power_generation([row])
+        store.upsert_power_generation([row[:2] + (4.0,) + row[3:]])
+        assert store.conn.execute("SELECT Power_Generated FROM Power_Generation").fetchall() == [(4.0,)]
+        assert store.delete_readings_before(datetime(2025, 6, 5, 8, 41, 30)) == 1
+
+def test_upload_ledger_uploads_a_replaced_file_again(tmp_path, monkeypatch):
+    import shutil
+    import types
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from scripts import archive, storage, upload_to_sql, wide_tables
+    db_file = tmp_path / "edge.db"
+    shutil.copy(BASE_DIR / "db" / "energy_monitoring.db", db_file)
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(storage, "SQLITE_PATH", db_file)
+    monkeypatch.setattr(upload_to_sql, "PROCESSED_DIR", tmp_path / "processed")
+    monkeypatch.setattr(upload_to_sql, "LEDGER_FILE", tmp_path / "upload_ledger.json")
+    monkeypatch.setattr(wide_tables, "WIDE_DIR", tmp_path / "wide")
+    monkeypatch.setattr(upload_to_sql.sensor_registry, "get_registry",
+                        lambda: types.SimpleNamespace(sensor_map=lambda store: store.fetch_sensor_ids()))
+    with storage.open_store() as store:
+        store.conn.execute("INSERT INTO Projects (Project_Name, Source_Type) VALUES ('HAWT', 'Wind')")
+        store.conn.execute("INSERT INTO Sensors (Project_ID, Sensor_Code, Sensor_Type, Unit) VALUES (1, 'Irr_1', 'irradiance', 'W/m2')")
+        store.conn.commit()
+
+    path = archive.partition_dir(tmp_path / "processed", "2025-06-05", "HAWT") / "2025-06-05_08-41.parquet"
+    path.parent.mkdir(parents=True)
+    def write(stamps):
+        pq.write_table(pa.table({"timestamp": stamps, "project_id": ["HAWT"] * len(stamps),
+                                 "sensor_id": ["Irr_1"] * len(stamps), "value": [1.0] * len(stamps)}), path)
+        os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10 ** 9))
+
+    write(["2025-06-05T08:41:02Z"])
+    upload_to_sql.upload_parquet_to_sql()
+    assert upload_to_sql.get_pending_parquet_files(upload_to_sql.load_ledger()) == []
+    write(["2025-06-05T08:41:02Z", "2025-06-05T08:41:32Z"])    # replaced after its upload
+    assert upload_to_sql.get_pending_parquet_files(upload_to_sql.load_ledger()) == [path]
+    upload_to_sql.upload_parquet_to_sql()
+    assert upload_to_sql.get_pending_parquet_files(upload_to_sql.load_ledger()) == []
+    with storage.open_store() as store:
+        assert store.conn.execute("SELECT COUNT(*) FROM Sensor_Data").fetchone()[0] == 2
+
+def test_db_pool_reuses_and_replaces_connections(tmp_path, monkeypatch):
+    import pymysql
+    from scripts import db
+    (tmp_path / "db.json").write_text(json.dumps({"host": "db.local", "port": 3307}))
+    config = db.load_config(tmp_path / "db.json", environ={"DB_PORT": "3308", "DB_NAME": "site_a"})
+    assert (config["host"], config["port"], config["database"]) == ("db.local", 3308, "site_a")
+
+    class FakeConn:
+        server_status = 0
+        def __init__(self):
+            self.alive, self.closed, self.rollbacks = True, False, 0
+        def ping(self, reconnect=False):
+            if not self.alive:
+                raise pymysql.err.OperationalError(2006, "MySQL server has gone away")
+        def rollback(self):
+            self.rollbacks += 1
+        def close(self):
+            self.closed = True
+
+    opened = []
+    monkeypatch.setattr(db, "connect", lambda config=None: opened.append(FakeConn()) or opened[-1])
+    pool = db.ConnectionPool(config, size=1, health_check=0)
+    with pool.connection() as first:
+        first.server_status = db.SERVER_STATUS.SERVER_STATUS_IN_TRANS   # left a transaction open
+    assert first.rollbacks == 1
+    with pool.connection() as again:
+        assert again is first and len(opened) == 1
+        overflow = pool.get()
+        assert overflow is not first
+    pool.put(overflow)
+    assert overflow.closed                      # pool already full
+
+    first.alive = False
+    with pool.connection() as fresh:
+        assert fresh is not first and first.closed and len(opened) == 3
+
+def test_sensor_registry_caches_and_registers_from_config(tmp_path):
+    from scripts import sensor_registry, storage
+    store = storage.SQLiteStore(tmp_path / "site.db")
+    store.conn.execute("INSERT INTO Projects (Project_Name, Source_Type) VALUES ('Solar Facade', 'Solar')")
+    store.conn.execute("INSERT INTO Sensors (Project_ID, Sensor_Code, Sensor_Type, Unit) VALUES (1, 'Temp_1', 'temperature', 'C')")
+    store.conn.commit()
+    config = tmp_path / "sensor_config.json"
+    config.write_text(json.dumps([
+        {"project_id": "Solar_Facade", "sensor_id": "Temp_1", "sensor_type": "temperature", "unit": "C"},
+        {"project_id": "Solar_Facade", "sensor_id": "Volt_1", "sensor_type": "voltage", "unit": "V"},
+        {"project_id": "Roof Array", "sensor_id": "Irr_1", "sensor_type": "irradiance", "unit": "W/m2", "source_type": "Solar"},
+    ]))
+
+    registry = sensor_registry.SensorRegistry(config, tmp_path / "registry.json", ttl=300)
+    sensor_map = registry.sensor_map(store)
+    assert sensor_map[sensor_registry.normalize_key("Solar Facade", "temp_1")] == 1
+    assert len(sensor_map) == 3
+    assert store.conn.execute("SELECT COUNT(*) FROM Projects").fetchone() == (2,)
+    assert registry.project_map(store)["roof_array"][1] == {"irr_1": sensor_map[("roof_array", "irr_1")]}
+
+    calls = []
+    store.fetch_projects = lambda: calls.append("projects")
+    store.fetch_registry_version = lambda: calls.append("version") or registry.version
+    assert registry.sensor_map(store) is sensor_map and calls == []      # within the TTL: no queries
+    fresh = sensor_registry.SensorRegistry(config, tmp_path / "registry.json", ttl=300)
+    assert fresh.sensor_map(store) == sensor_map and calls == ["version"]  # cache file, version check only
+    store.close()
+
+def test_thingspeak_outbox_backfills_after_outage(tmp_path, monkeypatch, thingspeak_stub):
+    import requests
+    from datetime import timezone
+    from scripts import thingspeak_outbox, upload_thingspeak
+    url, received = thingspeak_stub
+    bulk_url = url.replace("/update", "/channels/{channel_id}/bulk_update.json")
+    monkeypatch.setattr(upload_thingspeak, "CHANNEL_STATE_FILE", tmp_path / "thingspeak_state.json")
+    outbox_file = tmp_path / "outbox.db"
+    channels = {"HAWT": {"channel_id": 42, "write_api_key": "K1", "update_interval": 15}}
+
+    with thingspeak_outbox.Outbox(outbox_file) as outbox:
+        for minute in range(3):
+            outbox.enqueue({"HAWT": {"field1": minute}}, datetime(2025, 6, 5, 8, minute, tzinfo=timezone.utc))
+        # A stale reading (naive = UTC) is not queued again under a new time
+        assert outbox.enqueue({"HAWT": {"field1": 2}}, datetime(2025, 6, 5, 8, 2)) == []
+
+    class Offline:
+        def post(self, *args, **kwargs):
+            raise requests.ConnectionError("network is unreachable")
+
+    monkeypatch.setattr(upload_thingspeak, "get_session", lambda: Offline())
+    assert upload_thingspeak.drain_outbox(channels, bulk_url, now=1000.0, outbox_path=outbox_file) == {"HAWT": False}
+    with thingspeak_outbox.Outbox(outbox_file) as outbox:
+        assert outbox.pending() == {"HAWT": 3}      # nothing lost
+
+    monkeypatch.undo()
+    monkeypatch.setattr(upload_thingspeak, "CHANNEL_STATE_FILE", tmp_path / "thingspeak_state.json")
+    assert upload_thingspeak.drain_outbox(channels, bulk_url, now=1001.0, outbox_path=outbox_file) == {"HAWT": True}
+    assert len(received) == 1 and received[0]["path"] == "/channels/42/bulk_update.json"
+    assert received[0]["write_api_key"] == "K1"
+    assert [u["field1"] for u in received[0]["updates"]] == [0, 1, 2]
+    assert received[0]["updates"][0]["created_at"] == "2025-06-05 08:00:00 +0000"
+    with thingspeak_outbox.Outbox(outbox_file) as outbox:
+        assert outbox.pending() == {}
+
+def test_validation_quarantines_bad_rows_with_reasons(tmp_path):
+    import numpy as np
+    import pyarrow as pa
+    from scripts import segment_log, validation
+    df = pd.DataFrame({
+        "timestamp": pd.to_datetime(["2025-06-05 08:00:00", "2025-06-05 08:00:30", "2025-06-05 08:00:30",
+                                     "2025-06-05 08:00:00", "2025-06-05 08:01:00", None, "2030-01-01 00:00:00"], utc=True),
+        "project_id": "HAWT",
+        "sensor_id": ["Press_1", "Press_1", "Irr_1", "Irr_1", "Irr_1", "Irr_1", "Irr_1"],
+        "sensor_type": ["pressure", "pressure", "irradiance", "irradiance", "irradiance", "irradiance", "irradiance"],
+        "value": [250000.0, 9.0e6, 500.0, 510.0, np.nan, 520.0, 530.0],
+        "unit": "u",
+    })
+    table = pa.Table.from_pandas(df, schema=segment_log.RAW_SCHEMA, preserve_index=False)
+    limits = validation.load_limits()
+    clean, bad = validation.validate(table, limits, now=datetime(2025, 6, 5, 9))
+
+    assert clean["value"].to_pylist() == [250000.0, 500.0]
+    assert bad["reason"].to_pylist() == [
+        "out_of_range", "non_monotonic_timestamp", "nan_value", "bad_timestamp", "bad_timestamp"
+    ]
+    assert validation.count_reasons(bad)["bad_timestamp"] == 2
+    path = validation.write_quarantine([bad], "2025-06-05_09-00.parquet", tmp_path)
+    assert pd.read_parquet(path)["reason"].astype(str).tolist()[0] == "out_of_range"
+
+    assert validation.validate(clean, limits, now=datetime(2025, 6, 5, 9)) == (clean, None)
+
+    # Later tables of the same run are checked against the readings seen before
+    last_seen = {}
+    validation.validate(table, limits, now=datetime(2025, 6, 5, 9), last_seen=last_seen)
+    later = table.slice(2, 2).set_column(0, "timestamp", pa.array(
+        pd.to_datetime(["2025-06-05 08:00:15", "2025-06-05 08:00:45"], utc=True), segment_log.RAW_SCHEMA.field("timestamp").type))
+    clean, bad = validation.validate(later, limits, now=datetime(2025, 6, 5, 9), last_seen=last_seen)
+    assert clean["value"].to_pylist() == [510.0] and bad["reason"].to_pylist() == ["non_monotonic_timestamp"]
+
+def test_benchmark_runs_hermetically_and_flags_regressions(tmp_path):
+    from scripts import benchmark
+    before = sorted(p.name for p in PROC_DIR.rglob("*"))
+    results = benchmark.run_scale({"sensors": 8, "sites": 2, "hours": 0.5}, tmp_path)
+    assert sorted(p.name for p in PROC_DIR.rglob("*")) == before      # data/ untouched
+    assert list(results) == benchmark.STAGES
+    assert results["generate_load"]["rows"] == 8 * 60
+    assert results["aggregate_recent_csv"]["rows"] == results["upload_parquet_to_sql"]["rows"] == 8 * 60
+    assert results["upload_to_thingspeak"]["requests"] == 2          # one bulk, one single update
+
+    document = {"scales": {"tiny": results}}
+    assert benchmark.compare(document, document) == []
+    slower = {"scales": {"tiny": dict(results, aggregate_recent_csv=dict(
+        results["aggregate_recent_csv"], seconds=results["aggregate_recent_csv"]["seconds"] * 3 + 1))}}
+    assert [r.split(":")[0] for r in benchmark.compare(slower, document)] == ["tiny/aggregate_recent_csv"]
+
+def test_profiling_writes_and_rotates_profiles(tmp_path, monkeypatch):
+    from scripts import generate_sample_data, profiling, segment_log
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path / "profiles")
+    monkeypatch.setattr(profiling, "PROFILE_KEEP", 2)
+    monkeypatch.setattr(generate_sample_data, "_segment_writer", segment_log.SegmentWriter(tmp_path / "segments"))
+    assert profiling.span("generate_sample", "write") is profiling.span("upload_to_sql", "db")   # shared no-op
+    try:
+        profiling.configure("all")
+        for _ in range(3):
+            generate_sample_data.generate_sample()
+    finally:
+        profiling.configure("")
+        generate_sample_data._segment_writer.close()
+
+    files = sorted(p.name for p in (tmp_path / "profiles").iterdir())
+    assert len(files) == 2 * 4        # newest two runs, four modes each
+    suffixes = {name.split(".", 1)[1] for name in files}
+    assert suffixes == {"pstats", "collapsed", "tracemalloc.txt", "spans.json"}
+    spans = json.loads(max((tmp_path / "profiles").glob("*.spans.json")).read_text())
+    assert spans["stage"] == "generate_sample" and set(spans["phases"]) == {"transform", "write"}
+    with pytest.raises(ValueError):
+        profiling.configure("perf")
+
+def test_compact_records_roundtrip_through_raw_layout():
+    import numpy as np
+    import pyarrow as pa
+    from scripts import generate_sample_data, records, segment_log
+    config = generate_sample_data.build_load_config(6, 2)
+    catalog = records.SensorCatalog.from_config(config)
+    readings = generate_sample_data.simulate_chunk(config, np.arange(1749110400, 1749110400 + 300, 30),
+                                                   np.random.default_rng(1))
+    assert readings.nbytes / len(readings) == 16
+
+    batch = records.to_record_batch(readings, catalog)
+    assert batch.schema.equals(segment_log.RAW_SCHEMA)
+    assert len(batch["project_id"].dictionary) == 2             # side dictionary, not a string per row
+    frame = batch.to_pandas().astype({c: str for c in records.META_COLUMNS})
+    assert frame.memory_usage(deep=True).sum() / len(frame) > 4 * 16
+
+    back, back_catalog = records.from_table(batch)
+    assert back_catalog.names() == catalog.names()
+    assert (back.keys == readings.keys).all() and (back.timestamps == readings.timestamps).all()
+    assert (back.values == readings.values).all()
+
+    legacy = pa.table({"timestamp": ["2025-06-05T08:41:02Z", "bad"], "project_id": ["HAWT", "HAWT"],
+                       "sensor_id": ["Irr_1", "Irr_1"], "value": [1.5, None]})
+    old, _ = records.from_table(legacy)
+    assert old.timestamps.tolist() == [1749112862, records.NO_TIMESTAMP]
+    assert np.isnan(old.values[1])
+
+def test_wide_tables_merge_incrementally_and_sync_to_sql(tmp_path, monkeypatch):
+    import pyarrow as pa
+    from scripts import storage, wide_tables
+
+    def readings(rows):
+        stamps, projects, sensors, values = zip(*rows)
+        return pa.table({"timestamp": pa.array([datetime.fromisoformat(t) for t in stamps], pa.timestamp("s", tz="UTC")),
+                         "project_id": list(projects), "sensor_id": list(sensors), "value": list(values)})
+
+    base = tmp_path / "wide"
+    buffer = wide_tables.WideBuffer(interval=30)
+    buffer.add(readings([("2025-06-05 08:00:05", "HAWT", "Irr_1", 1.0), ("2025-06-05 08:00:20", "HAWT", "Irr_1", 2.0),
+                         ("2025-06-05 08:00:10", "HAWT", "T-1", 25.0), ("2025-06-05 08:00:40", "Solar PV", "V1", 12.0)]))
+    touched = buffer.write(base)
+    wide_tables.queue_sql_sync(touched, base)
+    assert [t[:2] for t in touched] == [("HAWT", "2025-06-05"), ("Solar PV", "2025-06-05")]
+
+    # A later run overwrites its own cells, adds a column and keeps the rest
+    buffer.add(readings([("2025-06-05 08:00:25", "HAWT", "T-1", 26.0), ("2025-06-05 08:00:35", "HAWT", "Wind", 4.0)]))
+    wide_tables.queue_sql_sync(buffer.write(base), base)
+    wide = wide_tables.read_wide("HAWT", base=base)
+    assert list(wide.columns) == ["Irr_1", "T-1", "Wind"]
+    assert wide.loc["2025-06-05 08:00:00"].tolist()[:2] == [2.0, 26.0]     # last reading of the bucket wins
+    assert wide.loc["2025-06-05 08:00:30", "Wind"] == 4.0
+    assert wide_tables.latest_values(base)[("hawt", "irr_1")] == 2.0
+    assert wide_tables.latest_readings(base)[("hawt", "wind")] == (datetime(2025, 6, 5, 8, 0, 30), 4.0)
+    assert wide_tables.pending_sql_sync(base) == [["HAWT", "2025-06-05", "2025-06-05T08:00:00", "2025-06-05T08:00:30"],
+                                                  ["Solar PV", "2025-06-05", "2025-06-05T08:00:30", "2025-06-05T08:00:30"]]
+
+    with storage.SQLiteStore(tmp_path / "wide.db") as store:
+        store.ensure_wide_table("Wide_HAWT", ["Irr_1"])
+        store.upsert_wide_rows("Wide_HAWT", ["Irr_1"], [(datetime(2025, 6, 5, 8, 0, 30), 9.0)])
+        assert wide_tables.sync_sql(store, base) == 3
+        rows = store.conn.execute('SELECT * FROM Wide_HAWT ORDER BY Timestamp').fetchall()
+        assert rows == [("2025-06-05 08:00:00", 2.0, 26.0, None), ("2025-06-05 08:00:30", 9.0, None, 4.0)]
+        assert store.conn.execute('SELECT * FROM Wide_Solar_PV').fetchall() == [("2025-06-05 08:00:30", 12.0)]
+        assert wide_tables.pending_sql_sync(base) == []
+
+        # Ids differing only in punctuation or case get their own columns;
+        # a range queued while a sync runs stays queued for the next one
+        buffer.add(readings([("2025-06-05 08:01:00", "HAWT", "T_1", 7.0), ("2025-06-05 08:01:00", "HAWT", "irr_1", 8.0)]))
+        late = [("Solar PV", "2025-06-05", "2025-06-05T08:05:00", "2025-06-05T08:05:00")]
+        upsert = store.upsert_wide_rows
+        monkeypatch.setattr(store, "upsert_wide_rows",
+                            lambda *args: (upsert(*args), wide_tables.queue_sql_sync(late, base)))
+        wide_tables.queue_sql_sync(buffer.write(base), base)
+        assert wide_tables.sync_sql(store, base) == 1
+        columns = wide_tables.sql_columns("Wide_HAWT", ["Irr_1", "T-1", "T_1", "irr_1"], base)
+        assert columns[:2] == ["Irr_1", "T_1"] and len({c.casefold() for c in columns}) == 4
+        row = store.conn.execute(f'SELECT "{columns[2]}", "{columns[3]}" FROM Wide_HAWT '
+                                 "WHERE Timestamp = '2025-06-05 08:01:00'").fetchone()
+        assert row == (7.0, 8.0)
+    assert wide_tables.pending_sql_sync(base) == [list(late[0])]
+
+def test_shards_split_projects_and_run_the_pipeline_per_shard(tmp_path, monkeypatch):
+    from scripts import (aggregate_parquet, archive, generate_sample_data, metrics, segment_log, sensor_registry,
+                         shards, storage, upload_to_sql, validation, wide_tables)
+    config = generate_sample_data.build_load_config(12, 6)
+    (tmp_path / "sensor_config.json").write_text(json.dumps(config))
+    assert shards.shard_of("Site 3", 4) == shards.shard_of(" site_3 ", 4)      # normalized, not salted
+    assignment = shards.assignments(config, 2)
+    assert sorted(p for projects in assignment.values() for p in projects) == sorted({s["project_id"] for s in config})
+
+    # configure() rebinds module globals; register them with monkeypatch so they are restored
+    for module, names in [(generate_sample_data, ["SENSOR_CONFIG", "SENSOR_CATALOG", "RAW_DATA_DIR", "_segment_writer"]),
+                          (aggregate_parquet, ["RAW_DIR", "SEGMENT_DIR"]), (validation, ["QUARANTINE_DIR"]),
+                          (wide_tables, ["PENDING_FILE_NAME"]), (upload_to_sql, ["LEDGER_FILE", "PROJECT_FILTER"]),
+                          (sensor_registry, ["_registry"]), (metrics, ["_constant_labels"]), (shards, ["_current"])]:
+        for name in names:
+            monkeypatch.setattr(module, name, getattr(module, name))
+    monkeypatch.setattr(shards, "CONFIG_PATH", tmp_path / "sensor_config.json")
+    monkeypatch.setattr(shards, "LOG_DIR", tmp_path)
+    monkeypatch.setattr(metrics, "METRICS_DIR", tmp_path / "metrics")
+    monkeypatch.setattr(aggregate_parquet, "PROCESSED_DIR", tmp_path / "data" / "processed")
+    monkeypatch.setattr(upload_to_sql, "PROCESSED_DIR", tmp_path / "data" / "processed")
+    monkeypatch.setattr(wide_tables, "WIDE_DIR", tmp_path / "data" / "wide")
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(storage, "SQLITE_PATH", tmp_path / "pipeline.db")
+    root = tmp_path / "data" / "shards"
+
+    for shard in range(2):
+        shards.configure(shard, 2, root)
+        shards.run_job("generate_sample")
+        generate_sample_data.get_segment_writer().close()
+        segment_log.seal_stale_segments(aggregate_parquet.SEGMENT_DIR, stale_after=0)
+        shards.run_job("aggregate_recent_csv")
+        shards.run_job("upload_parquet_to_sql")
+        ledger = json.loads((root / f"shard-{shard}" / "upload_ledger.json").read_text())
+        assert {archive.partition_project(Path(k)) for k in ledger} == set(assignment[shard])
+        progress = shards.read_progress(shard, root)
+        assert set(progress) == set(shards.SHARDED_JOBS) and all(e["ok"] for e in progress.values())
+
+    projects = {archive.partition_project(f) for f in archive.iter_data_files(tmp_path / "data" / "processed")}
+    assert projects == {s["project_id"] for s in config}
+    with storage.open_store() as store:
+        assert store.conn.execute("SELECT COUNT(*) FROM Sensor_Data").fetchone()[0] == len(config)
+        assert store.conn.execute("SELECT COUNT(DISTINCT Project_Name) FROM Projects").fetchone()[0] == 6
+    assert 'shard="1"' in (tmp_path / "metrics" / "shard_1.prom").read_text()